@@ -1,5 +1,6 @@
 import requests
 
+from common.services.distance import get_distances
 from routes.services.views import *
 
 def find_bike_stations_nearby(location: tuple[float, float], radius: int = 200, limit: int = 5):
@@ -67,12 +68,13 @@ def find_bike_stations_nearby(location: tuple[float, float], radius: int = 200,
         except:
             continue
 
-        station_location = (station['lat'], station['lon'])
-        route = calculate_simple_distance([location, station_location])
-        station['distance'] = route
-
         stations.append(station)
 
+    if stations:
+        distances = get_distances(location, [(station['lat'], station['lon']) for station in stations]) / 1000.0
+        for station, distance in zip(stations, distances):
+            station['distance'] = float(distance)
+
     stations = sorted(stations,key=lambda x: x['distance'])[:limit]
 
     for station in stations:
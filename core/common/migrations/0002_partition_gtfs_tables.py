@@ -0,0 +1,355 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+GTFS_TABLES = [
+    'common_CalendarDates',
+    'common_Routes',
+    'common_Shapes',
+    'common_ShapeSequences',
+    'common_Stops',
+    'common_Trips',
+    'common_StopTimes',
+    'common_Frequencies',
+    'common_Transfers',
+]
+
+
+def get_index_definitions(cursor, table: str) -> list[tuple[str, str, str, list[str]]]:
+    """Name, definition, constraint type and columns of every index of the table"""
+    cursor.execute('''
+        SELECT
+            c.relname,
+            pg_get_indexdef(i.indexrelid),
+            con.contype,
+            array(
+                SELECT a.attname FROM unnest(i.indkey) WITH ORDINALITY k(attnum, ord)
+                JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                ORDER BY k.ord
+            )
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        LEFT JOIN pg_constraint con ON con.conindid = i.indexrelid AND con.conrelid = i.indrelid
+        WHERE i.indrelid = %s::regclass;
+    ''', [f'"{table}"'])
+    return cursor.fetchall()
+
+
+def partition_table(cursor, table: str) -> None:
+    """
+    Recreates the table as a parent partitioned by carrier_id. 
+    Primary keys and unique constraints get carrier_id as their last column.
+    """
+    old_table = f'{table}_unpartitioned'
+    cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{old_table}";')
+    indexes = get_index_definitions(cursor, old_table)
+
+    for name, _, constraint_type, _ in indexes:
+        if constraint_type:
+            cursor.execute(f'ALTER TABLE "{old_table}" DROP CONSTRAINT "{name}";')
+        else:
+            cursor.execute(f'DROP INDEX "{name}";')
+
+    cursor.execute(f'''
+        CREATE TABLE "{table}" (LIKE "{old_table}" INCLUDING DEFAULTS) 
+        PARTITION BY LIST (carrier_id);
+    ''')
+
+    for name, definition, constraint_type, columns in indexes:
+        if constraint_type in ('p', 'u'):
+            columns = [c for c in columns if c != 'carrier_id'] + ['carrier_id']
+            kind = 'PRIMARY KEY' if constraint_type == 'p' else 'UNIQUE'
+            cursor.execute(f'''
+                ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {kind} ({', '.join(columns)});
+            ''')
+        else:
+            cursor.execute(definition.replace(f'"{old_table}"', f'"{table}"'))
+
+
+def partition_gtfs_tables(apps, schema_editor):
+    """
+    Every carrier gets its own partition in the live and in the staging tables, 
+    so an update swaps only the partitions of the carrier that changed. 
+    The staging tables are a scratch area and are emptied, 
+    the staging carriers are recreated with the ids of the live ones.
+    """
+    Carrier = apps.get_model('common', 'Carrier')
+    CarrierStaging = apps.get_model('common', 'CarrierStaging')
+    carriers = list(Carrier.objects.values_list('id', 'carrier_code', 'carrier_name'))
+
+    with schema_editor.connection.cursor() as cursor:
+        staging_tables = ', '.join(f'"{table}_Staging"' for table in GTFS_TABLES)
+        cursor.execute(f'TRUNCATE "common_Carriers_Staging", {staging_tables} CASCADE;')
+
+    CarrierStaging.objects.bulk_create(
+        CarrierStaging(id=id, carrier_code=code, carrier_name=name) for id, code, name in carriers
+    )
+
+    with schema_editor.connection.cursor() as cursor:
+        for live_table in GTFS_TABLES:
+            staging_table = f'{live_table}_Staging'
+
+            for table in (live_table, staging_table):
+                partition_table(cursor, table)
+
+                for carrier_id, _, _ in carriers:
+                    cursor.execute(f'''
+                        CREATE TABLE "{table}_{carrier_id}" PARTITION OF "{table}" 
+                        (CONSTRAINT "{table}_{carrier_id}_check" CHECK (carrier_id = {carrier_id}))
+                        FOR VALUES IN ({carrier_id});
+                    ''')
+
+            columns = [
+                column.name for column in 
+                schema_editor.connection.introspection.get_table_description(cursor, live_table)
+            ]
+            quoted_columns = ', '.join(f'"{column}"' for column in columns)
+            cursor.execute(f'''
+                INSERT INTO "{live_table}" ({quoted_columns}) 
+                SELECT {quoted_columns} FROM "{live_table}_unpartitioned";
+            ''')
+            cursor.execute(f'DROP TABLE "{live_table}_unpartitioned", "{staging_table}_unpartitioned";')
+
+            if 'id' in columns:
+                # Rows move between the live and the staging tables, so both draw ids from one sequence
+                sequence = f'{live_table}_id_seq'
+                cursor.execute(f'CREATE SEQUENCE "{sequence}" OWNED BY "{live_table}".id;')
+                cursor.execute(f'''SELECT setval('"{sequence}"', COALESCE(MAX(id), 0) + 1, false) FROM "{live_table}";''')
+
+                for table in (live_table, staging_table):
+                    cursor.execute(f'''ALTER TABLE "{table}" ALTER COLUMN id SET DEFAULT nextval('"{sequence}"');''')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='stoptime',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stoptimestaging',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='trip',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tripstaging',
+            unique_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='calendardate',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrier'),
+        ),
+        migrations.AlterField(
+            model_name='calendardatestaging',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrierstaging'),
+        ),
+        migrations.AlterField(
+            model_name='frequence',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrier'),
+        ),
+        migrations.AlterField(
+            model_name='frequence',
+            name='trip',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.trip'),
+        ),
+        migrations.AlterField(
+            model_name='frequencestaging',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrierstaging'),
+        ),
+        migrations.AlterField(
+            model_name='frequencestaging',
+            name='trip',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.tripstaging'),
+        ),
+        migrations.AlterField(
+            model_name='route',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrier'),
+        ),
+        migrations.AlterField(
+            model_name='routestaging',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrierstaging'),
+        ),
+        migrations.AlterField(
+            model_name='shape',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrier'),
+        ),
+        migrations.AlterField(
+            model_name='shapesequence',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrier'),
+        ),
+        migrations.AlterField(
+            model_name='shapesequence',
+            name='shape',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.shape'),
+        ),
+        migrations.AlterField(
+            model_name='shapesequencestaging',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrierstaging'),
+        ),
+        migrations.AlterField(
+            model_name='shapesequencestaging',
+            name='shape',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.shapestaging'),
+        ),
+        migrations.AlterField(
+            model_name='shapestaging',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrierstaging'),
+        ),
+        migrations.AlterField(
+            model_name='stop',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrier'),
+        ),
+        migrations.AlterField(
+            model_name='stopstaging',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrierstaging'),
+        ),
+        migrations.AlterField(
+            model_name='stoptime',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrier'),
+        ),
+        migrations.AlterField(
+            model_name='stoptime',
+            name='stop',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.stop'),
+        ),
+        migrations.AlterField(
+            model_name='stoptime',
+            name='trip',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.trip'),
+        ),
+        migrations.AlterField(
+            model_name='stoptimestaging',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrierstaging'),
+        ),
+        migrations.AlterField(
+            model_name='stoptimestaging',
+            name='stop',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.stopstaging'),
+        ),
+        migrations.AlterField(
+            model_name='stoptimestaging',
+            name='trip',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.tripstaging'),
+        ),
+        migrations.AlterField(
+            model_name='transfer',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrier'),
+        ),
+        migrations.AlterField(
+            model_name='transfer',
+            name='from_stop',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='transfers_from', to='common.stop'),
+        ),
+        migrations.AlterField(
+            model_name='transfer',
+            name='from_trip',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='transfers_from', to='common.trip'),
+        ),
+        migrations.AlterField(
+            model_name='transfer',
+            name='to_stop',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='transfers_to', to='common.stop'),
+        ),
+        migrations.AlterField(
+            model_name='transfer',
+            name='to_trip',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='transfers_to', to='common.trip'),
+        ),
+        migrations.AlterField(
+            model_name='transferstaging',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrierstaging'),
+        ),
+        migrations.AlterField(
+            model_name='transferstaging',
+            name='from_stop',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='transfers_staging_from', to='common.stopstaging'),
+        ),
+        migrations.AlterField(
+            model_name='transferstaging',
+            name='from_trip',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='transfers_staging_from', to='common.tripstaging'),
+        ),
+        migrations.AlterField(
+            model_name='transferstaging',
+            name='to_stop',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='transfers_staging_to', to='common.stopstaging'),
+        ),
+        migrations.AlterField(
+            model_name='transferstaging',
+            name='to_trip',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='transfers_staging_to', to='common.tripstaging'),
+        ),
+        migrations.AlterField(
+            model_name='trip',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrier'),
+        ),
+        migrations.AlterField(
+            model_name='trip',
+            name='route',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.route'),
+        ),
+        migrations.AlterField(
+            model_name='trip',
+            name='shape',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.shape'),
+        ),
+        migrations.AlterField(
+            model_name='tripstaging',
+            name='carrier',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrierstaging'),
+        ),
+        migrations.AlterField(
+            model_name='tripstaging',
+            name='route',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.routestaging'),
+        ),
+        migrations.AlterField(
+            model_name='tripstaging',
+            name='shape',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.shapestaging'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stoptime',
+            unique_together={('trip', 'stop_sequence', 'carrier')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='stoptimestaging',
+            unique_together={('trip', 'stop_sequence', 'carrier')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='trip',
+            unique_together={('trip_id', 'route', 'carrier')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='tripstaging',
+            unique_together={('trip_id', 'route', 'carrier')},
+        ),
+        migrations.RunPython(partition_gtfs_tables),
+    ]
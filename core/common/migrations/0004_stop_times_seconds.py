@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:34
+
+import django.db.models.expressions
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0002_partition_gtfs_tables'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stoptime',
+            name='arrival_seconds',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Cast(models.Func(models.F('arrival_time'), models.Value(':'), models.Value(1), function='split_part'), models.IntegerField()), '*', models.Value(3600)), '+', django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Cast(models.Func(models.F('arrival_time'), models.Value(':'), models.Value(2), function='split_part'), models.IntegerField()), '*', models.Value(60))), '+', django.db.models.functions.comparison.Cast(models.Func(models.F('arrival_time'), models.Value(':'), models.Value(3), function='split_part'), models.IntegerField())), output_field=models.IntegerField()),
+        ),
+        migrations.AddField(
+            model_name='stoptime',
+            name='departure_seconds',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Cast(models.Func(models.F('departure_time'), models.Value(':'), models.Value(1), function='split_part'), models.IntegerField()), '*', models.Value(3600)), '+', django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Cast(models.Func(models.F('departure_time'), models.Value(':'), models.Value(2), function='split_part'), models.IntegerField()), '*', models.Value(60))), '+', django.db.models.functions.comparison.Cast(models.Func(models.F('departure_time'), models.Value(':'), models.Value(3), function='split_part'), models.IntegerField())), output_field=models.IntegerField()),
+        ),
+        migrations.AddField(
+            model_name='stoptimestaging',
+            name='arrival_seconds',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Cast(models.Func(models.F('arrival_time'), models.Value(':'), models.Value(1), function='split_part'), models.IntegerField()), '*', models.Value(3600)), '+', django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Cast(models.Func(models.F('arrival_time'), models.Value(':'), models.Value(2), function='split_part'), models.IntegerField()), '*', models.Value(60))), '+', django.db.models.functions.comparison.Cast(models.Func(models.F('arrival_time'), models.Value(':'), models.Value(3), function='split_part'), models.IntegerField())), output_field=models.IntegerField()),
+        ),
+        migrations.AddField(
+            model_name='stoptimestaging',
+            name='departure_seconds',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Cast(models.Func(models.F('departure_time'), models.Value(':'), models.Value(1), function='split_part'), models.IntegerField()), '*', models.Value(3600)), '+', django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Cast(models.Func(models.F('departure_time'), models.Value(':'), models.Value(2), function='split_part'), models.IntegerField()), '*', models.Value(60))), '+', django.db.models.functions.comparison.Cast(models.Func(models.F('departure_time'), models.Value(':'), models.Value(3), function='split_part'), models.IntegerField())), output_field=models.IntegerField()),
+        ),
+        migrations.AddIndex(
+            model_name='stoptime',
+            index=models.Index(fields=['stop', 'arrival_seconds'], include=('trip', 'arrival_time', 'pickup_type'), name='stop_times_board_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stoptime',
+            index=models.Index(fields=['trip'], include=('arrival_seconds', 'departure_seconds'), name='stop_times_trip_times_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stoptimestaging',
+            index=models.Index(fields=['stop', 'arrival_seconds'], include=('trip', 'arrival_time', 'pickup_type'), name='stop_times_stg_board_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stoptimestaging',
+            index=models.Index(fields=['trip'], include=('arrival_seconds', 'departure_seconds'), name='stop_times_stg_trip_times_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:38
+
+import django.db.models.functions.comparison
+import django.db.models.lookups
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0004_stop_times_seconds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='day_type',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(django.db.models.lookups.Regex(models.Func(models.F('trip_id'), models.Value(':'), models.Value(2), function='split_part', output_field=models.CharField()), '^\\d{4}-\\d{2}-\\d{2}$'), then=models.Func(models.F('trip_id'), models.Value(':'), models.Value(3), function='split_part', output_field=models.CharField())), default=None), output_field=models.CharField(max_length=8, null=True)),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='service_date',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(django.db.models.lookups.Regex(models.Func(models.F('trip_id'), models.Value(':'), models.Value(2), function='split_part', output_field=models.CharField()), '^\\d{4}-\\d{2}-\\d{2}$'), then=models.Func(django.db.models.functions.comparison.Cast(models.Func(models.Func(models.F('trip_id'), models.Value(':'), models.Value(2), function='split_part', output_field=models.CharField()), models.Value('-'), models.Value(1), function='split_part', output_field=models.CharField()), models.IntegerField()), django.db.models.functions.comparison.Cast(models.Func(models.Func(models.F('trip_id'), models.Value(':'), models.Value(2), function='split_part', output_field=models.CharField()), models.Value('-'), models.Value(2), function='split_part', output_field=models.CharField()), models.IntegerField()), django.db.models.functions.comparison.Cast(models.Func(models.Func(models.F('trip_id'), models.Value(':'), models.Value(2), function='split_part', output_field=models.CharField()), models.Value('-'), models.Value(3), function='split_part', output_field=models.CharField()), models.IntegerField()), function='make_date', output_field=models.DateField())), default=None), output_field=models.DateField(null=True)),
+        ),
+        migrations.AddField(
+            model_name='tripstaging',
+            name='day_type',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(django.db.models.lookups.Regex(models.Func(models.F('trip_id'), models.Value(':'), models.Value(2), function='split_part', output_field=models.CharField()), '^\\d{4}-\\d{2}-\\d{2}$'), then=models.Func(models.F('trip_id'), models.Value(':'), models.Value(3), function='split_part', output_field=models.CharField())), default=None), output_field=models.CharField(max_length=8, null=True)),
+        ),
+        migrations.AddField(
+            model_name='tripstaging',
+            name='service_date',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(django.db.models.lookups.Regex(models.Func(models.F('trip_id'), models.Value(':'), models.Value(2), function='split_part', output_field=models.CharField()), '^\\d{4}-\\d{2}-\\d{2}$'), then=models.Func(django.db.models.functions.comparison.Cast(models.Func(models.Func(models.F('trip_id'), models.Value(':'), models.Value(2), function='split_part', output_field=models.CharField()), models.Value('-'), models.Value(1), function='split_part', output_field=models.CharField()), models.IntegerField()), django.db.models.functions.comparison.Cast(models.Func(models.Func(models.F('trip_id'), models.Value(':'), models.Value(2), function='split_part', output_field=models.CharField()), models.Value('-'), models.Value(2), function='split_part', output_field=models.CharField()), models.IntegerField()), django.db.models.functions.comparison.Cast(models.Func(models.Func(models.F('trip_id'), models.Value(':'), models.Value(2), function='split_part', output_field=models.CharField()), models.Value('-'), models.Value(3), function='split_part', output_field=models.CharField()), models.IntegerField()), function='make_date', output_field=models.DateField())), default=None), output_field=models.DateField(null=True)),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['service_date', 'day_type'], name='trips_service_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripstaging',
+            index=models.Index(fields=['service_date', 'day_type'], name='trips_stg_service_day_idx'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:40
+
+from importlib import import_module
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+partition_table = import_module('common.migrations.0002_partition_gtfs_tables').partition_table
+
+
+def partition_service_days(apps, schema_editor):
+    """
+    Partitions the service days like the other GTFS tables (see migration 0002) 
+    and materializes them from the live calendar dates, the staging table starts empty.
+    """
+    Carrier = apps.get_model('common', 'Carrier')
+    carrier_ids = list(Carrier.objects.values_list('id', flat=True))
+    live_table = 'common_ServiceDays'
+
+    with schema_editor.connection.cursor() as cursor:
+        for table in (live_table, f'{live_table}_Staging'):
+            partition_table(cursor, table)
+            cursor.execute(f'DROP TABLE "{table}_unpartitioned";')
+
+            for carrier_id in carrier_ids:
+                cursor.execute(f'''
+                    CREATE TABLE "{table}_{carrier_id}" PARTITION OF "{table}" 
+                    (CONSTRAINT "{table}_{carrier_id}_check" CHECK (carrier_id = {carrier_id}))
+                    FOR VALUES IN ({carrier_id});
+                ''')
+
+        sequence = f'{live_table}_id_seq'
+        cursor.execute(f'CREATE SEQUENCE "{sequence}" OWNED BY "{live_table}".id;')
+
+        for table in (live_table, f'{live_table}_Staging'):
+            cursor.execute(f'''ALTER TABLE "{table}" ALTER COLUMN id SET DEFAULT nextval('"{sequence}"');''')
+
+        cursor.execute(f'''
+            INSERT INTO "{live_table}" (date, service_id, carrier_id)
+            SELECT date, service_id, carrier_id FROM "common_CalendarDates"
+            GROUP BY date, service_id, carrier_id
+            HAVING bool_and(exception_type = 1);
+        ''')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0005_trips_service_day'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('service_id', models.CharField(max_length=32)),
+                ('carrier', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrier')),
+            ],
+            options={
+                'db_table': 'common_ServiceDays',
+                'unique_together': {('date', 'service_id', 'carrier')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ServiceDayStaging',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('service_id', models.CharField(max_length=32)),
+                ('carrier', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='common.carrierstaging')),
+            ],
+            options={
+                'db_table': 'common_ServiceDays_Staging',
+                'unique_together': {('date', 'service_id', 'carrier')},
+            },
+        ),
+        migrations.RunPython(partition_service_days),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:28
+
+from django.db import migrations
+
+
+def make_stop_times_buffer(apps, schema_editor):
+    """
+    Stop times are stored as TripStops and patterns (see trips migration 0004), 
+    the staging stop times are only a buffer they are built from, emptied after every import.
+    The id sequence was shared with (and owned by) the dropped live table, the buffer gets its own.
+    """
+    table = 'common_StopTimes_Staging'
+    sequence = f'{table}_id_seq'
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'CREATE SEQUENCE IF NOT EXISTS "{sequence}" OWNED BY "{table}".id;')
+        cursor.execute(f'''ALTER TABLE "{table}" ALTER COLUMN id SET DEFAULT nextval('"{sequence}"');''')
+
+        cursor.execute(f'''
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = '"{table}"'::regclass;
+        ''')
+
+        for partition, in cursor.fetchall():
+            cursor.execute(f'TRUNCATE "{partition}";')
+            cursor.execute(f'ALTER TABLE "{partition}" SET UNLOGGED;')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0006_service_days'),
+        ('trips', '0004_trip_patterns'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='stoptimestaging',
+            name='stop_times_stg_board_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='stoptimestaging',
+            name='stop_times_stg_trip_times_idx',
+        ),
+        migrations.DeleteModel(
+            name='StopTime',
+        ),
+        migrations.RunPython(make_stop_times_buffer),
+    ]
@@ -1,4 +1,46 @@
 from django.db import models
+from django.db.models.functions import Cast
+from django.db.models.lookups import Regex
+
+
+def get_gtfs_seconds(field: str) -> models.Expression:
+    """Seconds since the midnight of the service day of a GTFS time, which can be past 24:00:00"""
+    hours, minutes, seconds = (
+        Cast(models.Func(models.F(field), models.Value(':'), models.Value(part), function='split_part'),
+             models.IntegerField())
+        for part in (1, 2, 3)
+    )
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def split_part(expression, delimiter: str, part: int) -> models.Func:
+    return models.Func(expression, models.Value(delimiter), models.Value(part), function='split_part',
+                       output_field=models.CharField())
+
+
+# WTP trip_ids are composite, '<carrier>:<service date>:<day type>:...', e.g. 'WTP:2025-11-04:PcS:100:0:0500'
+COMPOSITE_TRIP_ID_DATE_REGEX = r'^\d{4}-\d{2}-\d{2}$'
+
+
+def get_composite_trip_id_value(output: models.Expression) -> models.Expression:
+    """`output` for the trip_ids whose second part is a date, NULL for the trip_ids of other carriers"""
+    return models.Case(
+        models.When(Regex(split_part(models.F('trip_id'), ':', 2), COMPOSITE_TRIP_ID_DATE_REGEX), then=output),
+        default=None,
+    )
+
+
+def get_trip_service_date() -> models.Expression:
+    year, month, day = (
+        Cast(split_part(split_part(models.F('trip_id'), ':', 2), '-', part), models.IntegerField())
+        for part in (1, 2, 3)
+    )
+    return get_composite_trip_id_value(models.Func(year, month, day, function='make_date', output_field=models.DateField()))
+
+
+def get_trip_day_type() -> models.Expression:
+    return get_composite_trip_id_value(split_part(models.F('trip_id'), ':', 3))
+
 
 class AbstractCarrier(models.Model):
     carrier_name = models.CharField(max_length=64, unique=True)
@@ -19,6 +61,15 @@ class AbstractCalendarDate(models.Model):
     class Meta:
         abstract = True
 
+
+class AbstractServiceDay(models.Model):
+    """A service running on a date, the calendar dates materialized by the import"""
+    date = models.DateField()
+    service_id = models.CharField(max_length=32)
+
+    class Meta:
+        abstract = True
+
 class AbstractRoute(models.Model):
     class RouteTypeChoice(models.IntegerChoices):
         TRAM = 0
@@ -115,6 +166,10 @@ class AbstractTrip(models.Model):
     hidden_block_id = models.IntegerField(null=True, blank=True)
     brigade = models.CharField(max_length=4, null=True)
     fleet_type = models.CharField(max_length=16, null=True)
+    service_date = models.GeneratedField(
+        expression=get_trip_service_date(), output_field=models.DateField(null=True), db_persist=True)
+    day_type = models.GeneratedField(
+        expression=get_trip_day_type(), output_field=models.CharField(max_length=8, null=True), db_persist=True)
 
     class Meta:
         abstract = True
@@ -127,6 +182,10 @@ class AbstractStopTime(models.Model):
     stop_sequence = models.IntegerField()
     arrival_time = models.CharField(max_length=8)
     departure_time = models.CharField(max_length=8)
+    arrival_seconds = models.GeneratedField(
+        expression=get_gtfs_seconds('arrival_time'), output_field=models.IntegerField(), db_persist=True)
+    departure_seconds = models.GeneratedField(
+        expression=get_gtfs_seconds('departure_time'), output_field=models.IntegerField(), db_persist=True)
     pickup_type = models.IntegerField(choices=BoardingTypeChoice, null=True)
     drop_off_type = models.IntegerField(choices=BoardingTypeChoice, null=True)
 
@@ -1,80 +1,85 @@
 from .abstract import *
 
+# GTFS tables are list-partitioned by carrier (see migration 0002), so their
+# primary keys include carrier_id and foreign keys are not enforced by the database
+
 
 class Carrier(AbstractCarrier):
     class Meta:
         db_table = 'common_Carriers'
 
 class CalendarDate(AbstractCalendarDate):
-    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE)
+    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE, db_constraint=False)
 
     class Meta:
         db_table ='common_CalendarDates'
 
 
+class ServiceDay(AbstractServiceDay):
+    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE, db_constraint=False)
+
+    class Meta:
+        db_table = 'common_ServiceDays'
+        unique_together = [['date', 'service_id', 'carrier']]
+
+
 class Route(AbstractRoute):
-    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE)
+    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE, db_constraint=False)
 
     class Meta:
         db_table = 'common_Routes'
 
 
 class Shape(AbstractShape):
-    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE)
+    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE, db_constraint=False)
 
     class Meta:
         db_table = 'common_Shapes'
     
 
 class ShapeSequence(AbstractShapeSequence):
-    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE)
-    shape = models.ForeignKey(Shape, on_delete=models.CASCADE)
+    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE, db_constraint=False)
+    shape = models.ForeignKey(Shape, on_delete=models.CASCADE, db_constraint=False)
 
     class Meta:
         db_table = 'common_ShapeSequences'
 
 
 class Stop(AbstractStop):
-    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE)
+    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE, db_constraint=False)
 
     class Meta:
         db_table = 'common_Stops'
 
 
 class Trip (AbstractTrip):
-    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE)
-    route = models.ForeignKey(Route, on_delete=models.CASCADE)
-    shape = models.ForeignKey(Shape, on_delete=models.CASCADE)
+    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE, db_constraint=False)
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, db_constraint=False)
+    shape = models.ForeignKey(Shape, on_delete=models.CASCADE, db_constraint=False)
 
     class Meta:
         db_table = 'common_Trips'
-        unique_together = [['trip_id', 'route']]
-
-
-class StopTime(AbstractStopTime):
-    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE)
-    trip = models.ForeignKey(Trip, on_delete=models.CASCADE)
-    stop = models.ForeignKey(Stop, on_delete=models.CASCADE)
-
-    class Meta:
-        db_table = 'common_StopTimes'
-        unique_together = [['trip', 'stop_sequence']]
+        unique_together = [['trip_id', 'route', 'carrier']]
+        indexes = [
+            # Trips of a WTP service day, without matching the trip_ids
+            models.Index(fields=['service_date', 'day_type'], name='trips_service_day_idx'),
+        ]
 
 
 class Frequence(AbstractFrequence):
-    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE)
-    trip = models.ForeignKey(Trip, on_delete=models.CASCADE)
+    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE, db_constraint=False)
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, db_constraint=False)
 
     class Meta:
         db_table = 'common_Frequencies'
 
 
 class Transfer(AbstractTransfer):        
-    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE)
-    from_stop = models.ForeignKey(Stop, on_delete=models.CASCADE, related_name='transfers_from')
-    to_stop = models.ForeignKey(Stop, on_delete=models.CASCADE, related_name='transfers_to')
-    from_trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='transfers_from')
-    to_trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='transfers_to')
+    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE, db_constraint=False)
+    from_stop = models.ForeignKey(Stop, on_delete=models.CASCADE, related_name='transfers_from', db_constraint=False)
+    to_stop = models.ForeignKey(Stop, on_delete=models.CASCADE, related_name='transfers_to', db_constraint=False)
+    from_trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='transfers_from', db_constraint=False)
+    to_trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='transfers_to', db_constraint=False)
 
     class Meta:
         db_table = 'common_Transfers'
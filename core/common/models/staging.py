@@ -11,7 +11,7 @@ class CarrierStaging(AbstractCarrier):
 
 
 class CalendarDateStaging(AbstractCalendarDate):
-    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE)
+    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE, db_constraint=False)
 
     _base_model = CalendarDate
 
@@ -19,8 +19,18 @@ class CalendarDateStaging(AbstractCalendarDate):
         db_table ='common_CalendarDates_Staging'
 
 
+class ServiceDayStaging(AbstractServiceDay):
+    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE, db_constraint=False)
+
+    _base_model = ServiceDay
+
+    class Meta:
+        db_table = 'common_ServiceDays_Staging'
+        unique_together = [['date', 'service_id', 'carrier']]
+
+
 class RouteStaging(AbstractRoute):
-    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE)
+    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE, db_constraint=False)
 
     _base_model = Route
 
@@ -29,7 +39,7 @@ class RouteStaging(AbstractRoute):
 
 
 class ShapeStaging(AbstractShape):
-    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE)
+    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE, db_constraint=False)
 
     _base_model = Shape
 
@@ -38,8 +48,8 @@ class ShapeStaging(AbstractShape):
     
 
 class ShapeSequenceStaging(AbstractShapeSequence):
-    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE)
-    shape = models.ForeignKey(ShapeStaging, on_delete=models.CASCADE)
+    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE, db_constraint=False)
+    shape = models.ForeignKey(ShapeStaging, on_delete=models.CASCADE, db_constraint=False)
 
     _base_model = ShapeSequence
 
@@ -48,7 +58,7 @@ class ShapeSequenceStaging(AbstractShapeSequence):
 
 
 class StopStaging(AbstractStop):
-    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE)
+    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE, db_constraint=False)
 
     _base_model = Stop
 
@@ -56,31 +66,37 @@ class StopStaging(AbstractStop):
         db_table = 'common_Stops_Staging'
 
 class TripStaging(AbstractTrip):
-    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE)
-    route = models.ForeignKey(RouteStaging, on_delete=models.CASCADE)
-    shape = models.ForeignKey(ShapeStaging, on_delete=models.CASCADE)
+    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE, db_constraint=False)
+    route = models.ForeignKey(RouteStaging, on_delete=models.CASCADE, db_constraint=False)
+    shape = models.ForeignKey(ShapeStaging, on_delete=models.CASCADE, db_constraint=False)
 
     _base_model = Trip
 
     class Meta:
         db_table = 'common_Trips_Staging'
-        unique_together = [['trip_id', 'route']]
+        unique_together = [['trip_id', 'route', 'carrier']]
+        indexes = [
+            # Trips of a WTP service day, without matching the trip_ids
+            models.Index(fields=['service_date', 'day_type'], name='trips_stg_service_day_idx'),
+        ]
 
 
 class StopTimeStaging(AbstractStopTime):
-    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE)
-    trip = models.ForeignKey(TripStaging, on_delete=models.CASCADE)
-    stop = models.ForeignKey(StopStaging, on_delete=models.CASCADE)
-
-    _base_model = StopTime
+    """
+    UNLOGGED buffer, there is no live table: stop times are stored as TripStops and patterns,
+    which are built from it. Emptied once they are.
+    """
+    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE, db_constraint=False)
+    trip = models.ForeignKey(TripStaging, on_delete=models.CASCADE, db_constraint=False)
+    stop = models.ForeignKey(StopStaging, on_delete=models.CASCADE, db_constraint=False)
 
     class Meta:
         db_table = 'common_StopTimes_Staging'
-        unique_together = [['trip', 'stop_sequence']]
+        unique_together = [['trip', 'stop_sequence', 'carrier']]
 
 class FrequenceStaging(AbstractFrequence):
-    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE)
-    trip = models.ForeignKey(TripStaging, on_delete=models.CASCADE)
+    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE, db_constraint=False)
+    trip = models.ForeignKey(TripStaging, on_delete=models.CASCADE, db_constraint=False)
 
     _base_model = Frequence
 
@@ -88,11 +104,11 @@ class FrequenceStaging(AbstractFrequence):
         db_table = 'common_Frequencies_Staging'
 
 class TransferStaging(AbstractTransfer):
-    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE)
-    from_stop = models.ForeignKey(StopStaging, on_delete=models.CASCADE, related_name='transfers_staging_from')
-    to_stop = models.ForeignKey(StopStaging, on_delete=models.CASCADE, related_name='transfers_staging_to')
-    from_trip = models.ForeignKey(TripStaging, on_delete=models.CASCADE, related_name='transfers_staging_from')
-    to_trip = models.ForeignKey(TripStaging, on_delete=models.CASCADE, related_name='transfers_staging_to')
+    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE, db_constraint=False)
+    from_stop = models.ForeignKey(StopStaging, on_delete=models.CASCADE, related_name='transfers_staging_from', db_constraint=False)
+    to_stop = models.ForeignKey(StopStaging, on_delete=models.CASCADE, related_name='transfers_staging_to', db_constraint=False)
+    from_trip = models.ForeignKey(TripStaging, on_delete=models.CASCADE, related_name='transfers_staging_from', db_constraint=False)
+    to_trip = models.ForeignKey(TripStaging, on_delete=models.CASCADE, related_name='transfers_staging_to', db_constraint=False)
 
     _base_model = Transfer
     
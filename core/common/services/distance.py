@@ -0,0 +1,41 @@
+import numpy as np
+
+
+# Mean radius of the WGS84 ellipsoid
+EARTH_RADIUS_M = 6_371_008.8
+
+# Largest relative error of `haversine` against the WGS84 geodesic for points within 50 km of Warsaw,
+# the sphere is too flat along meridians and too round along parallels at this latitude.
+# Measured with `manage.py benchmark_distances`
+HAVERSINE_MAX_ERROR = 0.0035
+
+
+def as_coordinates(points) -> np.ndarray:
+    """(lat, lon) pairs in degrees as an array of shape (n, 2), Decimals included"""
+    return np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+
+def haversine(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Great-circle distances in meters between coordinates in degrees, arrays are broadcast against each other"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def get_distances(point, points) -> np.ndarray:
+    """Distances in meters from the point to each of the points"""
+    lat, lon = as_coordinates(point)[0]
+    points = as_coordinates(points)
+    return haversine(lat, lon, points[:, 0], points[:, 1])
+
+
+def get_distance_matrix(points_a, points_b) -> np.ndarray:
+    """Distances in meters from each of `points_a` (rows) to each of `points_b` (columns)"""
+    points_a, points_b = as_coordinates(points_a), as_coordinates(points_b)
+    return haversine(points_a[:, :1], points_a[:, 1:], points_b[:, 0], points_b[:, 1])
+
+
+def get_path_length(points) -> float:
+    """Length in meters of the path through the points in order"""
+    points = as_coordinates(points)
+    return float(haversine(points[:-1, 0], points[:-1, 1], points[1:, 0], points[1:, 1]).sum())
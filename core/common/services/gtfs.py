@@ -1,5 +1,8 @@
+from django.db.models import Exists, OuterRef
 from django.utils import timezone as tz
 
+from common.models import ServiceDay
+
 
 def parse_gtfs_time(time:str) -> tz.timedelta:
     h, m, s = map(int, time.split(':'))
@@ -14,4 +17,28 @@ def timedelta_to_str(td: tz.timedelta) -> str:
     m = (total_seconds % 3600) // 60
     s = total_seconds % 60
 
-    return f"{h:02d}:{m:02d}:{s:02d}"
\ No newline at end of file
+    return f"{h:02d}:{m:02d}:{s:02d}"
+
+
+DAY_SECONDS = 24 * 3600
+
+def get_seconds_since_midnight(dt: tz.datetime) -> int:
+    return dt.hour * 3600 + dt.minute * 60 + dt.second
+
+
+def parse_gtfs_seconds(time:str) -> int:
+    return int(parse_gtfs_time(time).total_seconds())
+
+
+def format_gtfs_seconds(seconds: int) -> str:
+    """GTFS time of seconds since the midnight of the service day, past 24:00:00 for trips after midnight"""
+    return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+
+
+def get_running_services_filter(date, prefix: str = '') -> Exists:
+    """Trips whose service runs on the date, one index lookup in the service days per trip"""
+    return Exists(ServiceDay.objects.filter(
+        carrier=OuterRef(f'{prefix}carrier'),
+        service_id=OuterRef(f'{prefix}service_id'),
+        date=date,
+    ))
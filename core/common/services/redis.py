@@ -49,7 +49,7 @@ def get_from_redis(key:str) -> str:
 
 @redis_operation
 def get_redis_keys_by_regexp(pattern: str) -> Generator[str, None, None]:
-    return (key.decode() for key in redis_client.scan_iter(match=pattern))
+    return redis_client.scan_iter(match=pattern)
 
 
 @redis_operation
@@ -69,6 +69,20 @@ def get_stop_route_schedule_from_redis(stop_id:str, date:str, route:str) -> dict
     return None
 
 
+@redis_operation
+def get_route_details_from_redis(route:str) -> dict | None:
+    from tasks.services.gtfs.models import split_value_with_carrier_prefix
+    carrier, route_id = split_value_with_carrier_prefix(route)
+    key = f'{carrier}_ROUTE_DETAILS_{route_id}'
+    return get_json_data_from_redis(key)
+
+
+@redis_operation
+def get_stop_departures_from_redis(carrier:str, stop_id:str, date:str) -> list[list] | None:
+    key = f'{carrier}_DEPARTURES_{stop_id}_{date}'
+    return get_json_data_from_redis(key)
+
+
 @redis_operation
 def get_stop_list_from_redis() -> list[dict]:
     key = 'STOP_LIST'
@@ -77,16 +91,16 @@ def get_stop_list_from_redis() -> list[dict]:
 
 
 @redis_operation
-def set_in_redis(key:str, value:str) -> None:
+def set_in_redis(key:str, value:str, ex:int | None = None) -> None:
     try:
-        assert redis_client.set(key, value)
+        assert redis_client.set(key, value, ex=ex)
     except Exception as e:
         raise Exception(f'Error while setting in Redis: {e}')
     
 
 @redis_operation
-def set_json_data_in_redis(key:str, data:dict) -> None:
-    set_in_redis(key, json.dumps(data))
+def set_json_data_in_redis(key:str, data:dict, ex:int | None = None) -> None:
+    set_in_redis(key, json.dumps(data), ex)
     
 
 @redis_operation
@@ -97,6 +111,31 @@ def set_stop_route_schedule_in_redis(data: dict, stop_id:str, date:str, route:st
     set_json_data_in_redis(key, data)
 
 
+@redis_operation
+def set_route_details_in_redis(data: dict, route:str) -> None:
+    from tasks.services.gtfs.models import split_value_with_carrier_prefix
+    carrier, route_id = split_value_with_carrier_prefix(route)
+    key = f'{carrier}_ROUTE_DETAILS_{route_id}'
+    set_json_data_in_redis(key, data)
+
+
+@redis_operation
+def set_stop_departures_in_redis(data: list[list], carrier:str, stop_id:str, date:str) -> None:
+    key = f'{carrier}_DEPARTURES_{stop_id}_{date}'
+    set_json_data_in_redis(key, data, settings.GTFS_DEPARTURE_BOARD_TTL)
+
+
+@redis_operation
+def set_stop_departure_boards_in_redis(boards: dict[str, list[list]], carrier:str, date:str) -> None:
+    """Departure boards of many stops in one round trip"""
+    pipeline = redis_client.pipeline(transaction=False)
+
+    for stop_id, data in boards.items():
+        pipeline.set(f'{carrier}_DEPARTURES_{stop_id}_{date}', json.dumps(data), ex=settings.GTFS_DEPARTURE_BOARD_TTL)
+
+    pipeline.execute()
+
+
 @redis_operation
 def save_stops_in_redis(stops:list[dict]) -> None:
     key = 'STOP_LIST'
@@ -126,6 +165,41 @@ def get_hash_from_redis(carrier:str, suffix:str = 'sha1') -> str:
         return hash_from_redis
 
 
+@redis_operation
+def get_gtfs_checksums_from_redis(carrier:str) -> dict | None:
+    key = f'{carrier}_GTFS_CHECKSUMS'
+    return get_json_data_from_redis(key)
+
+
+@redis_operation
+def set_gtfs_checksums_in_redis(checksums:dict, carrier:str) -> None:
+    key = f'{carrier}_GTFS_CHECKSUMS'
+    set_json_data_in_redis(key, checksums)
+
+
+@redis_operation
+def get_retained_gtfs_version_from_redis(carrier:str) -> dict | None:
+    key = f'{carrier}_RETAINED_GTFS_VERSION'
+    return get_json_data_from_redis(key)
+
+
+@redis_operation
+def set_retained_gtfs_version_in_redis(version:dict, carrier:str) -> None:
+    key = f'{carrier}_RETAINED_GTFS_VERSION'
+    set_json_data_in_redis(key, version)
+
+
+@redis_operation
+def get_stops_version_from_redis() -> str | None:
+    return get_from_redis('STOPS_VERSION')
+
+
+@redis_operation
+def bump_stops_version_in_redis() -> int:
+    """Processes rebuild their nearest stops index on the next request"""
+    return redis_client.incr('STOPS_VERSION')
+
+
 @redis_operation
 def recreate_redis_set(key: str, *values) -> bool:
     remove_from_redis(key)
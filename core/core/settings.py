@@ -46,6 +46,36 @@ CARRIERS_WITH_RT_VEHICLES_DATA = list({
 
 SERVED_FEEDS = list(ONESTOP_IDS.keys())
 
+GTFS_COPY_BUFFER_SIZE = int(getenv('GTFS_COPY_BUFFER_SIZE', 8 * 1024 * 1024))
+GTFS_IMPORT_WORKERS = int(getenv('GTFS_IMPORT_WORKERS', 4))
+GTFS_CACHE_DIR = getenv('GTFS_CACHE_DIR', '/tmp/gtfs_cache')
+GTFS_CACHE_SIZE = int(getenv('GTFS_CACHE_SIZE', 3))
+GTFS_DIFF_IMPORT = getenv('GTFS_DIFF_IMPORT', 'true').lower() == 'true'
+GTFS_LOAD_OPTIMIZED = getenv('GTFS_LOAD_OPTIMIZED', 'true').lower() == 'true'
+GTFS_TRIP_STOPS_CHUNK_SIZE = int(getenv('GTFS_TRIP_STOPS_CHUNK_SIZE', 20_000))
+GTFS_COLUMNAR_READER = getenv('GTFS_COLUMNAR_READER', 'true').lower() == 'true'
+GTFS_COLUMNAR_BATCH_SIZE = int(getenv('GTFS_COLUMNAR_BATCH_SIZE', 100_000))
+GTFS_VALIDATE_FEED = getenv('GTFS_VALIDATE_FEED', 'true').lower() == 'true'
+GTFS_SWAP_LOCK_TIMEOUT = int(getenv('GTFS_SWAP_LOCK_TIMEOUT', 50))
+GTFS_SWAP_RETRIES = int(getenv('GTFS_SWAP_RETRIES', 50))
+GTFS_TRACEMALLOC = getenv('GTFS_TRACEMALLOC', 'false').lower() == 'true'
+GTFS_HTTP_TIMEOUT = int(getenv('GTFS_HTTP_TIMEOUT', 60))
+GTFS_FEED_CHECK_CONNECTIONS = int(getenv('GTFS_FEED_CHECK_CONNECTIONS', 8))
+GTFS_WARMUP_WORKERS = int(getenv('GTFS_WARMUP_WORKERS', 4))
+# Departure boards are built per calendar date, they expire after the date has passed
+GTFS_DEPARTURE_BOARD_TTL = int(getenv('GTFS_DEPARTURE_BOARD_TTL', 2 * 24 * 3600))
+GTFS_THROTTLED_IMPORT = getenv('GTFS_THROTTLED_IMPORT', 'false').lower() == 'true'
+GTFS_THROTTLE_BYTES_PER_SECOND = int(getenv('GTFS_THROTTLE_BYTES_PER_SECOND', 8 * 1024 * 1024))
+GTFS_THROTTLE_BUFFER_SIZE = int(getenv('GTFS_THROTTLE_BUFFER_SIZE', 256 * 1024))
+GTFS_THROTTLE_CHECK_INTERVAL = float(getenv('GTFS_THROTTLE_CHECK_INTERVAL', 1))
+GTFS_THROTTLE_MAX_ACTIVE_BACKENDS = int(getenv('GTFS_THROTTLE_MAX_ACTIVE_BACKENDS', 16))
+GTFS_THROTTLE_MAX_LOCK_WAITS = int(getenv('GTFS_THROTTLE_MAX_LOCK_WAITS', 2))
+GTFS_THROTTLE_MAX_REPLICATION_LAG = float(getenv('GTFS_THROTTLE_MAX_REPLICATION_LAG', 10))
+GTFS_THROTTLE_BACKOFF = float(getenv('GTFS_THROTTLE_BACKOFF', 1))
+GTFS_THROTTLE_MAX_BACKOFF = float(getenv('GTFS_THROTTLE_MAX_BACKOFF', 30))
+# Local time, e.g. '01:00-05:00', updates are only started inside it. Empty allows them any time
+GTFS_IMPORT_WINDOW = getenv('GTFS_IMPORT_WINDOW', '')
+
 SCRAPER_USER_AGENT=getenv('SCRAPER_USER_AGENT')
 
 DEBUG = True
@@ -13,5 +13,6 @@ urlpatterns = [
     path('trips/', include('trips.urls')),
     path('bikes/', include('Bikes.urls')),
     path('alerts/', include('common.urls')),
+    path('metrics/', include('tasks.urls')),
     path('health/', health_check), 
 ]
@@ -1,11 +1,13 @@
 from rest_framework import serializers
-from django.db.models import Count, Q, QuerySet, Min, Max
+from django.db.models import Count, Q, QuerySet
 from django.utils import timezone as tz
 
 from common.models import *
 from common.services.common import *
+from common.services.gtfs import *
 from stops.serializers import *
 from trips.models import *
+from trips.services.models import get_trip_times
 from trips.serializers import *
 
 
@@ -98,48 +100,31 @@ class RouteDetailsSerializer(BaseRouteSerializer, serializers.ModelSerializer):
 
         if obj.carrier.carrier_code == 'WTP':
             weekday_code = get_wtp_weekday(date.isoweekday())
-            trip_filter &= (Q(trip_id__contains=date) & Q(trip_id__contains=weekday_code))
+            trip_filter &= (Q(service_date=date) & Q(day_type=weekday_code))
 
-        trips = Trip.objects.filter(trip_filter)
-
-        service_ids = trips.values_list('service_id', flat=True).distinct()
-
-        calendar_dates = CalendarDate.objects.filter(
-            service_id__in=service_ids,
-            date=date,
-        ).values('service_id', 'exception_type')
-
-        working_services = {
-            c['service_id'] for c in calendar_dates if c['exception_type'] == 1
-        }
-        excluded_services = {
-            c['service_id'] for c in calendar_dates if c['exception_type'] == 2
-        }
-
-        return (
-            trips
-                .filter(service_id__in=working_services)
-                .exclude(service_id__in=excluded_services)
-        )
+        return Trip.objects.filter(trip_filter, get_running_services_filter(date))
 
     def get_now_on_track(self, obj: Route):
-        now = tz.localtime(tz.now()).time()
-        trips = self.get_trips_for_date(obj)
-
-        trips_active_now = (StopTime.objects
-            .filter(trip_id__in=trips.values_list('trip_id',flat=True))
-            .values('trip_id')
-            .annotate(
-                min_time=Min('arrival_time'),
-                max_time=Max('departure_time'))
-            .filter(
-                min_time__lt=now,
-                max_time__gt=now)
-            .values_list('trip_id', flat=True)
-        )
+        now = tz.localtime(tz.now())
+        seconds = get_seconds_since_midnight(now)
+        trips_on_track = Trip.objects.none()
+
+        # Trips of yesterday's service day can still be on track after midnight
+        for service_date, offset in ((now.date() - tz.timedelta(days=1), DAY_SECONDS), (now.date(), 0)):
+            trips = self.get_trips_for_date(obj, service_date)
+
+            trip_stops = TripStops.objects.filter(
+                trip_id__in=trips.values('trip_id'),
+                carrier=obj.carrier,
+                start_seconds__lt=seconds + offset,
+            )
+            trips_active_now = [
+                trip_id for trip_id, (_, end) in get_trip_times(trip_stops).items() if end > seconds + offset
+            ]
+
+            trips_on_track |= trips.filter(trip_id__in=trips_active_now)
 
-        trips = trips.filter(trip_id__in=trips_active_now)
-        return TripBriefSerializer(trips, many=True).data
+        return TripBriefSerializer(trips_on_track, many=True).data
         
     class Meta(BaseRouteSerializer.Meta):
         fields = BaseRouteSerializer.Meta.fields + (
@@ -150,6 +135,14 @@ class RouteDetailsSerializer(BaseRouteSerializer, serializers.ModelSerializer):
         )
 
 
+class RouteStaticDetailsSerializer(RouteDetailsSerializer):
+    """Details that change only with a new GTFS feed, so they can be cached until the next update"""
+    now_on_track = None
+
+    class Meta(RouteDetailsSerializer.Meta):
+        fields = tuple(field for field in RouteDetailsSerializer.Meta.fields if field != 'now_on_track')
+
+
 class RouteBriefSerializer(BaseRouteSerializer, serializers.ModelSerializer):
     class Meta(BaseRouteSerializer.Meta):
         pass
@@ -1,12 +1,13 @@
 import folium
 from decimal import Decimal
-from geopy.distance import geodesic
 import requests
 
 from django.conf import settings
 
 from .views import *
 from common.models import *
+from common.services.redis import *
+from common.services.distance import *
 from ..serializers import *
 
 
@@ -17,7 +18,7 @@ def calculate_simple_distance(points, unit='km'):
     if unit not in {'km', 'm'}:
         raise ValueError('Unit parameter must be in {"km", "m"}!')
     
-    total = sum([geodesic(a,b).meters for a, b in zip(points, points[1:])])
+    total = get_path_length(points)
     return total if unit == 'm' else total / 1000.0
 
 def get_shortest_route(point1: LocationPoint, point2: LocationPoint, mode: str = 'foot-walking'):
@@ -75,7 +76,13 @@ def show_route(shape_sequence: list[LocationPoint]) -> str:
 
     return m._repr_html_()
 
+def cache_route_details(route: Route) -> dict:
+    details = RouteStaticDetailsSerializer(route).data
+    set_route_details_in_redis(details, route.route_id)
+    return details
+
 def get_route(route_id:str) -> dict:
     route = Route.objects.get(route_id=route_id)
-    route = RouteDetailsSerializer(route).data
-    return route
\ No newline at end of file
+    details = get_route_details_from_redis(route_id) or cache_route_details(route)
+    details['now_on_track'] = RouteDetailsSerializer().get_now_on_track(route)
+    return details
\ No newline at end of file
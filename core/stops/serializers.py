@@ -83,26 +83,23 @@ class StopOnMapBriefSerializer(BaseStopSerializer, serializers.ModelSerializer):
         )
 
 
-class BaseStopTimeSerializer(serializers.ModelSerializer):
+class BaseStopTimeSerializer(serializers.Serializer):
+    """Stop times are rebuilt from the trip patterns, see `trips.services.models.get_stop_times`"""
+    trip = serializers.CharField(source='trip_id')
+    arrival_time = serializers.CharField()
     on_request = serializers.SerializerMethodField()
     
     def get_on_request(self, obj):
         return True if obj.pickup_type == 3 else False  
 
-    class Meta:
-        model = StopTime
-        fields = ('trip', 'arrival_time', 'on_request')
-
 
 class StopTimeSerializer(BaseStopTimeSerializer):
-    stop = BaseStopSerializer()
-    
-    class Meta(BaseStopTimeSerializer.Meta):
-        fields = BaseStopTimeSerializer.Meta.fields + (
-            'stop',
-        )
+    """The stops of the stop times are passed by their stop_id in the `stops` context"""
+    stop = serializers.SerializerMethodField()
+
+    def get_stop(self, obj):
+        return BaseStopSerializer(self.context['stops'][obj.stop_id]).data
 
 
 class RecentTripStopTimeSerializer(BaseStopTimeSerializer):
-    class Meta(BaseStopTimeSerializer.Meta):
-        pass
+    pass
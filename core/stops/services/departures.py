@@ -0,0 +1,140 @@
+import logging
+from bisect import bisect_right
+from collections import defaultdict
+from operator import itemgetter
+
+from django.db.models import Q
+from django.utils import timezone as tz
+
+from common.services.common import *
+from common.services.gtfs import *
+from common.services.redis import *
+from common.models.common import *
+from trips.models import TripStops
+from trips.services.models import get_stop_times
+
+
+logger = logging.getLogger(__name__)
+
+# A departure of a board is [seconds since the midnight of the calendar date, trip_id, arrival_time, route, on_request]
+DEPARTURE_SECONDS = itemgetter(0)
+
+
+def get_trip_filter(carrier:str, date, prefix: str = 'trip__') -> Q:
+    """Rows of the trips that run on the date, the trips themselves with an empty `prefix`"""
+    match carrier:
+        case 'WTP':
+            return (
+                Q(**{f'{prefix}service_date': date}) &
+                Q(**{f'{prefix}day_type': get_wtp_weekday(date.isoweekday())})
+            )
+        case 'WKD':
+            return Q(get_running_services_filter(date, prefix))
+        case _:
+            return Q()
+
+
+def get_service_dates(date) -> tuple[tuple, ...]:
+    """
+    Service days with departures on the calendar date, with the offset of their GTFS times.
+    Trips of the previous service day that run past midnight have times past 24:00:00.
+    """
+    return ((date - tz.timedelta(days=1), DAY_SECONDS), (date, 0))
+
+
+def get_frequency_runs(carrier_id: int, trip_filter: Q) -> dict[str, list[int]]:
+    """
+    Shifts of every run of the frequency-based trips against the start of their TripStops,
+    whose stop times only give the pattern of the trip.
+    """
+    frequencies = list(
+        Frequence.objects
+            .filter(trip_filter, carrier_id=carrier_id)
+            .values_list('trip_id', 'start_time', 'end_time', 'headway_secs')
+    )
+
+    if not frequencies:
+        return {}
+
+    trip_starts = dict(
+        TripStops.objects
+            .filter(trip_id__in={trip_id for trip_id, *_ in frequencies}, carrier_id=carrier_id)
+            .values_list('trip_id', 'start_seconds')
+    )
+    runs = defaultdict(list)
+
+    for trip_id, start_time, end_time, headway_secs in frequencies:
+        # A trip without stop times has no departures to shift
+        if trip_starts.get(trip_id) is None:
+            logger.warning(f'Frequency-based trip {trip_id} of carrier {carrier_id} has no stop times, skipping')
+            continue
+
+        start, end = parse_gtfs_seconds(start_time), parse_gtfs_seconds(end_time)
+        runs[trip_id] += [run_start - trip_starts[trip_id] for run_start in range(start, end, headway_secs)]
+
+    return runs
+
+
+def get_departure_boards(carrier:str, date, stop_id: str | None = None) -> dict[str, list[list]]:
+    """
+    Departure boards of the calendar date for every stop of the carrier, or of the stop `stop_id`.
+    All of them come from the TripStops and patterns of one query each per service day, 
+    the runs of frequency-based trips are expanded.
+    """
+    carrier_id = Carrier.objects.values_list('id', flat=True).get(carrier_code=carrier)
+    routes = dict(Route.objects.filter(carrier_id=carrier_id).values_list('route_id', 'route_short_name'))
+    stop_ids = None if stop_id is None else {stop_id}
+    boards = defaultdict(list)
+
+    for service_date, offset in get_service_dates(date):
+        trip_filter = get_trip_filter(carrier, service_date)
+        runs = get_frequency_runs(carrier_id, trip_filter)
+        trips = Trip.objects.filter(get_trip_filter(carrier, service_date, prefix=''), carrier_id=carrier_id)
+        trip_stops = TripStops.objects \
+            .filter(trip_id__in=trips.values('trip_id'), carrier_id=carrier_id) \
+            .only('trip_id', 'route_id', 'pattern_id', 'start_seconds', 'carrier')
+
+        if stop_id is not None:
+            trip_stops = trip_stops.filter(stop_ids__contains=[stop_id])
+
+        trip_stops = list(trip_stops)
+        trip_routes = {obj.trip_id: routes.get(obj.route_id) for obj in trip_stops}
+
+        for stop_time in get_stop_times(trip_stops, stop_ids):
+            trip_id = stop_time.trip_id
+            on_request = stop_time.pickup_type == AbstractStopTime.BoardingTypeChoice.ON_REQUEST
+
+            # Runs of a frequency-based trip can start after midnight even if its pattern does not
+            for shift in runs.get(trip_id, (0,)):
+                seconds = stop_time.arrival_seconds + shift
+                if seconds >= offset:
+                    boards[stop_time.stop_id].append(
+                        [seconds - offset, trip_id, format_gtfs_seconds(seconds), trip_routes[trip_id], on_request])
+
+    for board in boards.values():
+        board.sort(key=itemgetter(0, 1))
+
+    return boards
+
+
+def get_next_departures(board: list[list], after: int, n: int) -> list[dict]:
+    """`n` departures of the board after `after` seconds since midnight, found by a binary search"""
+    start = bisect_right(board, after, key=DEPARTURE_SECONDS)
+
+    return [
+        {'trip': trip_id, 'arrival_time': arrival_time, 'on_request': on_request, 'route': route}
+        for _, trip_id, arrival_time, route, on_request in board[start:start + n]
+    ]
+
+
+def cache_departure_boards(carrier:str, date) -> int:
+    """Saves the departure boards of all stops of the carrier, stops without departures are built on request"""
+    boards = get_departure_boards(carrier, date)
+    set_stop_departure_boards_in_redis(boards, carrier, str(date))
+    return len(boards)
+
+
+def cache_stop_departures(carrier:str, stop_id:str, date) -> list[list]:
+    board = get_departure_boards(carrier, date, stop_id=stop_id).get(stop_id, [])
+    set_stop_departures_in_redis(board, carrier, stop_id, str(date))
+    return board
@@ -0,0 +1,106 @@
+import heapq
+import math
+from collections import defaultdict
+from typing import Hashable
+
+from common.models.common import *
+from common.services.distance import EARTH_RADIUS_M
+from common.services.redis import *
+
+
+GRID_CELL_SIZE_M = 250
+
+
+class StopGridIndex:
+    """
+    Stops bucketed into square cells of an equirectangular projection around their mean latitude.
+    A query reads the cells ring by ring around the point and stops as soon as the next ring is farther
+    than the k-th nearest stop found or the radius, so its cost does not depend on the number of stops.
+    Across a city, distances on the projection are within 1% of the geodesic ones.
+    Stops are keyed by whatever identifies them, carriers share stop_ids.
+    """
+    def __init__(self, stops: list[tuple[Hashable, float, float]], version: str | None = None,
+                 cell_size: float = GRID_CELL_SIZE_M):
+        self.version = version
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+
+        latitudes = [lat for _, lat, _ in stops]
+        self._lon_scale = math.cos(math.radians(sum(latitudes) / len(latitudes))) if latitudes else 1.0
+
+        for key, lat, lon in stops:
+            x, y = self.project(lat, lon)
+            self.cells[self.get_cell(x, y)].append((x, y, key))
+
+    def __len__(self) -> int:
+        return sum(len(cell) for cell in self.cells.values())
+
+    def project(self, lat: float, lon: float) -> tuple[float, float]:
+        """Meters east and north of the equator at the prime meridian"""
+        return (
+            math.radians(lon) * self._lon_scale * EARTH_RADIUS_M,
+            math.radians(lat) * EARTH_RADIUS_M
+        )
+
+    def get_cell(self, x: float, y: float) -> tuple[int, int]:
+        return (int(x // self.cell_size), int(y // self.cell_size))
+
+    @staticmethod
+    def get_ring(i: int, j: int, ring: int):
+        """Cells `ring` cells away from (i, j) on either axis"""
+        if ring == 0:
+            yield (i, j)
+            return
+
+        for di in range(-ring, ring + 1):
+            yield (i + di, j - ring)
+            yield (i + di, j + ring)
+        for dj in range(-ring + 1, ring):
+            yield (i - ring, j + dj)
+            yield (i + ring, j + dj)
+
+    def get_nearest(self, lat: float, lon: float, k: int, radius: float) -> list[tuple[float, Hashable]]:
+        """Up to `k` stops within `radius` meters of the point, as (distance in meters, key) from the nearest"""
+        x, y = self.project(lat, lon)
+        i, j = self.get_cell(x, y)
+        nearest = []  # max-heap of the k nearest stops so far, by negated distance
+
+        for ring in range(int(radius // self.cell_size) + 2):
+            # The point may lie anywhere in its cell, so stops of the ring are at least ring - 1 cells away
+            if len(nearest) == k and (ring - 1) * self.cell_size >= -nearest[0][0]:
+                break
+
+            for cell in self.get_ring(i, j, ring):
+                for stop_x, stop_y, key in self.cells.get(cell, ()):
+                    distance = math.hypot(stop_x - x, stop_y - y)
+
+                    if distance > radius:
+                        continue
+                    if len(nearest) < k:
+                        heapq.heappush(nearest, (-distance, key))
+                    elif distance < -nearest[0][0]:
+                        heapq.heapreplace(nearest, (-distance, key))
+
+        return sorted((-distance, key) for distance, key in nearest)
+
+
+_stop_index: StopGridIndex | None = None
+
+
+def build_stop_index(version: str | None = None) -> StopGridIndex:
+    """Stops keyed by (stop_id, carrier_id)"""
+    stops = Stop.objects.values_list('stop_id', 'carrier_id', 'stop_lat', 'stop_lon')
+    return StopGridIndex([((stop_id, carrier_id), lat, lon) for stop_id, carrier_id, lat, lon in stops], version)
+
+
+def get_stop_index() -> StopGridIndex:
+    """
+    The index of this process, rebuilt once the stops version in Redis changes after an import or a rollback.
+    Without Redis the index is built once per process.
+    """
+    global _stop_index
+    version = get_stops_version_from_redis()
+
+    if _stop_index is None or _stop_index.version != version:
+        _stop_index = build_stop_index(version)
+    return _stop_index
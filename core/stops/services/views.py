@@ -1,18 +1,21 @@
 from geopy.geocoders import Nominatim
-import heapq
 
 from django.db.models.manager import BaseManager
 from django.db.models import Q
 from django.utils import timezone as tz
 
 from common.services.common import *
+from common.services.gtfs import *
 from common.models.common import *
+from trips.models import TripStops
 from routes.services.views import *
 from routes.serializers import *
 
 from ..exceptions import *
 from ..serializers import *
 from .scraper import *
+from .departures import *
+from .nearest import *
 
 
 
@@ -26,22 +29,18 @@ def get_location(address: str) -> tuple[float ,float]:
         raise AddressNotFoundError(f'Address {address} was not found!')
     return (location.latitude, location.longitude)
 
-def get_n_nearest_points(selfpoint: tuple[float, float], dataset: list[Stop], n: int) -> list:
-    if n > len(dataset):
-        raise ValueError('Cannot make a sample larger than the entire set!')
-    
-    distances = []
-    for stop in dataset:
-        point = stop.get_coordinates()
-        distance = calculate_simple_distance([selfpoint, point])
-        distances.append((distance, stop))
-    
-    n_smallest = heapq.nsmallest(n, distances, key=lambda x: x[0])
-    
-    result = [(StopBriefSerializer(stop).data, distance) for distance, stop in n_smallest]
+def get_n_nearest_points(selfpoint: tuple[float, float], n: int, radius: float) -> list:
+    """`n` nearest stops within `radius` km from the spatial index, only they are read from the database"""
+    nearest = get_stop_index().get_nearest(*selfpoint, n, radius * 1000)
+    stops = {
+        (stop.stop_id, stop.carrier_id): stop
+        for stop in Stop.objects.select_related('carrier').filter(stop_id__in={stop_id for _, (stop_id, _) in nearest})
+    }
+
+    result = [(StopBriefSerializer(stops[key]).data, distance / 1000) for distance, key in nearest]
     return result
 
-def get_nearest_stops(location: str | tuple[float, float], stops: list[Stop], limit: int) -> list[dict]:    
+def get_nearest_stops(location: str | tuple[float, float], limit: int, radius: float) -> list[dict]:    
     def format_distance(distance: float) -> str:
         if distance < 1:
             return f'{int(distance*1000)}m'
@@ -53,7 +52,7 @@ def get_nearest_stops(location: str | tuple[float, float], stops: list[Stop], li
     if isinstance(location, str):
         location = get_location(location)
     
-    nearest_points = get_n_nearest_points(location, stops, limit)
+    nearest_points = get_n_nearest_points(location, limit, radius)
     nearest_stops = []
     
     for stop_data, distance in nearest_points:
@@ -85,51 +84,26 @@ def intercept_bad_stop_id(stop_id: str) -> str:
 
     return good_stop_id
 
-def get_available_routes(stoptime_objs: BaseManager[StopTime]) -> list[dict]:
-    """Returns a list of routes that stop at this stop, based on the filtered dataset of transport stops for the required stop.."""
-    trips_of_stop = stoptime_objs \
-    .distinct('trip__trip_id') \
-    .values_list('trip__trip_id', flat=True)
+def get_available_routes(trip_stops_objs: BaseManager[TripStops]) -> list[dict]:
+    """Returns a list of routes that stop at this stop, based on the filtered TripStops of the trips calling at the stop."""
+    routes_of_stop = trip_stops_objs.values('route_id')
 
     available_routes = Route.objects \
-        .filter(trip__trip_id__in=trips_of_stop) \
+        .filter(route_id__in=routes_of_stop) \
         .distinct('route_id')
     
     return RouteBriefSerializer(available_routes, many=True).data
 
 
-def get_recent_trips(carrier:str, stoptime_objs: BaseManager[StopTime], n: int = 10, dt: tz.datetime = None):
+def get_stop_recent_trips(carrier:str, stop_id:str, n: int = 10, dt: tz.datetime = None) -> list[dict]:
+    """Next departures from the stop, from its departure board of the day, which is built on the first request"""
     dt = tz.localtime() if not dt else dt
-    day_of_week = dt.isoweekday()
-    date, time = dt.date(), dt.time()
-
-    match carrier:
-        case 'WTP':
-            trip_filter = (
-                Q(trip__trip_id__contains=date) & 
-                Q(trip__trip_id__contains=get_wtp_weekday(day_of_week))
-            )
-        case 'WKD':
-            carrier = Carrier.objects.get(carrier_code=carrier)
-            excluded_services = CalendarDate.objects \
-                .filter(carrier=carrier, date=date) \
-                .values_list('service_id', flat=True)
-            trip_filter = ~Q(trip__service_id__in=excluded_services)
-            
-    stoptime_objs = stoptime_objs \
-        .filter(trip_filter) \
-        .filter(arrival_time__gt=time) \
-        .order_by('arrival_time')[:n]
+    board = get_stop_departures_from_redis(carrier, stop_id, str(dt.date()))
 
-    recent_trips = []
+    if board is None:
+        board = cache_stop_departures(carrier, stop_id, dt.date())
 
-    for stop_time in stoptime_objs:
-        route = stop_time.trip.route.route_short_name
-        stop_time = RecentTripStopTimeSerializer(stop_time).data
-        stop_time['route'] = route
-        recent_trips.append(stop_time)
-
-    return recent_trips
+    return get_next_departures(board, get_seconds_since_midnight(dt), n)
 
 def add_carrier_data(stop: dict):
     carrier = stop['carrier']
@@ -143,8 +117,8 @@ def extend_stop_info(stop: dict) -> tuple[list[str], str]:
     else:
         stop_ids = [stop_id]
     
-    stoptime_objs = StopTime.objects.filter(stop_id__in=stop_ids)
-    available_routes = get_available_routes(stoptime_objs)
+    trip_stops_objs = TripStops.objects.filter(stop_ids__overlap=stop_ids)
+    available_routes = get_available_routes(trip_stops_objs)
     stop['available_routes'] = available_routes
 
     return stop
@@ -156,9 +130,8 @@ def get_stop(stop_id: str) -> dict:
         stop = StopBriefSerializer(stop).data
         stop = extend_stop_info(stop)
 
-        stoptime_objs = StopTime.objects.filter(stop_id=stop_id)
         carrier_code = stop['carrier']['carrier_code']
-        recent_trips = get_recent_trips(carrier_code, stoptime_objs)
+        recent_trips = get_stop_recent_trips(carrier_code, stop_id)
 
         return {
             'stop': stop,
@@ -169,27 +142,36 @@ def get_stop(stop_id: str) -> dict:
         raise StopNotFoundError(f"Stop with id '{stop_id}' for '{carrier_code}' carrier wasn't found!")
     
 
+def get_stop_list(**filters) -> list[dict]:
+    try:
+        if filters:
+            stops = Stop.objects.filter(**filters)
+            stops = StopBriefSerializer(stops, many=True).data
+            stops = [extend_stop_info(stop) for stop in stops]
+        else:
+            stops = Stop.objects.all().distinct('stop_name')
+            stops = StopBriefSerializer(stops, many=True).data
+    except:
+        raise StopNotFoundError(**filters)
+
+    return sorted(stops, key=lambda x: x['stop_name'])
+
+
+def cache_stop_list() -> list[dict]:
+    stops = get_stop_list()
+    save_stops_in_redis(stops)
+    return stops
+
+
 def get_stops(**filters) -> list[dict]:
-    def get_stop_list(**filters) -> list[dict]:
-        try:
-            if filters:
-                stops = Stop.objects.filter(**filters)
-                stops = StopBriefSerializer(stops, many=True).data
-                stops = [extend_stop_info(stop) for stop in stops]
-            else:
-                stops = Stop.objects.all().distinct('stop_name')
-                stops = StopBriefSerializer(stops, many=True).data
-        except:
-            raise StopNotFoundError(**filters)
-
-        return sorted(stops, key=lambda x: x['stop_name'])
+    # Only the full list is cached
+    if filters:
+        return get_stop_list(**filters)
 
     if cached:= get_stop_list_from_redis():
         return cached
     else:
-        stops = get_stop_list()
-        save_stops_in_redis(stops)
-        return stops
+        return cache_stop_list()
 
 
 def form_schedule_from_soup(soup:BeautifulSoup) -> dict:
@@ -36,12 +36,9 @@ class NearestStopsView(APIView):
         
         address = params['address'].value
         limit = params['limit'].value
-        
-        stops = Stop.objects.all()
-        stop_ids = [stop.stop_id for stop in stops]
-        stops = Stop.objects.filter(stop_id__in=stop_ids)
+        radius = params['radius'].value
 
-        nearest_stops = get_nearest_stops(address, stops, limit)
+        nearest_stops = get_nearest_stops(address, limit, radius)
         response = {
             'nearest_stops': nearest_stops
         }
@@ -1,3 +1,15 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import *
+
+
+class GtfsUpdateStageInline(admin.TabularInline):
+    model = GtfsUpdateStage
+    extra = 0
+
+
+@admin.register(GtfsUpdateRun)
+class GtfsUpdateRunAdmin(admin.ModelAdmin):
+    list_display = ('carrier_code', 'mode', 'status', 'started_at', 'duration', 'peak_rss_mb')
+    list_filter = ('carrier_code', 'mode', 'status')
+    inlines = (GtfsUpdateStageInline,)
@@ -0,0 +1,91 @@
+import time
+
+import numpy as np
+from geopy.distance import geodesic
+
+from django.core.management.base import BaseCommand
+
+from common.services.distance import *
+
+
+# Center of Warsaw
+CENTER = (52.2297, 21.0122)
+
+
+class Command(BaseCommand):
+    help = ('Compares the accuracy and speed of the NumPy haversine distances '
+            'with geopy geodesic distances computed pair by pair, on random points around Warsaw')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=10_000,
+                            help='Points of the one-to-many benchmark (default: 10000)')
+        parser.add_argument('--matrix', type=int, default=300,
+                            help='Points on each side of the many-to-many benchmark (default: 300)')
+        parser.add_argument('--pairs', type=int, default=20_000,
+                            help='Random pairs the accuracy is measured on (default: 20000)')
+        parser.add_argument('--radius-km', type=float, default=50,
+                            help='Points are drawn within this distance of the center (default: 50)')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        random_points = lambda n: self.get_random_points(rng, n, options['radius_km'])
+
+        self.benchmark_accuracy(random_points(options['pairs']), random_points(options['pairs']))
+        self.benchmark_one_to_many(random_points(options['points']))
+        self.benchmark_many_to_many(random_points(options['matrix']), random_points(options['matrix']))
+
+    @staticmethod
+    def get_random_points(rng: np.random.Generator, n: int, radius_km: float) -> np.ndarray:
+        """Uniform in a square around the center, about `radius_km` to each side"""
+        lat_delta = radius_km / 111.2
+        lon_delta = lat_delta / np.cos(np.radians(CENTER[0]))
+        return np.column_stack([
+            CENTER[0] + rng.uniform(-lat_delta, lat_delta, n),
+            CENTER[1] + rng.uniform(-lon_delta, lon_delta, n),
+        ])
+
+    @staticmethod
+    def measure(func, *args) -> tuple[float, object]:
+        start = time.perf_counter()
+        result = func(*args)
+        return time.perf_counter() - start, result
+
+    def print_speed(self, name: str, geodesic_time: float, haversine_time: float, distances: int):
+        self.stdout.write(self.style.SUCCESS(
+            f'{name}: {distances} distances, geodesic {geodesic_time:.3f}s, haversine {haversine_time * 1000:.2f}ms, '
+            f'{geodesic_time / haversine_time:.0f}x faster'
+        ))
+
+    def benchmark_accuracy(self, points_a: np.ndarray, points_b: np.ndarray):
+        expected = np.array([geodesic(a, b).meters for a, b in zip(points_a, points_b)])
+        distances = haversine(points_a[:, 0], points_a[:, 1], points_b[:, 0], points_b[:, 1])
+
+        # Relative errors of pairs closer than a meter say nothing
+        far = expected >= 1
+        errors = np.abs(distances - expected)
+        relative_errors = errors[far] / expected[far]
+        max_error = relative_errors.max()
+
+        self.stdout.write(
+            f'Accuracy on {len(expected)} pairs: relative error max {max_error:.3%}, mean {relative_errors.mean():.3%}, '
+            f'absolute error max {errors.max():.1f}m'
+        )
+
+        if max_error > HAVERSINE_MAX_ERROR:
+            self.stdout.write(self.style.ERROR(
+                f'The error is above the documented bound of {HAVERSINE_MAX_ERROR:.2%}'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Within the documented bound of {HAVERSINE_MAX_ERROR:.2%}'))
+
+    def benchmark_one_to_many(self, points: np.ndarray):
+        point = tuple(CENTER)
+        geodesic_time, _ = self.measure(lambda: [geodesic(point, other).meters for other in points])
+        haversine_time, _ = self.measure(get_distances, point, points)
+        self.print_speed('One-to-many', geodesic_time, haversine_time, len(points))
+
+    def benchmark_many_to_many(self, points_a: np.ndarray, points_b: np.ndarray):
+        geodesic_time, _ = self.measure(lambda: [[geodesic(a, b).meters for b in points_b] for a in points_a])
+        haversine_time, _ = self.measure(get_distance_matrix, points_a, points_b)
+        self.print_speed('Many-to-many', geodesic_time, haversine_time, len(points_a) * len(points_b))
@@ -0,0 +1,157 @@
+import json
+import time
+import zipfile
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import GtfsUpdateRun
+from ...services.gtfs import generate_gtfs_feed, import_to_staging, swap_tables, remove_carrier
+from ...services.gtfs.metrics import get_peak_rss_mb, track_run
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks the GTFS import pipeline on synthetic feeds of the given scales of the WTP feed. '
+            'Imports into the configured database under a separate carrier, which is removed afterwards')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', type=float, nargs='+', default=[1, 5, 20],
+                            help='Feed sizes relative to the WTP feed (default: 1 5 20)')
+        parser.add_argument('--carrier', type=str, default='BN',
+                            help='Carrier code used for the benchmark data (default: BN)')
+        parser.add_argument('--days', type=int, default=7,
+                            help='Days of service in the generated feeds (default: 7)')
+        parser.add_argument('--save', type=Path,
+                            help='Writes the results as JSON baseline to this file')
+        parser.add_argument('--compare', type=Path,
+                            help='Compares the results with a JSON baseline')
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='Relative slowdown reported as a regression (default: 0.1)')
+        parser.add_argument('--feeds-dir', type=Path,
+                            help='Keeps the generated feeds in this directory and reuses them')
+
+    def handle(self, *args, **options):
+        carrier = options['carrier']
+        baseline = self.load_baseline(options['compare']) if options['compare'] else None
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            feeds_dir = options['feeds_dir'] or Path(temp_dir)
+            feeds_dir.mkdir(parents=True, exist_ok=True)
+            results = [
+                self.run_benchmark(scale, carrier, options['days'], feeds_dir) for scale in options['scales']
+            ]
+
+        for result in results:
+            self.print_result(result)
+
+        if options['save']:
+            options['save'].write_text(json.dumps(results, indent=2))
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {options['save']}"))
+
+        if baseline is not None:
+            self.compare(results, baseline, options['tolerance'])
+
+    def run_benchmark(self, scale: float, carrier: str, days: int, feeds_dir: Path) -> dict:
+        stages = dict()
+
+        @contextmanager
+        def stage(name: str):
+            start = time.perf_counter()
+            yield
+            stages[name] = round(time.perf_counter() - start, 3)
+            self.stdout.write(f'  {name}: {stages[name]}s')
+
+        self.stdout.write(f'Scale x{scale}:')
+        feed_path = feeds_dir / f'synthetic_x{scale}_{days}d.zip'
+
+        with stage('generate'):
+            if not feed_path.exists():
+                generate_gtfs_feed(feed_path, scale=scale, days=days)
+
+        remove_carrier(carrier)
+        run = None
+
+        try:
+            # The import records the stages of its workers, TripStops included, in the run
+            with track_run(carrier, None, GtfsUpdateRun.ModeChoice.FULL) as run:
+                with stage('import_to_staging'):
+                    with zipfile.ZipFile(feed_path) as zip_file:
+                        rows = import_to_staging(zip_file, carrier)
+
+                with stage('swap_tables'):
+                    swap_tables(carrier)
+
+            import_stages = {
+                recorded.name: round(recorded.duration, 3) for recorded in run.stages.order_by('started_at')
+            }
+        finally:
+            remove_carrier(carrier)
+            if run is not None:
+                run.delete()
+
+        for name, seconds in import_stages.items():
+            self.stdout.write(f'    {name}: {seconds}s')
+
+        pipeline_time = sum(seconds for name, seconds in stages.items() if name != 'generate')
+        total_rows = sum(rows.values())
+
+        return {
+            'scale': scale,
+            'days': days,
+            'rows': rows,
+            'total_rows': total_rows,
+            'stages': stages,
+            'import_stages': import_stages,
+            'pipeline_time': round(pipeline_time, 3),
+            'rows_per_sec': round(total_rows / pipeline_time),
+            'peak_rss_mb': get_peak_rss_mb(),
+        }
+
+    def print_result(self, result: dict):
+        self.stdout.write(self.style.SUCCESS(
+            f"x{result['scale']}: {result['total_rows']} rows in {result['pipeline_time']}s, "
+            f"{result['rows_per_sec']} rows/s, peak RSS {result['peak_rss_mb']} MB"
+        ))
+
+    def load_baseline(self, path: Path) -> list[dict]:
+        try:
+            return json.loads(path.read_text())
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Unable to read the baseline {path}: {e}')
+
+    def compare(self, results: list[dict], baseline: list[dict], tolerance: float):
+        baseline_by_scale = {result['scale']: result for result in baseline}
+        regressions = 0
+
+        for result in results:
+            previous = baseline_by_scale.get(result['scale'])
+
+            if previous is None:
+                self.stdout.write(self.style.WARNING(f"x{result['scale']}: not in the baseline"))
+                continue
+
+            # Stages of the import are part of import_to_staging, they show which of them slowed down
+            stages = {**result['stages'], **result.get('import_stages', {})}
+            previous_stages = {**previous['stages'], **previous.get('import_stages', {})}
+
+            for name, seconds in stages.items():
+                previous_seconds = previous_stages.get(name)
+
+                if name == 'generate' or not previous_seconds:
+                    continue
+
+                change = seconds / previous_seconds - 1
+                line = f"x{result['scale']} {name}: {previous_seconds}s -> {seconds}s ({change:+.1%})"
+
+                if change > tolerance:
+                    regressions += 1
+                    self.stdout.write(self.style.ERROR(line))
+                else:
+                    self.stdout.write(line)
+
+        if regressions:
+            self.stdout.write(self.style.ERROR(f'{regressions} stage(s) slower than the baseline'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
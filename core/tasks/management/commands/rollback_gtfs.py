@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...services.gtfs.tasks import validate_carrier
+from ...services.gtfs.rollback import GtfsRollbackError
+from ...tasks import rollback_gtfs
+
+
+class Command(BaseCommand):
+    help = 'Swaps the previous GTFS version of the carrier back in, without reimporting it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('carrier', type=str, nargs=1)
+        parser.add_argument('--sync', action='store_true',
+                            help='Rolls back in this process instead of the GTFS update queue')
+
+    def handle(self, *args, **options):
+        carrier = validate_carrier(options)
+
+        if not options['sync']:
+            rollback_gtfs.delay(carrier)
+            self.stdout.write(self.style.SUCCESS(f'Rollback of GTFS for {carrier} carrier scheduled!'))
+            return
+
+        try:
+            rollback_gtfs(carrier)
+        except GtfsRollbackError as e:
+            raise CommandError(e)
+
+        self.stdout.write(self.style.SUCCESS(f'GTFS for {carrier} carrier rolled back!'))
@@ -0,0 +1,61 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from ...models import GtfsUpdateRun
+from ...serializers import GtfsUpdateRunSerializer
+
+
+class Command(BaseCommand):
+    help = 'Shows the timings and memory use of the recent GTFS updates, stage by stage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('carrier', type=str, nargs='?',
+                            help='Carrier code, all carriers are shown if omitted')
+        parser.add_argument('--limit', type=int, default=5,
+                            help='Number of the most recent updates (default: 5)')
+        parser.add_argument('--json', action='store_true',
+                            help='Prints the updates as JSON')
+
+    def handle(self, *args, **options):
+        runs = GtfsUpdateRun.objects.prefetch_related('stages').order_by('-started_at')
+
+        if options['carrier']:
+            runs = runs.filter(carrier_code=options['carrier'])
+
+        runs = runs[:options['limit']]
+
+        if options['json']:
+            self.stdout.write(json.dumps(GtfsUpdateRunSerializer(runs, many=True).data, indent=2))
+            return
+
+        if not runs:
+            self.stdout.write(self.style.WARNING('No GTFS updates recorded yet'))
+            return
+
+        for run in runs:
+            self.print_run(run)
+
+    def print_run(self, run: GtfsUpdateRun):
+        style = self.style.SUCCESS if run.status == GtfsUpdateRun.StatusChoice.SUCCESS else self.style.ERROR
+        self.stdout.write(style(
+            f'{run.carrier_code} {run.mode} update {run.started_at:%Y-%m-%d %H:%M:%S}: {run.status}, '
+            f'{run.duration or 0:.2f}s, peak RSS {run.peak_rss_mb} MB'
+        ))
+
+        if run.error:
+            self.stdout.write(self.style.ERROR(f'  {run.error}'))
+
+        for stage in sorted(run.stages.all(), key=lambda stage: stage.started_at):
+            line = f'  {stage.name}: {stage.duration:.2f}s'
+
+            if stage.rows is not None:
+                line += f', {stage.rows} rows ({stage.rows / max(stage.duration, 1e-3):.0f}/s)'
+            if stage.bytes_read is not None:
+                line += f', {stage.bytes_read / 2**20:.1f} MB read'
+            if stage.peak_rss_mb is not None:
+                line += f', peak RSS {stage.peak_rss_mb} MB'
+            if stage.tracemalloc_peak_mb is not None:
+                line += f', Python peak {stage.tracemalloc_peak_mb} MB'
+
+            self.stdout.write(line)
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GtfsUpdateRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('carrier_code', models.CharField(max_length=8)),
+                ('feed_sha1', models.CharField(max_length=40, null=True)),
+                ('mode', models.CharField(choices=[('full', 'Full'), ('diff', 'Diff')], max_length=4)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('success', 'Success'), ('failed', 'Failed')], default='running', max_length=8)),
+                ('error', models.TextField(null=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('duration', models.FloatField(null=True)),
+                ('peak_rss_mb', models.FloatField(null=True)),
+            ],
+            options={
+                'db_table': 'tasks_GtfsUpdateRuns',
+                'indexes': [models.Index(fields=['carrier_code', '-started_at'], name='tasks_GtfsU_carrier_03e4b6_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='GtfsUpdateStage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64)),
+                ('started_at', models.DateTimeField()),
+                ('duration', models.FloatField()),
+                ('rows', models.BigIntegerField(null=True)),
+                ('bytes_read', models.BigIntegerField(null=True)),
+                ('rss_mb', models.FloatField(null=True)),
+                ('peak_rss_mb', models.FloatField(null=True)),
+                ('tracemalloc_peak_mb', models.FloatField(null=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stages', to='tasks.gtfsupdaterun')),
+            ],
+            options={
+                'db_table': 'tasks_GtfsUpdateStages',
+            },
+        ),
+    ]
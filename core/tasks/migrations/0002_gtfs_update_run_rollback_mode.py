@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='gtfsupdaterun',
+            name='mode',
+            field=models.CharField(choices=[('full', 'Full'), ('diff', 'Diff'), ('rollback', 'Rollback')], max_length=8),
+        ),
+    ]
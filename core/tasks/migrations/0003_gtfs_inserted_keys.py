@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0002_gtfs_update_run_rollback_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GtfsInsertedKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('carrier_id', models.IntegerField()),
+                ('table_name', models.CharField(max_length=64)),
+                ('key', models.JSONField()),
+            ],
+            options={
+                'db_table': 'tasks_GtfsInsertedKeys',
+                'indexes': [models.Index(fields=['carrier_id', 'table_name'], name='tasks_GtfsI_carrier_5945f5_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+from django.db import models
+
+
+class GtfsUpdateRun(models.Model):
+    class StatusChoice(models.TextChoices):
+        RUNNING = 'running'
+        SUCCESS = 'success'
+        FAILED = 'failed'
+
+    class ModeChoice(models.TextChoices):
+        FULL = 'full'
+        DIFF = 'diff'
+        ROLLBACK = 'rollback'
+
+    carrier_code = models.CharField(max_length=8)
+    feed_sha1 = models.CharField(max_length=40, null=True)
+    mode = models.CharField(max_length=8, choices=ModeChoice)
+    status = models.CharField(max_length=8, choices=StatusChoice, default=StatusChoice.RUNNING)
+    error = models.TextField(null=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    duration = models.FloatField(null=True)
+    peak_rss_mb = models.FloatField(null=True)
+
+    class Meta:
+        db_table = 'tasks_GtfsUpdateRuns'
+        indexes = [models.Index(fields=['carrier_code', '-started_at'])]
+
+
+class GtfsUpdateStage(models.Model):
+    run = models.ForeignKey(GtfsUpdateRun, on_delete=models.CASCADE, related_name='stages')
+    name = models.CharField(max_length=64)
+    started_at = models.DateTimeField()
+    duration = models.FloatField()
+    rows = models.BigIntegerField(null=True)
+    bytes_read = models.BigIntegerField(null=True)
+    rss_mb = models.FloatField(null=True)
+    peak_rss_mb = models.FloatField(null=True)
+    tracemalloc_peak_mb = models.FloatField(null=True)
+
+    class Meta:
+        db_table = 'tasks_GtfsUpdateStages'
+
+
+class GtfsInsertedKey(models.Model):
+    """Natural key of a live row inserted by a diff update, rolling the update back deletes the row"""
+    carrier_id = models.IntegerField()
+    table_name = models.CharField(max_length=64)
+    key = models.JSONField()
+
+    class Meta:
+        db_table = 'tasks_GtfsInsertedKeys'
+        indexes = [models.Index(fields=['carrier_id', 'table_name'])]
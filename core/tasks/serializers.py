@@ -0,0 +1,26 @@
+from rest_framework import serializers
+
+from .models import *
+
+
+class GtfsMetricsQueryParamsSerializer(serializers.Serializer):
+    carrier = serializers.CharField(required=False)
+    limit = serializers.IntegerField(
+        min_value = 1,
+        max_value = 100,
+        default = 10
+    )
+
+
+class GtfsUpdateStageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = GtfsUpdateStage
+        exclude = ('id', 'run')
+
+
+class GtfsUpdateRunSerializer(serializers.ModelSerializer):
+    stages = GtfsUpdateStageSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = GtfsUpdateRun
+        fields = '__all__'
@@ -1,4 +1,17 @@
+from .changes import *
+from .checksums import *
 from .db_operations import *
+from .diff import *
 from .download import *
+from .metrics import *
+from .partitions import *
 from .process import *
-from .tasks import *
\ No newline at end of file
+from .rollback import *
+from .scheduler import *
+from .service_days import *
+from .synthetic import *
+from .tasks import *
+from .throttle import *
+from .trip_stops import *
+from .validation import *
+from .warmup import *
\ No newline at end of file
@@ -0,0 +1,124 @@
+import logging
+
+from django.db import connection
+
+from tasks.models import GtfsInsertedKey
+from trips.models import *
+from .models import *
+from .partitions import *
+
+
+logger = logging.getLogger(__name__)
+
+# Columns identifying a row of a partitioned table within one carrier
+ROW_KEYS = {
+    REQUIRED_MODELS[filename]: keys for filename, keys in NATURAL_KEYS.items()
+    if REQUIRED_MODELS[filename] not in BUFFER_MODELS
+} | {
+    ShapeStaging: ('shape_id',),
+    ServiceDayStaging: ('date', 'service_id'),
+    TripStopsStaging: ('trip_id',),
+    TripPatternStaging: ('pattern_id',),
+}
+
+REVERTED_TABLE = 'gtfs_reverted'
+
+
+def get_row_key(model: models.Model, alias: str) -> str:
+    """The natural key as a JSON array, NULL parts of it compare equal"""
+    return 'jsonb_build_array({})'.format(', '.join(f'{alias}."{key}"' for key in ROW_KEYS[model]))
+
+
+def get_row_columns(model: models.Model, alias: str | None = None) -> str:
+    prefix = f'{alias}.' if alias else ''
+    return ', '.join(f'{prefix}"{column}"' for column in get_allowed_fields(model))
+
+
+def retain_deleted_rows(model: models.Model, carrier_id: int, delete_query: str) -> str:
+    """Wraps a DELETE of the live rows so that the deleted rows are kept in the staging partition"""
+    columns = get_row_columns(model)
+
+    return f'''
+        WITH deleted AS ({delete_query} RETURNING {columns})
+        INSERT INTO "{get_staging_partition(model, carrier_id)}" ({columns}) SELECT {columns} FROM deleted;
+    '''
+
+
+def retain_updated_rows(model: models.Model, carrier_id: int, select_query: str) -> str:
+    """
+    The UPDATE following it sees the rows as they were before,
+    so the old versions of the rows it updates are kept in the staging partition.
+    """
+    return f'''
+        WITH retained AS (
+            INSERT INTO "{get_staging_partition(model, carrier_id)}" ({get_row_columns(model)})
+            SELECT {get_row_columns(model, 'l')} {select_query}
+        )
+    '''
+
+
+def retain_inserted_keys(model: models.Model, carrier_id: int, insert_query: str) -> str:
+    """Wraps an INSERT of the live rows so that the keys of the inserted rows are kept"""
+    keys = ', '.join(f'"{key}"' for key in ROW_KEYS[model])
+
+    return f'''
+        WITH inserted AS ({insert_query} RETURNING {keys})
+        INSERT INTO "{get_table_name(GtfsInsertedKey)}" (carrier_id, table_name, key)
+        SELECT {int(carrier_id)}, '{get_table_name(model._base_model)}', {get_row_key(model, 'inserted')}
+        FROM inserted;
+    '''
+
+
+def revert_table_changes(model: models.Model, carrier_id: int) -> int:
+    """
+    Replaces the live rows the diff update inserted, changed or deleted with their old versions,
+    which are kept in the staging partition. The reverted rows are kept instead,
+    so reverting again brings the update back.
+    """
+    table = get_table_name(model._base_model)
+    staging_partition = get_staging_partition(model, carrier_id)
+    columns = get_row_columns(model)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            CREATE TEMP TABLE "{REVERTED_TABLE}" ON COMMIT DROP AS
+            SELECT {columns} FROM "{staging_partition}" WITH NO DATA;
+        ''')
+        cursor.execute(f'''
+            WITH reverted AS (
+                DELETE FROM "{table}" l
+                WHERE l.carrier_id = %s AND {get_row_key(model, 'l')} IN (
+                    SELECT {get_row_key(model, 's')} FROM "{staging_partition}" s
+                    UNION ALL
+                    SELECT key FROM "{get_table_name(GtfsInsertedKey)}" WHERE carrier_id = %s AND table_name = %s
+                )
+                RETURNING {columns}
+            )
+            INSERT INTO "{REVERTED_TABLE}" ({columns}) SELECT {columns} FROM reverted;
+        ''', [carrier_id, carrier_id, table])
+        reverted = cursor.rowcount
+
+        cursor.execute(f'INSERT INTO "{table}" ({columns}) SELECT {columns} FROM "{staging_partition}";')
+        restored = cursor.rowcount
+
+        # Every row written above was inserted, or replaced one of the reverted rows
+        cursor.execute(f'''
+            DELETE FROM "{get_table_name(GtfsInsertedKey)}" WHERE carrier_id = %s AND table_name = %s;
+        ''', [carrier_id, table])
+        cursor.execute(f'''
+            INSERT INTO "{get_table_name(GtfsInsertedKey)}" (carrier_id, table_name, key)
+            SELECT %s, %s, {get_row_key(model, 's')} FROM "{staging_partition}" s;
+        ''', [carrier_id, table])
+
+        cursor.execute(f'TRUNCATE "{staging_partition}";')
+        cursor.execute(f'INSERT INTO "{staging_partition}" ({columns}) SELECT {columns} FROM "{REVERTED_TABLE}";')
+        cursor.execute(f'DROP TABLE "{REVERTED_TABLE}";')
+
+    return reverted + restored
+
+
+def revert_changes(carrier_id: int) -> list[models.Model]:
+    """Reverts the changes of a diff update in every table, returns the models whose tables changed"""
+    changed = [model for model in ROW_KEYS if revert_table_changes(model, carrier_id)]
+    logger.info(f'Changes of the carrier {carrier_id} reverted in {len(changed)} tables')
+    return changed
@@ -0,0 +1,79 @@
+import zipfile
+import logging
+
+from django.db import connection, transaction
+
+from common.services.redis import get_gtfs_checksums_from_redis, set_gtfs_checksums_in_redis, remove_from_redis
+from .models import *
+from .process import get_file_info
+from .partitions import BUFFER_MODELS, get_staging_partition
+from .throttle import wait_for_database_capacity
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_member_checksums(zip_file: zipfile.ZipFile) -> dict[str, list[int]]:
+    """CRC32 and size of every GTFS file of the archive, as recorded in the zip directory"""
+    checksums = dict()
+
+    for filename in REQUIRED_MODELS:
+        if file_info := get_file_info(zip_file, filename):
+            checksums[filename] = [file_info.CRC, file_info.file_size]
+
+    return checksums
+
+
+def save_member_checksums(zip_file: zipfile.ZipFile, carrier: str) -> None:
+    set_gtfs_checksums_in_redis(get_member_checksums(zip_file), carrier)
+
+
+def get_unchanged_files(zip_file: zipfile.ZipFile, carrier: str) -> set[str]:
+    """GTFS files that are byte-identical to the ones of the last successful import"""
+    if not Carrier.objects.filter(carrier_code=carrier).exists():
+        return set()
+
+    previous = get_gtfs_checksums_from_redis(carrier) or dict()
+    current = get_member_checksums(zip_file)
+
+    # The carrier row itself is always imported
+    return {
+        filename for filename, checksum in current.items()
+        if filename != 'agency' and previous.get(filename) == checksum
+    }
+
+
+def remove_member_checksums(carrier: str) -> None:
+    remove_from_redis(f'{carrier}_GTFS_CHECKSUMS')
+
+
+def carry_over_file(carrier: str, filename: str) -> int:
+    """Copies the carrier's rows of an unchanged GTFS file from the live table into staging"""
+    model = REQUIRED_MODELS[filename]
+
+    # Only the TripStops built from them are live, see `carry_over_trip_stops`
+    if model in BUFFER_MODELS:
+        logger.info(f'File {filename} is unchanged, nothing to carry over')
+        return 0
+
+    models_to_copy = [ShapeStaging, model] if model is ShapeSequenceStaging else [model]
+    carrier_id = Carrier.objects.values_list('id', flat=True).get(carrier_code=carrier)
+    carrier_staging_id = CarrierStaging.objects.values_list('id', flat=True).get(carrier_code=carrier)
+    copied = 0
+    wait_for_database_capacity()
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for model_staging in models_to_copy:
+                columns = [f for f in get_allowed_fields(model_staging) if f not in {'id', 'carrier_id'}]
+                quoted_columns = ', '.join(f'"{column}"' for column in columns)
+
+                cursor.execute(f'''
+                    INSERT INTO "{get_staging_partition(model_staging, carrier_staging_id)}" ({quoted_columns}, carrier_id)
+                    SELECT {quoted_columns}, %s FROM "{get_table_name(model_staging._base_model)}"
+                    WHERE carrier_id = %s;
+                ''', [carrier_staging_id, carrier_id])
+                copied = cursor.rowcount
+
+    logger.info(f'File {filename} is unchanged, carried over {copied} records from the live table')
+    return copied
@@ -0,0 +1,299 @@
+import csv
+import zipfile
+import logging
+from typing import Iterable, NamedTuple
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from trips.models import *
+from .models import *
+from .process import *
+from .changes import *
+from .service_days import get_service_days_query
+from .partitions import *
+from .throttle import wait_for_database_capacity
+
+
+logger = logging.getLogger(__name__)
+
+
+class DiffResult(NamedTuple):
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+
+
+# Stop times are stored as TripStops and patterns, which are compared instead of the file
+TRIP_STOPS_FILES = {'trips', 'stop_times'}
+TRIP_STOPS_DIFF_TABLE = 'gtfs_diff_tripstops'
+TRIP_PATTERNS_DIFF_TABLE = 'gtfs_diff_trippatterns'
+SERVICE_DAYS_DIFF_TABLE = 'gtfs_diff_servicedays'
+
+# Tables that are rewritten when the table of the model changes
+DERIVED_MODELS = {
+    ShapeSequenceStaging: (ShapeStaging,),
+    TripStaging: (TripStopsStaging, TripPatternStaging),
+    StopTimeStaging: (TripStopsStaging, TripPatternStaging),
+    CalendarDateStaging: (ServiceDayStaging,),
+}
+
+
+def get_diff_table_name(model: models.Model) -> str:
+    return f'gtfs_diff_{model._meta.model_name}'
+
+
+def get_key_condition(key: str, nullable: bool) -> str:
+    """Nullable keys match NULLs too, they are compared with IS NOT DISTINCT FROM, which no index serves"""
+    operator = 'IS NOT DISTINCT FROM' if nullable else '='
+    return f'n."{key}" {operator} l."{key}"'
+
+
+def load_diff_table(zip_file: zipfile.ZipFile, carrier: str, carrier_id: int, 
+                    filename: str, buffer_size: int) -> tuple[str, list[str]] | None:
+    """Streams a GTFS file into a temporary table shaped like its live table"""
+    model = REQUIRED_MODELS[filename]
+    live_table = get_table_name(model._base_model)
+    diff_table = get_diff_table_name(model)
+
+    with open_gtfs_file(zip_file, filename) as file:
+        if file is None:
+            return None
+
+        reader = csv.DictReader(file)
+        columns = get_copy_columns(model, reader.fieldnames)
+        quoted_columns = ', '.join(f'"{column}"' for column in columns)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                CREATE TEMP TABLE "{diff_table}" ON COMMIT DROP AS 
+                SELECT {quoted_columns} FROM "{live_table}" WITH NO DATA;
+            ''')
+
+        lines = iter_copy_data(carrier, carrier_id, model, file, reader, columns)
+        copied = copy_lines_to_db(diff_table, columns, lines, buffer_size)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'ANALYZE "{diff_table}";')
+
+    logger.info(f'Loaded {copied} rows of {filename} for comparison')
+    return diff_table, columns
+
+
+def apply_table_diff(model: models.Model, diff_table: str, columns: list[str], 
+                     keys: tuple[str], carrier_id: int,
+                     nullable_keys: Iterable[str] = ()) -> DiffResult:
+    """
+    Makes the rows of the carrier in the live table of `model` equal to the rows of `diff_table`: 
+    rows are matched by the natural key, and only missing, changed or removed rows are written.
+    The old versions of the changed and removed rows and the keys of the new ones are retained.
+    """
+    table = get_table_name(model._base_model)
+    nullable_keys = set(nullable_keys)
+    value_columns = [c for c in columns if c not in keys and c != 'carrier_id']
+    match_keys = ' AND '.join(get_key_condition(key, key in nullable_keys) for key in keys)
+    quoted_columns = ', '.join(f'"{c}"' for c in columns if c != 'carrier_id')
+    selected_columns = ', '.join(f'n."{c}"' for c in columns if c != 'carrier_id')
+
+    with connection.cursor() as cursor:
+        cursor.execute(retain_deleted_rows(model, carrier_id, f'''
+            DELETE FROM "{table}" l
+            WHERE l.carrier_id = %s 
+                AND NOT EXISTS (SELECT 1 FROM "{diff_table}" n WHERE {match_keys})
+        '''), [carrier_id])
+        deleted = cursor.rowcount
+
+        updated = 0
+        if value_columns:
+            assignments = ', '.join(f'"{c}" = n."{c}"' for c in value_columns)
+            old_values = ', '.join(f'l."{c}"' for c in value_columns)
+            new_values = ', '.join(f'n."{c}"' for c in value_columns)
+            changed_rows = f'''
+                l.carrier_id = %s AND {match_keys}
+                AND ROW({old_values}) IS DISTINCT FROM ROW({new_values})
+            '''
+
+            cursor.execute(retain_updated_rows(
+                model, carrier_id, f'FROM "{table}" l JOIN "{diff_table}" n ON {changed_rows}') + f'''
+                UPDATE "{table}" l SET {assignments}
+                FROM "{diff_table}" n
+                WHERE {changed_rows};
+            ''', [carrier_id, carrier_id])
+            updated = cursor.rowcount
+
+        cursor.execute(retain_inserted_keys(model, carrier_id, f'''
+            INSERT INTO "{table}" ({quoted_columns}, carrier_id)
+            SELECT {selected_columns}, %s FROM "{diff_table}" n
+            WHERE NOT EXISTS (SELECT 1 FROM "{table}" l WHERE l.carrier_id = %s AND {match_keys})
+        '''), [carrier_id, carrier_id])
+        inserted = cursor.rowcount
+
+    return DiffResult(inserted, updated, deleted)
+
+
+def apply_shapes_diff(diff_table: str, carrier_id: int) -> DiffResult:
+    """Shapes are not a GTFS file, they follow the shape points"""
+    table = get_table_name(Shape)
+
+    with connection.cursor() as cursor:
+        cursor.execute(retain_deleted_rows(ShapeStaging, carrier_id, f'''
+            DELETE FROM "{table}" l
+            WHERE l.carrier_id = %s 
+                AND NOT EXISTS (SELECT 1 FROM "{diff_table}" n WHERE n.shape_id = l.shape_id)
+        '''), [carrier_id])
+        deleted = cursor.rowcount
+
+        cursor.execute(retain_inserted_keys(ShapeStaging, carrier_id, f'''
+            INSERT INTO "{table}" (shape_id, carrier_id)
+            SELECT DISTINCT n.shape_id, %s FROM "{diff_table}" n
+            ON CONFLICT DO NOTHING
+        '''), [carrier_id])
+        inserted = cursor.rowcount
+
+    return DiffResult(inserted=inserted, deleted=deleted)
+
+
+def delete_carrier_rows(model: models.Model, carrier_id: int) -> DiffResult:
+    """The new feed has no such file, so none of the carrier's rows of its table are left"""
+    with connection.cursor() as cursor:
+        cursor.execute(retain_deleted_rows(model, carrier_id, f'''
+            DELETE FROM "{get_table_name(model._base_model)}" WHERE carrier_id = %s
+        '''), [carrier_id])
+        return DiffResult(deleted=cursor.rowcount)
+
+
+def create_trip_stops_diff_tables(carrier_id: int, stop_times_changed: bool) -> None:
+    """
+    The new TripStops of the carrier and their patterns: built from the stop times in the staging buffer,
+    or from the live TripStops with the direction and route of the live trips if only the trips changed.
+    """
+    trips_table = get_partition_name(get_table_name(Trip), carrier_id)
+
+    if stop_times_changed:
+        query, params = TripStops._get_definition(
+            from_table=get_staging_partition(StopTimeStaging, carrier_id), join_table=trips_table)
+    else:
+        query, params = TripStops._get_carried_over_definition(
+            from_table=get_partition_name(get_table_name(TripStops), carrier_id),
+            patterns_table=get_partition_name(get_table_name(TripPattern), carrier_id),
+            join_table=trips_table,
+        )
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TEMP TABLE "{TRIP_STOPS_DIFF_TABLE}" ON COMMIT DROP AS {query};', params)
+        cursor.execute(f'''
+            CREATE TEMP TABLE "{TRIP_PATTERNS_DIFF_TABLE}" ON COMMIT DROP AS
+            SELECT DISTINCT ON (pattern_id) {', '.join(TripStops.PATTERN_COLUMNS)} FROM "{TRIP_STOPS_DIFF_TABLE}";
+        ''')
+        cursor.execute(f'ANALYZE "{TRIP_STOPS_DIFF_TABLE}", "{TRIP_PATTERNS_DIFF_TABLE}";')
+
+
+def apply_trip_stops_diff(carrier_id: int, stop_times_changed: bool) -> DiffResult:
+    """
+    Applies the changes of the trips and stop times to the TripStops and patterns, the stored form
+    of the stop times. A pattern is identified by its hash, so patterns are only inserted and removed.
+    """
+    create_trip_stops_diff_tables(carrier_id, stop_times_changed)
+
+    result = apply_table_diff(
+        TripStopsStaging, TRIP_STOPS_DIFF_TABLE, list(TripStops.COLUMNS), ('trip_id',), carrier_id)
+    patterns_result = apply_table_diff(
+        TripPatternStaging, TRIP_PATTERNS_DIFF_TABLE, list(TripStops.PATTERN_COLUMNS), ('pattern_id',), carrier_id)
+
+    logger.info(f'Changes of TripStops applied: {result}, of patterns: {patterns_result}')
+    return result
+
+
+def apply_service_days_diff(carrier_id: int) -> DiffResult:
+    """The live calendar dates changed in place, so do the live service days"""
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            CREATE TEMP TABLE "{SERVICE_DAYS_DIFF_TABLE}" ON COMMIT DROP AS
+            {get_service_days_query(get_table_name(CalendarDate))};
+        ''', [carrier_id])
+
+    result = apply_table_diff(
+        ServiceDayStaging, SERVICE_DAYS_DIFF_TABLE, ['date', 'service_id', 'carrier_id'], 
+        ROW_KEYS[ServiceDayStaging], carrier_id)
+    logger.info(f'Changes of service days applied: {result}')
+    return result
+
+
+def get_changed_models(results: dict[str, DiffResult]) -> set[models.Model]:
+    changed = {REQUIRED_MODELS[filename] for filename, result in results.items() if any(result)}
+    for model in list(changed):
+        changed.update(DERIVED_MODELS.get(model, ()))
+    return changed - set(BUFFER_MODELS)
+
+
+def apply_gtfs_diff(zip_file: zipfile.ZipFile, carrier: str, 
+                    buffer_size: int = settings.GTFS_COPY_BUFFER_SIZE,
+                    unchanged_files: Iterable[str] = ()) -> dict[str, DiffResult]:
+    """
+    Compares every GTFS file with the carrier's rows in the live tables and applies 
+    only the inserted, changed and removed rows, all in one transaction. 
+    Stop times are compared as the TripStops and patterns built from them.
+    Unchanged files are not read at all. The feed is validated by the caller.
+    The staging partitions keep only the changed rows of the previous version, 
+    see `revert_changes`, the transaction writes them and the live data together.
+    """
+    carrier_obj = Carrier.objects.get(carrier_code=carrier)
+    unchanged_files = set(unchanged_files)
+    results = dict()
+
+    with transaction.atomic():
+        prepare_staging_carrier(carrier)
+        CarrierStaging.objects.filter(pk=carrier_obj.pk).update(carrier_name=carrier_obj.carrier_name)
+
+        with open_gtfs_reader(zip_file, 'agency') as reader:
+            if reader is not None:
+                carrier_name = next(reader)['agency_name']
+                Carrier.objects.filter(pk=carrier_obj.pk).update(carrier_name=carrier_name)
+
+        for filename, keys in NATURAL_KEYS.items():
+            if filename in unchanged_files:
+                logger.info(f'File {filename} is unchanged, skipping')
+                continue
+
+            model = REQUIRED_MODELS[filename]
+
+            # A missing file leaves the buffer empty, so all TripStops are removed
+            if model in BUFFER_MODELS:
+                truncate_buffer_partitions(carrier_obj.pk)
+                loaded = import_file(zip_file, carrier, filename, buffer_size)
+                logger.info(f'Loaded {loaded} rows of {filename} into the staging buffer')
+                continue
+
+            loaded = load_diff_table(zip_file, carrier, carrier_obj.pk, filename, buffer_size)
+            wait_for_database_capacity()
+
+            if loaded is None:
+                results[filename] = delete_carrier_rows(model, carrier_obj.pk)
+
+                if model is ShapeSequenceStaging:
+                    delete_carrier_rows(ShapeStaging, carrier_obj.pk)
+
+                logger.info(f'File {filename} is not in the feed, rows of the carrier removed: {results[filename]}')
+                continue
+
+            diff_table, columns = loaded
+            nullable_keys = OPTIONAL_KEYS.get(filename, set()) | {
+                field.attname for field in model._meta.fields if field.null
+            }
+            results[filename] = apply_table_diff(model, diff_table, columns, keys, carrier_obj.pk, nullable_keys)
+
+            if model is ShapeSequenceStaging:
+                apply_shapes_diff(diff_table, carrier_obj.pk)
+
+            logger.info(f'Changes of {filename} applied: {results[filename]}')
+
+        if not TRIP_STOPS_FILES <= unchanged_files:
+            wait_for_database_capacity()
+            results['stop_times'] = apply_trip_stops_diff(carrier_obj.pk, 'stop_times' not in unchanged_files)
+            truncate_buffer_partitions(carrier_obj.pk)
+
+        if 'calendar_dates' in results:
+            apply_service_days_diff(carrier_obj.pk)
+
+    analyze_live_partitions(carrier_obj.pk, get_changed_models(results))
+    return results
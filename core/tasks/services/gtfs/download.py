@@ -1,33 +1,271 @@
 import requests
 import io
+import os
+import json
+import mmap
+import time
+import asyncio
+import hashlib
+import logging
 import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Generator, Iterable
+
+import aiohttp
 
 from django.conf import settings
-from common.services.redis import get_hash_from_redis
+from common.services.redis import get_hash_from_redis, get_from_redis
+
+
+logger = logging.getLogger(__name__)
+
+
+class GtfsArchiveNotModifiedError(ValueError):
+    """The server still serves the archive from the cache, not the one of the feed, nothing was downloaded"""
+
 
 def get_from_feed(feed, key):
     return feed.get('feeds')[0].get('feed_versions')[0].get(key)
 
-def get_recent_feed(carrier: str):  
+def get_feed_url(carrier: str) -> str:
     onestop_id = settings.ONESTOP_IDS[carrier]
     api_key = settings.TRANSITLAND_API_KEY
-    url = f'https://transit.land/api/v2/rest/feeds?onestop_id={onestop_id}&api_key={api_key}'
+    return f'https://transit.land/api/v2/rest/feeds?onestop_id={onestop_id}&api_key={api_key}'
 
-    feed = requests.get(url)
+def get_recent_feed(carrier: str):  
+    feed = requests.get(get_feed_url(carrier))
     feed.raise_for_status()
 
     return feed.json()
 
+async def fetch_recent_feed(session: aiohttp.ClientSession, carrier: str) -> dict:
+    async with session.get(get_feed_url(carrier)) as response:
+        response.raise_for_status()
+        return await response.json()
+
+async def fetch_recent_feeds(carriers: list[str]) -> list[dict | BaseException]:
+    """Queries all feeds at once over a single pool of connections"""
+    connector = aiohttp.TCPConnector(limit=settings.GTFS_FEED_CHECK_CONNECTIONS)
+    timeout = aiohttp.ClientTimeout(total=settings.GTFS_HTTP_TIMEOUT)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        return await asyncio.gather(
+            *(fetch_recent_feed(session, carrier) for carrier in carriers), return_exceptions=True
+        )
+
+def get_recent_feeds(carriers: Iterable[str]) -> dict[str, dict]:
+    """Recent feeds of the carriers, a carrier whose feed could not be queried is left out"""
+    carriers = list(carriers)
+    feeds = dict()
+
+    for carrier, feed in zip(carriers, asyncio.run(fetch_recent_feeds(carriers))):
+        if isinstance(feed, BaseException):
+            logger.error(f'Unable to get the recent feed for {carrier} carrier: {feed!r}')
+            continue
+        feeds[carrier] = feed
+
+    return feeds
+
 def is_feed_new(feed, carrier:str):
     redis_sha = get_hash_from_redis(carrier)
     feed_sha = get_from_feed(feed, 'sha1')
+    # A rolled back feed is not imported again, only the next published one
+    rejected_sha = get_from_redis(f'{carrier}_rejected_sha1')
+
+    return feed_sha not in {redis_sha, rejected_sha}
+
+
+def get_cached_gtfs_path(sha1: str) -> Path:
+    """Archives in the cache are addressed by their content hash"""
+    return Path(settings.GTFS_CACHE_DIR) / f'{sha1}.zip'
+
+
+def get_validators_path(sha1: str) -> Path:
+    """HTTP validators of the archive, or of its partial download, are kept next to it"""
+    return get_cached_gtfs_path(sha1).with_suffix('.json')
+
+
+def save_validators(sha1: str, url: str, response: requests.Response) -> dict:
+    validators = {
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }
+    get_validators_path(sha1).write_text(json.dumps(validators))
+    return validators
+
+
+def load_validators(sha1: str) -> dict | None:
+    try:
+        return json.loads(get_validators_path(sha1).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def get_range_headers(part_path: Path, validators: dict | None) -> dict[str, str]:
+    """Resumes the partial download only if the server can tell that the archive did not change since"""
+    # Weak ETags are not allowed in If-Range
+    etag = validators and validators.get('etag')
+    if_range = etag if etag and not etag.startswith('W/') else validators and validators.get('last_modified')
+
+    if not if_range:
+        return dict()
+    return {'Range': f'bytes={part_path.stat().st_size}-', 'If-Range': if_range}
+
+
+def get_conditional_headers(url: str) -> tuple[str | None, dict[str, str]]:
+    """Validators of the most recent archive in the cache downloaded from the url, with its sha1"""
+    cache_dir = Path(settings.GTFS_CACHE_DIR)
+    archives = sorted(cache_dir.glob('*.zip'), key=lambda p: p.stat().st_mtime, reverse=True)
 
-    return feed_sha != redis_sha
+    for archive in archives:
+        validators = load_validators(archive.stem)
 
-def get_gtfs(feed):
+        if not validators or validators.get('url') != url:
+            continue
+
+        headers = dict()
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+        if headers:
+            return archive.stem, headers
+
+    return None, dict()
+
+
+def hash_file(path: Path, chunk_size: int = 1024 * 1024):
+    digest = hashlib.sha1()
+
+    with open(path, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest
+
+
+def download_gtfs(feed, chunk_size: int = 128_000) -> Path:
+    """
+    Streams the GTFS archive to a file in the cache, verifying it against the 
+    feed's sha1 on the way. An archive already in the cache is not downloaded again.
+    An interrupted download is resumed with a range request. Otherwise the request is conditional 
+    on the last archive from the same url, so an archive the server did not change is not downloaded again.
+    """
     url = get_from_feed(feed, 'url')
-    return requests.get(url).content
+    feed_sha = get_from_feed(feed, 'sha1')
+    path = get_cached_gtfs_path(feed_sha)
+    part_path = path.with_suffix('.part')
+
+    if path.exists():
+        logger.info(f'GTFS archive {feed_sha} found in cache, skipping download')
+        return path
+    
+    path.parent.mkdir(parents=True, exist_ok=True)
+    cached_sha, headers = None, dict()
+
+    if part_path.exists():
+        headers = get_range_headers(part_path, load_validators(feed_sha))
+    if not headers:
+        cached_sha, headers = get_conditional_headers(url)
+
+    logger.info('Start downloading GTFS archive...')
+    with requests.get(url, headers=headers, stream=True, timeout=settings.GTFS_HTTP_TIMEOUT) as response:
+        if response.status_code == requests.codes.not_modified:
+            raise GtfsArchiveNotModifiedError(
+                f'GTFS archive {feed_sha} is not served yet, the server still serves {cached_sha}'
+            )
+        
+        if response.status_code == requests.codes.range_not_satisfiable:
+            logger.warning('The partial GTFS archive is larger than the archive on the server, starting over')
+            part_path.unlink()
+            return download_gtfs(feed, chunk_size)
+        
+        response.raise_for_status()
+
+        if response.status_code == requests.codes.partial_content:
+            logger.info(f'Resuming the download from {part_path.stat().st_size // (1024 * 1024)} MB')
+            digest = hash_file(part_path)
+            mode = 'ab'
+        else:
+            save_validators(feed_sha, url, response)
+            digest = hashlib.sha1()
+            mode = 'wb'
+
+        # The partial archive is kept on errors, the next attempt resumes it
+        with open(part_path, mode) as spool:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    spool.write(chunk)
+                    digest.update(chunk)
+
+    archive_sha = digest.hexdigest()
+    # Whatever the server sent is kept under its own sha1, in case the feed catches up with it
+    os.replace(get_validators_path(feed_sha), get_validators_path(archive_sha))
+    os.replace(part_path, get_cached_gtfs_path(archive_sha))
+
+    if archive_sha != feed_sha:
+        raise ValueError(f'Checksum mismatch for GTFS archive: expected {feed_sha}, got {archive_sha}')
+    
+    logger.info(f'Download complete. Size: {path.stat().st_size // (1024 * 1024)} MB')
+    return path
+
+
+class MappedFile(io.RawIOBase):
+    """Read-only seekable file over a memory map (`mmap.mmap` has no `seekable()` before Python 3.13)"""
+    def __init__(self, mapped_file: mmap.mmap):
+        self._mapped_file = mapped_file
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._mapped_file.seek(offset, whence)
+        return self._mapped_file.tell()
+
+    def tell(self) -> int:
+        return self._mapped_file.tell()
+
+    def read(self, size: int = -1) -> bytes:
+        return self._mapped_file.read(size)
+
+    def readinto(self, buffer) -> int:
+        data = self._mapped_file.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+@contextmanager
+def open_gtfs_archive(path: str | Path) -> Generator[zipfile.ZipFile, None, None]:
+    """Opens the archive through a read-only memory map, so it lives in the page cache instead of the heap"""
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            with zipfile.ZipFile(MappedFile(mapped_file)) as zip_file:
+                # Lets the importer hand the archive over to worker processes by path
+                zip_file.filename = str(path)
+                yield zip_file
+
+
+def prune_gtfs_cache(keep: int = settings.GTFS_CACHE_SIZE) -> None:
+    """Removes all but the `keep` most recent archives and leftovers of interrupted downloads"""
+    cache_dir = Path(settings.GTFS_CACHE_DIR)
 
-def fetch_gtfs_zip(gtfs_zip) -> zipfile.ZipFile:
-    return zipfile.ZipFile(io.BytesIO(gtfs_zip))
+    if not cache_dir.exists():
+        return
+    
+    for leftover in cache_dir.glob('*.part'):
+        # A download still in progress writes to its partial archive at least once per timeout
+        if time.time() - leftover.stat().st_mtime > settings.GTFS_HTTP_TIMEOUT:
+            leftover.unlink(missing_ok=True)
+    
+    archives = sorted(cache_dir.glob('*.zip'), key=lambda p: p.stat().st_mtime, reverse=True)
+    for archive in archives[keep:]:
+        archive.unlink(missing_ok=True)
+        logger.info(f'Removed {archive.name} from GTFS cache')
 
+    for validators in cache_dir.glob('*.json'):
+        if not validators.with_suffix('.zip').exists() and not validators.with_suffix('.part').exists():
+            validators.unlink(missing_ok=True)
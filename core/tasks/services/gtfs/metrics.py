@@ -0,0 +1,139 @@
+import os
+import time
+import logging
+import resource
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Callable, Generator, NamedTuple
+
+from django.conf import settings
+from django.utils import timezone as tz
+
+from tasks.models import GtfsUpdateRun, GtfsUpdateStage
+
+
+logger = logging.getLogger(__name__)
+
+current_run: ContextVar[GtfsUpdateRun | None] = ContextVar('current_gtfs_update_run', default=None)
+
+
+class StageMetrics:
+    """Filled by the code inside `track_stage` with what only it knows"""
+    def __init__(self):
+        self.rows = None
+        self.bytes_read = None
+
+
+class WorkerResult(NamedTuple):
+    rows: int
+    duration: float
+    peak_rss_mb: float
+
+
+def get_rss_mb() -> float | None:
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return round(resident_pages * os.sysconf('SC_PAGE_SIZE') / 2**20, 1)
+
+
+def get_peak_rss_mb() -> float:
+    """Peak RSS of this process and of its finished child processes"""
+    peak_kb = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return round(peak_kb / 1024, 1)
+
+
+def get_tracemalloc_peak_mb() -> float | None:
+    if not tracemalloc.is_tracing():
+        return None
+    return round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+
+
+def record_stage(name: str, started_at: datetime, duration: float, **metrics) -> None:
+    """Saves a stage of the current run, does nothing outside of `track_run`"""
+    run = current_run.get()
+    logger.info(f'Stage {name} took {duration:.2f}s: {metrics}')
+
+    if run is None:
+        return
+
+    GtfsUpdateStage.objects.create(run=run, name=name, started_at=started_at, duration=duration, **metrics)
+
+
+@contextmanager
+def track_stage(name: str) -> Generator[StageMetrics, None, None]:
+    metrics = StageMetrics()
+    started_at = tz.now()
+    start = time.perf_counter()
+
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+    try:
+        yield metrics
+    finally:
+        record_stage(
+            name, started_at, time.perf_counter() - start,
+            rows=metrics.rows,
+            bytes_read=metrics.bytes_read,
+            rss_mb=get_rss_mb(),
+            peak_rss_mb=get_peak_rss_mb(),
+            tracemalloc_peak_mb=get_tracemalloc_peak_mb(),
+        )
+
+
+def run_measured(func: Callable[..., int], *args) -> WorkerResult:
+    """Runs a worker of the import schedule, measuring it in the worker itself"""
+    start = time.perf_counter()
+    rows = func(*args)
+    return WorkerResult(rows, time.perf_counter() - start, get_peak_rss_mb())
+
+
+def record_worker_stage(name: str, result: WorkerResult, bytes_read: int | None = None) -> None:
+    started_at = tz.now() - timedelta(seconds=result.duration)
+    record_stage(name, started_at, result.duration,
+                 rows=result.rows, bytes_read=bytes_read, peak_rss_mb=result.peak_rss_mb)
+
+
+def mark_run_failed(run: GtfsUpdateRun, error: Exception) -> None:
+    run.status = GtfsUpdateRun.StatusChoice.FAILED
+    run.error = str(error)
+
+
+@contextmanager
+def track_run(carrier: str, feed_sha1: str | None, mode: str) -> Generator[GtfsUpdateRun, None, None]:
+    """
+    Persists a GTFS update with the stages tracked inside it.
+    Python allocations are traced only with GTFS_TRACEMALLOC, it slows the import down noticeably.
+    """
+    trace = settings.GTFS_TRACEMALLOC and not tracemalloc.is_tracing()
+    if trace:
+        tracemalloc.start()
+
+    run = GtfsUpdateRun.objects.create(carrier_code=carrier, feed_sha1=feed_sha1, mode=mode)
+    token = current_run.set(run)
+    start = time.perf_counter()
+
+    try:
+        yield run
+    except Exception as e:
+        mark_run_failed(run, e)
+        raise
+    finally:
+        if run.status == GtfsUpdateRun.StatusChoice.RUNNING:
+            run.status = GtfsUpdateRun.StatusChoice.SUCCESS
+
+        run.duration = time.perf_counter() - start
+        run.peak_rss_mb = get_peak_rss_mb()
+        run.save()
+        current_run.reset(token)
+
+        if trace:
+            tracemalloc.stop()
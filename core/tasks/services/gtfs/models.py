@@ -13,6 +13,23 @@ REQUIRED_MODELS = {
     'transfers': TransferStaging,
 }
 
+# Columns identifying a row of a GTFS file within one carrier
+NATURAL_KEYS = {
+    'calendar_dates': ('service_id', 'date'),
+    'routes': ('route_id',),
+    'shapes': ('shape_id', 'shape_pt_sequence'),
+    'stops': ('stop_id',),
+    'trips': ('trip_id',),
+    'stop_times': ('trip_id', 'stop_sequence'),
+    'frequencies': ('trip_id', 'start_time'),
+    'transfers': ('from_stop_id', 'to_stop_id', 'from_trip_id', 'to_trip_id'),
+}
+
+# Parts of the natural keys that GTFS allows to be empty
+OPTIONAL_KEYS = {
+    'transfers': {'from_trip_id', 'to_trip_id'},
+}
+
 
 def get_related_by_fk_models(model: models.Model) -> list[models.Model]:
     related_objects = model._meta.related_objects
@@ -25,7 +42,8 @@ models_should_have_carrier_prefix = (
 
 
 def get_allowed_fields(model: models.Model) -> list:
-    return [field.attname for field in model._meta.fields]
+    """Fields that are written, generated columns are computed by the database"""
+    return [field.attname for field in model._meta.fields if not field.generated]
 
 
 def add_carrier_prefix(carrier:str, val:str) -> str:
@@ -44,20 +62,24 @@ def remove_carrier_prefix(val:str) -> str:
     return split_value_with_carrier_prefix(val)[1]
 
 
-def add_carrier_prefix_to_fields(carrier, model, row):
+def get_carrier_prefix_fields(model: models.Model) -> tuple[str, ...]:
     if model is TransferStaging:
-        row['from_trip_id'] = add_carrier_prefix(carrier, row['from_trip_id'])
-        row['to_trip_id'] = add_carrier_prefix(carrier, row['to_trip_id'])
+        return ('from_trip_id', 'to_trip_id')
     
     elif model is RouteStaging:
-        row['route_id'] = add_carrier_prefix(carrier, row['route_id'])
+        return ('route_id',)
 
     elif model is TripStaging:
-        row['route_id'] = add_carrier_prefix(carrier, row['route_id'])
-        row['trip_id'] = add_carrier_prefix(carrier, row['trip_id'])
+        return ('route_id', 'trip_id')
+
+    return ('trip_id',)
 
-    else:
-        row['trip_id'] = add_carrier_prefix(carrier, row['trip_id'])
+
+def add_carrier_prefix_to_fields(carrier, model, row):
+    for field in get_carrier_prefix_fields(model):
+        # Missing values stay NULL instead of becoming '<carrier>:None'
+        if row[field] is not None:
+            row[field] = add_carrier_prefix(carrier, row[field])
 
     return row
 
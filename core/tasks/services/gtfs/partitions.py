@@ -0,0 +1,397 @@
+import time
+import uuid
+import random
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+
+from psycopg2.errors import LockNotAvailable
+from django.conf import settings
+from django.db import connection, transaction, IntegrityError, OperationalError
+
+from tasks.models import GtfsInsertedKey
+from trips.models import *
+from .models import *
+from .throttle import wait_for_database_capacity
+
+
+logger = logging.getLogger(__name__)
+
+# Staging models whose files are only loaded to build other tables, they have no live table
+BUFFER_MODELS = [StopTimeStaging]
+
+# Staging models whose tables are partitioned by carrier, in the live and in the staging table
+PARTITIONED_MODELS = [
+    model for model in REQUIRED_MODELS.values() if model is not CarrierStaging and model not in BUFFER_MODELS
+] + [ShapeStaging, ServiceDayStaging, TripStopsStaging, TripPatternStaging]
+
+# Buffers are emptied right after the import, there is nothing to recover after a crash
+UNLOGGED_MODELS = set(BUFFER_MODELS)
+
+# TripStops and patterns are built by INSERT ... ON CONFLICT, which needs the indexes of their partitions
+TRIP_STOPS_MODELS = {TripStopsStaging, TripPatternStaging}
+
+# Staging models loaded into detached UNLOGGED partitions without indexes when GTFS_LOAD_OPTIMIZED is on
+LOAD_OPTIMIZED_MODELS = [model for model in PARTITIONED_MODELS + BUFFER_MODELS if model not in TRIP_STOPS_MODELS]
+
+
+def get_partition_name(table: str, carrier_id: int) -> str:
+    return f'{table}_{carrier_id}'
+
+
+def get_staging_partition(model: models.Model, carrier_id: int) -> str:
+    """Staging data is written straight into the carrier's partition, attached or not"""
+    return get_partition_name(get_table_name(model), carrier_id)
+
+
+def get_carrier_id(carrier: str) -> int:
+    """
+    A carrier has the same id in the live and in the staging tables,
+    which is also the partition key of its rows in both of them.
+    """
+    carrier_id = (
+        Carrier.objects.filter(carrier_code=carrier).values_list('id', flat=True).first()
+        or CarrierStaging.objects.filter(carrier_code=carrier).values_list('id', flat=True).first()
+    )
+
+    if carrier_id is None:
+        with connection.cursor() as cursor:
+            cursor.execute(f'''SELECT nextval(pg_get_serial_sequence('"{get_table_name(Carrier)}"', 'id'));''')
+            carrier_id = cursor.fetchone()[0]
+
+    return carrier_id
+
+
+def create_partition(table: str, carrier_id: int, unlogged: bool = False) -> None:
+    """Creates the partition of the carrier, the CHECK constraint lets ATTACH skip the validation scan"""
+    partition = get_partition_name(table, carrier_id)
+    unlogged_clause = 'UNLOGGED' if unlogged else ''
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            CREATE {unlogged_clause} TABLE IF NOT EXISTS "{partition}" PARTITION OF "{table}"
+            (CONSTRAINT "{partition}_check" CHECK (carrier_id = %s))
+            FOR VALUES IN (%s);
+        ''', [carrier_id, carrier_id])
+
+
+def create_carrier_partitions(carrier_id: int) -> None:
+    for model_staging in PARTITIONED_MODELS:
+        for model in (model_staging, model_staging._base_model):
+            create_partition(get_table_name(model), carrier_id)
+
+    for model_staging in BUFFER_MODELS:
+        create_partition(get_table_name(model_staging), carrier_id, unlogged=model_staging in UNLOGGED_MODELS)
+
+
+def truncate_staging_partitions(carrier_id: int) -> None:
+    """The keys inserted by a diff update belong to the changes it kept in staging"""
+    partitions = ', '.join(
+        f'"{get_staging_partition(model, carrier_id)}"' for model in PARTITIONED_MODELS + BUFFER_MODELS
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'TRUNCATE {partitions};')
+
+    GtfsInsertedKey.objects.filter(carrier_id=carrier_id).delete()
+
+
+def truncate_buffer_partitions(carrier_id: int) -> None:
+    """Buffers are not kept after the tables built from them, unlike the staging data kept for a rollback"""
+    partitions = ', '.join(f'"{get_staging_partition(model, carrier_id)}"' for model in BUFFER_MODELS)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'TRUNCATE {partitions};')
+
+
+def prepare_staging_carrier(carrier: str) -> int:
+    """Empties the staging partitions of the carrier, creating them and the staging carrier if needed"""
+    carrier_id = get_carrier_id(carrier)
+
+    with transaction.atomic():
+        CarrierStaging.objects.get_or_create(
+            id=carrier_id,
+            defaults={'carrier_code': carrier, 'carrier_name': carrier}
+        )
+        create_carrier_partitions(carrier_id)
+        truncate_staging_partitions(carrier_id)
+
+    return carrier_id
+
+
+def remove_carrier(carrier: str) -> None:
+    """Drops the carrier's partitions and rows, much faster than a cascading delete through the ORM"""
+    carrier_ids = set(Carrier.objects.filter(carrier_code=carrier).values_list('id', flat=True))
+    carrier_ids |= set(CarrierStaging.objects.filter(carrier_code=carrier).values_list('id', flat=True))
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for carrier_id in carrier_ids:
+                tables = [
+                    get_table_name(model) for model_staging in PARTITIONED_MODELS
+                    for model in (model_staging, model_staging._base_model)
+                ] + [get_table_name(model) for model in BUFFER_MODELS]
+
+                for table in tables:
+                    cursor.execute(f'DROP TABLE IF EXISTS "{get_partition_name(table, carrier_id)}";')
+
+        Carrier.objects.filter(carrier_code=carrier).delete()
+        CarrierStaging.objects.filter(carrier_code=carrier).delete()
+
+
+def exchange_partitions(table: str, staging_table: str, carrier_id: int) -> None:
+    """Moves the carrier's staging partition into the live table and the live one into staging"""
+    partition = get_partition_name(table, carrier_id)
+    staging_partition = get_partition_name(staging_table, carrier_id)
+    temporary_name = f'{partition}_swap'
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{partition}";')
+        cursor.execute(f'ALTER TABLE "{staging_table}" DETACH PARTITION "{staging_partition}";')
+        cursor.execute(f'ALTER TABLE "{partition}" RENAME TO "{temporary_name}";')
+        cursor.execute(f'ALTER TABLE "{staging_partition}" RENAME TO "{partition}";')
+        cursor.execute(f'ALTER TABLE "{temporary_name}" RENAME TO "{staging_partition}";')
+        cursor.execute(f'ALTER TABLE "{table}" ATTACH PARTITION "{partition}" FOR VALUES IN (%s);', [carrier_id])
+        cursor.execute(
+            f'ALTER TABLE "{staging_table}" ATTACH PARTITION "{staging_partition}" FOR VALUES IN (%s);', [carrier_id])
+
+
+def lock_swapped_tables(lock_timeout: int) -> None:
+    """
+    Takes the locks of the swap upfront, in one statement and in a fixed order. 
+    The wait is bounded by `lock_timeout` milliseconds, queries queued behind the swap wait no longer than that.
+    """
+    tables = [
+        table for model_staging in PARTITIONED_MODELS
+        for table in (get_table_name(model_staging._base_model), get_table_name(model_staging))
+    ]
+    quoted_tables = ', '.join(f'"{table}"' for table in tables)
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT set_config(%s, %s, true);', ['lock_timeout', f'{lock_timeout}ms'])
+        cursor.execute(f'LOCK TABLE {quoted_tables} IN ACCESS EXCLUSIVE MODE;')
+
+
+def swap_carrier_partitions(carrier: str, lock_timeout: int = settings.GTFS_SWAP_LOCK_TIMEOUT,
+                            retries: int = settings.GTFS_SWAP_RETRIES) -> None:
+    """
+    Makes the carrier's staging data live. Other carriers are not touched,
+    the previous live data of the carrier stays in staging until the next import, 
+    so swapping again rolls the update back.
+    The swap itself only changes the catalog, so it holds its locks for milliseconds. Getting them
+    can take long behind running queries, so the swap gives up after a short lock timeout, 
+    lets the queued queries through and tries again, until the running queries finish.
+    """
+    carrier_staging = CarrierStaging.objects.get(carrier_code=carrier)
+
+    for attempt in range(1, retries + 1):
+        try:
+            with transaction.atomic():
+                lock_swapped_tables(lock_timeout)
+                live_name = Carrier.objects.filter(id=carrier_staging.id).values_list('carrier_name', flat=True).first()
+                Carrier.objects.update_or_create(
+                    id=carrier_staging.id,
+                    defaults={'carrier_code': carrier, 'carrier_name': carrier_staging.carrier_name}
+                )
+
+                for model_staging in PARTITIONED_MODELS:
+                    exchange_partitions(
+                        get_table_name(model_staging._base_model), get_table_name(model_staging), carrier_staging.id
+                    )
+
+                # The staging carrier describes the data left in staging
+                if live_name is not None:
+                    CarrierStaging.objects.filter(id=carrier_staging.id).update(carrier_name=live_name)
+            break
+        except OperationalError as e:
+            if not isinstance(e.__cause__, LockNotAvailable) or attempt == retries:
+                raise
+
+            delay = min(2 ** attempt, 50) * lock_timeout / 1000 * random.uniform(0.5, 1)
+            logger.info(f'Tables of {carrier} are in use, retrying the swap in {delay:.2f}s ({attempt}/{retries})')
+            time.sleep(delay)
+
+    logger.info(f'Partitions of {carrier} are swapped')
+
+
+def is_partition_attached(partition: str) -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = %s::regclass);', [f'"{partition}"'])
+        return cursor.fetchone()[0]
+
+
+def get_index_definitions(table: str) -> list[tuple[str, bool, list[str], str | None]]:
+    """Name, uniqueness, columns and constraint type of every index of the table"""
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            SELECT
+                c.relname,
+                i.indisunique,
+                array(
+                    SELECT a.attname FROM unnest(i.indkey) WITH ORDINALITY k(attnum, ord)
+                    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                    ORDER BY k.ord
+                ),
+                con.contype,
+                pg_get_indexdef(i.indexrelid)
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            LEFT JOIN pg_constraint con ON con.conindid = i.indexrelid AND con.conrelid = i.indrelid
+            WHERE i.indrelid = %s::regclass;
+        ''', [f'"{table}"'])
+        return cursor.fetchall()
+
+
+def drop_partition_indexes(partition: str) -> None:
+    with connection.cursor() as cursor:
+        for name, _, _, constraint_type, _ in get_index_definitions(partition):
+            if constraint_type:
+                cursor.execute(f'ALTER TABLE "{partition}" DROP CONSTRAINT "{name}";')
+            else:
+                cursor.execute(f'DROP INDEX "{name}";')
+
+
+def detach_staging_partitions(carrier_id: int) -> None:
+    """
+    Turns the carrier's empty staging partitions into standalone UNLOGGED tables 
+    without indexes and constraints, so that COPY writes neither WAL nor index entries.
+    """
+    for model in LOAD_OPTIMIZED_MODELS:
+        table = get_table_name(model)
+        partition = get_staging_partition(model, carrier_id)
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                if is_partition_attached(partition):
+                    cursor.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{partition}";')
+
+                cursor.execute(f'ALTER TABLE "{partition}" SET UNLOGGED;')
+                drop_partition_indexes(partition)
+
+
+def create_partition_index(partition: str, name: str, unique: bool, definition: str) -> None:
+    """Builds one index of the partition on its own connection"""
+    index_method = definition.split(' USING ', 1)[1]
+    unique_clause = 'UNIQUE' if unique else ''
+
+    try:
+        wait_for_database_capacity()
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE {unique_clause} INDEX "{name}" ON "{partition}" USING {index_method};')
+    finally:
+        connection.close()
+
+
+def add_partition_constraints(table: str, partition: str) -> None:
+    """Turns the rebuilt unique indexes into the primary key and unique constraints the parent expects"""
+    partition_indexes = {
+        tuple(columns): name for name, unique, columns, _, _ in get_index_definitions(partition) if unique
+    }
+
+    with connection.cursor() as cursor:
+        for _, _, columns, constraint_type, _ in get_index_definitions(table):
+            if constraint_type not in ('p', 'u'):
+                continue
+
+            kind = 'PRIMARY KEY' if constraint_type == 'p' else 'UNIQUE'
+            cursor.execute(
+                f'ALTER TABLE "{partition}" ADD {kind} USING INDEX "{partition_indexes[tuple(columns)]}";')
+
+
+def get_reference_checks(carrier_id: int) -> list[tuple[str, str]]:
+    """Anti-joins finding rows whose foreign keys point to nothing in the carrier's staging partitions"""
+    checks = list()
+
+    for model in LOAD_OPTIMIZED_MODELS:
+        for field in model._meta.fields:
+            if not field.many_to_one or field.related_model not in LOAD_OPTIMIZED_MODELS:
+                continue
+
+            label = f'{get_table_name(model)}.{field.column}'
+            query = f'''
+                SELECT '{label}', count(*) FROM "{get_staging_partition(model, carrier_id)}" c
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM "{get_staging_partition(field.related_model, carrier_id)}" p 
+                    WHERE p."{field.target_field.column}" = c."{field.column}"
+                )
+            '''
+            checks.append((label, query))
+
+    return checks
+
+
+def validate_staging_references(carrier_id: int) -> None:
+    """The database does not enforce foreign keys between partitioned tables, so they are checked in one pass"""
+    query = ' UNION ALL '.join(query for _, query in get_reference_checks(carrier_id))
+
+    with connection.cursor() as cursor:
+        cursor.execute(query)
+        violations = {label: count for label, count in cursor.fetchall() if count}
+
+    if violations:
+        raise IntegrityError(f'Staging data refers to missing rows: {violations}')
+
+
+def attach_staging_partitions(carrier_id: int, workers: int = settings.GTFS_IMPORT_WORKERS) -> None:
+    """
+    Makes the detached staging partitions logged again, rebuilds their indexes in parallel,
+    validates the foreign keys and attaches the partitions back.
+    """
+    detached = [
+        model for model in LOAD_OPTIMIZED_MODELS 
+        if not is_partition_attached(get_staging_partition(model, carrier_id))
+    ]
+    indexes = list()
+    # Partitions change their names on every swap, but their indexes keep them
+    suffix = uuid.uuid4().hex[:8]
+
+    for model in detached:
+        partition = get_staging_partition(model, carrier_id)
+
+        if model not in UNLOGGED_MODELS:
+            with connection.cursor() as cursor:
+                cursor.execute(f'ALTER TABLE "{partition}" SET LOGGED;')
+
+        # Leftovers of an interrupted import
+        drop_partition_indexes(partition)
+        indexes += [
+            (partition, f'{partition}_{suffix}_{i}', unique, definition) 
+            for i, (_, unique, _, _, definition) in enumerate(get_index_definitions(get_table_name(model)))
+        ]
+
+    if indexes:
+        logger.info(f'Rebuilding {len(indexes)} indexes of the staging partitions...')
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(create_partition_index, *index) for index in indexes]:
+                future.result()
+
+    validate_staging_references(carrier_id)
+
+    with transaction.atomic():
+        for model in detached:
+            table = get_table_name(model)
+            partition = get_staging_partition(model, carrier_id)
+            add_partition_constraints(table, partition)
+
+            with connection.cursor() as cursor:
+                cursor.execute(f'ALTER TABLE "{table}" ATTACH PARTITION "{partition}" FOR VALUES IN (%s);', [carrier_id])
+
+
+def analyze_staging_partitions(carrier_id: int) -> None:
+    """
+    Autovacuum analyzes fresh partitions only after a while, so the statistics are 
+    collected before the swap, to give the first queries on the new data good plans.
+    """
+    with connection.cursor() as cursor:
+        for model in PARTITIONED_MODELS:
+            cursor.execute(f'ANALYZE "{get_staging_partition(model, carrier_id)}";')
+
+
+def analyze_live_partitions(carrier_id: int, models_staging: Iterable[models.Model]) -> None:
+    """A diff import changes the live partitions in place, so they are analyzed right after it"""
+    with connection.cursor() as cursor:
+        for model_staging in models_staging:
+            table = get_table_name(model_staging._base_model)
+            cursor.execute(f'ANALYZE "{get_partition_name(table, carrier_id)}";')
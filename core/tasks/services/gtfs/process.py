@@ -2,172 +2,273 @@ import zipfile
 import csv
 import logging
 import io
-import gc
-from typing import Generator, List
+import re
+from contextlib import contextmanager
+from typing import Generator, Iterable, Iterator
 
-from django.db import connection
+import pandas as pd
+from django.conf import settings
+from django.db import connection, transaction
 
 from .models import *
+from .partitions import get_staging_partition
+from .throttle import ImportThrottle, get_import_throttle, get_copy_buffer_size
 
 logger = logging.getLogger(__name__)
 
-def get_data_from_zip(zip_file: zipfile.ZipFile) -> Generator[tuple[str, dict], None, None]:
-    """Generator that returns data one row at a time"""
-    required_files = set(REQUIRED_MODELS.keys())
+COPY_NULL = '\\N'
+COPY_ESCAPES = {'\\': '\\\\', '\n': '\\n', '\r': '\\r', '\t': '\\t'}
+COPY_ESCAPED_CHARACTERS = re.compile('[\\\\\n\r\t]')
 
-    try:
-        for file_info in zip_file.infolist():
-            filename, extension = file_info.filename.split('.')
-
-            if filename in required_files and extension in {'csv', 'txt'}:
-                logger.info(f'Processing file {filename}...')
-                with zip_file.open(file_info) as file:
-                    decoded_file = io.TextIOWrapper(file, encoding='utf-8')
-                    reader = csv.DictReader(decoded_file)
-                    
-                    for row in reader:
-                        yield filename, row
-                        
-                logger.info(f'File {filename} processed')
-                        
-    except Exception as e:
-        logger.error(f'Unable to retrieve data from zip file: {e}')
-        return
+def get_file_info(zip_file: zipfile.ZipFile, filename: str) -> zipfile.ZipInfo | None:
+    for info in zip_file.infolist():
+        if info.filename.startswith(filename) and info.filename.endswith(('.csv', '.txt')):
+            return info
+    return None
 
-def process_file_in_batches(zip_file: zipfile.ZipFile, filename: str, batch_size: int = 100_000) -> Generator[List[dict], None, None]:
-    """Generator that returns file data in batches"""
-    try:
-        file_info = None
-        for info in zip_file.infolist():
-            if info.filename.startswith(filename) and info.filename.endswith(('.csv', '.txt')):
-                file_info = info
+
+def to_copy_value(value) -> str:
+    """Formats a single value for the text format of PostgreSQL COPY"""
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+
+    return (str(value)
+        .replace('\\', '\\\\')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+        .replace('\t', '\\t'))
+
+
+def prepare_gtfs_row(carrier: str, model: models.Model, row: dict, allowed_fields: set) -> dict:
+    """Leaves only the fields of the model, replaces empty values with NULL and adds carrier prefixes"""
+    filtered_row = {
+        k: None if v in {None, ''} else v
+        for k, v in row.items() 
+        if k in allowed_fields
+    }
+
+    if model in models_should_have_carrier_prefix:
+        filtered_row = add_carrier_prefix_to_fields(carrier, model, filtered_row)
+
+    return filtered_row
+
+
+def get_copy_columns(model: models.Model, fieldnames: Iterable[str]) -> list[str]:
+    """Columns of the model that are present in the GTFS file, followed by `carrier_id`"""
+    allowed_fields = set(get_allowed_fields(model)) - {'id', 'carrier_id'}
+    return [name for name in fieldnames if name in allowed_fields] + ['carrier_id']
+
+
+def iter_copy_lines(carrier: str, carrier_id: int, model: models.Model, 
+                    reader: csv.DictReader, columns: list[str]) -> Generator[str, None, None]:
+    """Turns rows of a GTFS file into lines of COPY text without creating model instances"""
+    allowed_fields = set(columns)
+
+    for row in reader:
+        row = prepare_gtfs_row(carrier, model, row, allowed_fields)
+        row['carrier_id'] = carrier_id
+        yield '\t'.join(to_copy_value(row.get(column)) for column in columns) + '\n'
+
+
+def read_gtfs_batches(file: io.TextIOBase, fieldnames: list[str], columns: list[str], 
+                      batch_size: int) -> Iterator[pd.DataFrame]:
+    """
+    Parses the rest of a GTFS file with the C parser of pandas into batches of string columns, 
+    only the given columns are kept. Missing trailing values are read as empty strings, like in `csv.DictReader`.
+    """
+    return pd.read_csv(
+        file,
+        header=None,
+        names=fieldnames,
+        usecols=columns,
+        dtype=str,
+        keep_default_na=False,
+        na_filter=False,
+        chunksize=batch_size,
+    )
+
+
+def prepare_gtfs_batch(carrier: str, model: models.Model, batch: pd.DataFrame) -> pd.DataFrame:
+    """`prepare_gtfs_row` for a whole batch: replaces empty values with NULL and adds carrier prefixes"""
+    batch = batch.mask(batch == '')
+
+    if model in models_should_have_carrier_prefix:
+        for field in get_carrier_prefix_fields(model):
+            batch[field] = add_carrier_prefix(carrier, '') + batch[field]
+
+    return batch
+
+
+def to_copy_column(values: pd.Series) -> pd.Series:
+    """`to_copy_value` for a whole column of strings"""
+    # Searching the joined column is much faster than a search in every value
+    if COPY_ESCAPED_CHARACTERS.search(''.join(values.dropna().tolist())):
+        for character, escaped in COPY_ESCAPES.items():
+            values = values.str.replace(character, escaped, regex=False)
+
+    return values.fillna(COPY_NULL)
+
+
+def iter_copy_batches(carrier: str, carrier_id: int, model: models.Model, file: io.TextIOBase,
+                      fieldnames: list[str], columns: list[str],
+                      batch_size: int = settings.GTFS_COLUMNAR_BATCH_SIZE) -> Generator[str, None, None]:
+    """Columnar variant of `iter_copy_lines`, turns each batch of rows into one chunk of COPY text"""
+    data_columns = [column for column in columns if column != 'carrier_id']
+
+    for batch in read_gtfs_batches(file, fieldnames, data_columns, batch_size):
+        if batch.empty:
+            continue
+
+        batch = prepare_gtfs_batch(carrier, model, batch)
+        values = [
+            pd.Series(str(carrier_id), index=batch.index) if column == 'carrier_id' else to_copy_column(batch[column])
+            for column in columns
+        ]
+        lines = values[0].str.cat(values[1:], sep='\t')
+        yield '\n'.join(lines.tolist()) + '\n'
+
+
+def iter_copy_data(carrier: str, carrier_id: int, model: models.Model, file: io.TextIOBase,
+                   reader: csv.DictReader, columns: list[str]) -> Iterator[str]:
+    """
+    COPY text of the rest of the file, whose header was already read by `reader`. 
+    Parsed in columns with GTFS_COLUMNAR_READER, row by row otherwise.
+    """
+    if settings.GTFS_COLUMNAR_READER:
+        return iter_copy_batches(carrier, carrier_id, model, file, reader.fieldnames, columns)
+    return iter_copy_lines(carrier, carrier_id, model, reader, columns)
+
+
+class LineStream(io.TextIOBase):
+    """
+    Read-only file object over an iterator of text lines, or of chunks of whole lines.
+    Holds at most one chunk of `buffer_size` characters besides the current item, 
+    so `cursor.copy_expert` can consume a generator of any length in bounded memory.
+    Every chunk is passed through the throttle, if there is one.
+    """
+    def __init__(self, lines: Iterator[str], buffer_size: int, throttle: ImportThrottle | None = None):
+        self._lines = iter(lines)
+        self._buffer_size = buffer_size
+        self._throttle = throttle
+        self._remainder = ''
+        self.lines_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:
+        size = self._buffer_size if size is None or size < 0 else size
+        chunks = [self._remainder]
+        length = len(self._remainder)
+
+        while length < size:
+            try:
+                line = next(self._lines)
+            except StopIteration:
                 break
-                
-        if not file_info:
-            logger.warning(f'File {filename} not found in archive')
-            return
-            
-        with zip_file.open(file_info) as file:
-            decoded_file = io.TextIOWrapper(file, encoding='utf-8')
-            reader = csv.DictReader(decoded_file)
-            batch = []
-
-            for row in reader:
-                batch.append(row)
-                if len(batch) >= batch_size:
-                    yield batch
-                    batch = []
-                    gc.collect()
-                    
-            if batch:
-                yield batch
-                
-    except Exception as e:
-        logger.error(f'Error while processing file {filename}: {e}')
-        return
-    
-def bulk_copy_to_db(model, records: list):
-    """Uses PostgreSQL COPY for fast import"""
-    if not records:
-        return 0
-
-    model_fields = {f.attname: f for f in model._meta.fields if f.attname != 'id'}
-    fields = list(model_fields.keys())
-
-    buffer = io.StringIO()
-    for record in records:
-        row = []
-        for field_name in fields:
-            value = getattr(record, field_name, None)
-            
-            if value is None:
-                row.append('\\N')
-            elif isinstance(value, bool):
-                row.append('t' if value else 'f')
-            else:
-                str_value = str(value)
-                str_value = str_value.replace('\\', '\\\\')
-                str_value = str_value.replace('\n', '\\n')
-                str_value = str_value.replace('\r', '\\r')
-                str_value = str_value.replace('\t', '\\t')
-                row.append(str_value)
-                
-        buffer.write('\t'.join(row) + '\n')
-
-    buffer.seek(0)
-
-    table_name = model._meta.db_table
+
+            chunks.append(line)
+            length += len(line)
+            self.lines_read += 1
+
+        data = ''.join(chunks)
+        self._remainder = data[size:]
+
+        if self._throttle:
+            self._throttle.consume(min(len(data), size))
+
+        return data[:size]
+
+
+def copy_lines_to_db(table_name: str, columns: list[str], lines: Iterator[str], buffer_size: int) -> int:
+    """
+    Streams lines of COPY text into the table and returns the number of copied rows.
+    With GTFS_THROTTLED_IMPORT the lines are written in small chunks at a capped rate.
+    """
+    buffer_size = get_copy_buffer_size(buffer_size)
+    quoted_columns = ', '.join(f'"{column}"' for column in columns)
+    query = f'COPY "{table_name}" ({quoted_columns}) FROM STDIN'
+    throttle = get_import_throttle()
 
     try:
         with connection.cursor() as cursor:
-            cursor.copy_from(
-                buffer, 
-                table_name, 
-                columns=fields,
-                null='\\N'
-            )
-        logger.info(f"Successfully copied {len(records)} records to {table_name}")
-        return len(records)
-    except Exception as e:
-        logger.error(f"Error during COPY for {model._meta.label}: {e}")
-        logger.error(f"Table: {table_name}")
-        logger.error(f"Fields: {fields}")
-        logger.error(f"First record sample: {getattr(records[0], fields[0], 'N/A') if records else 'No records'}")
-        raise
-
-def process_model_batch(carrier: str, model: models.Model, batch_data: List[dict]) -> int:
-    if not batch_data:
-        return 0
-        
-    try:
-        records = convert_gtfs_data_to_model_objects(carrier, model, batch_data)
-        if records:
-            bulk_copy_to_db(model, records)
-        return len(records)
-    except Exception as e:
-        logger.error(f"Error during batch processing for {model._meta.label}: {e}")
-        raise
-
-
-def convert_gtfs_data_to_model_objects(carrier: str, model: models.Model, data_batch: list) -> list:
-    """Converts a batch of data into model objects"""
-     
-    allowed_fields = get_allowed_fields(model)
-    records = []
-
-    if model == CarrierStaging:
-        carrier_name = data_batch[0]['agency_name']
-        carrier_code = carrier
-        carrier = CarrierStaging(carrier_name=carrier_name, carrier_code=carrier_code)
-        return [carrier]
-
-    carrier_obj = CarrierStaging.objects.get(carrier_code=carrier)
-    
-    if model == ShapeSequenceStaging:
-        unique_shape_ids = {row.get('shape_id') for row in data_batch}
-        
-        shapes = []
-        for shape_id in unique_shape_ids:
-            shapes.append(ShapeStaging(shape_id=shape_id, carrier=carrier_obj))
-
-        ShapeStaging.objects.bulk_create(shapes, ignore_conflicts=True)
-
-    for row in data_batch:
-        filtered_row = dict()
+            cursor.copy_expert(query, LineStream(lines, buffer_size, throttle), buffer_size)
+            copied = cursor.rowcount
+    finally:
+        if throttle:
+            throttle.close()
+
+    if throttle and throttle.waited:
+        logger.info(f'COPY into {table_name} was throttled for {throttle.waited:.1f}s')
+    return copied
+
+
+def create_shapes_from_sequences(carrier_id: int) -> None:
+    """Creates shapes for the freshly copied shape points of the carrier"""
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            INSERT INTO "{get_staging_partition(ShapeStaging, carrier_id)}" (shape_id, carrier_id)
+            SELECT DISTINCT shape_id, carrier_id 
+            FROM "{get_staging_partition(ShapeSequenceStaging, carrier_id)}"
+            ON CONFLICT DO NOTHING;
+        ''')
+
+
+@contextmanager
+def open_gtfs_file(zip_file: zipfile.ZipFile, filename: str) -> Generator[io.TextIOWrapper | None, None, None]:
+    """Opens a GTFS file of the archive as text, yields None if the file is missing"""
+    file_info = get_file_info(zip_file, filename)
+
+    if not file_info:
+        logger.warning(f'File {filename} not found in archive')
+        yield None
+        return
+
+    with zip_file.open(file_info) as file:
+        yield io.TextIOWrapper(file, encoding='utf-8', newline='')
+
+
+@contextmanager
+def open_gtfs_reader(zip_file: zipfile.ZipFile, filename: str) -> Generator[csv.DictReader | None, None, None]:
+    """Opens a GTFS file of the archive as a stream of rows, yields None if the file is missing"""
+    with open_gtfs_file(zip_file, filename) as file:
+        yield csv.DictReader(file) if file else None
+
+
+def import_file(zip_file: zipfile.ZipFile, carrier: str, filename: str, 
+                buffer_size: int = settings.GTFS_COPY_BUFFER_SIZE) -> int:
+    """Imports one GTFS file of the archive into its staging table"""
+    model = REQUIRED_MODELS[filename]
+
+    with open_gtfs_file(zip_file, filename) as file:
+        if file is None:
+            return 0
+
+        reader = csv.DictReader(file)
+
+        if model is CarrierStaging:
+            row = next(reader)
+            CarrierStaging.objects.filter(carrier_code=carrier).update(carrier_name=row['agency_name'])
+            return 1
+
+        carrier_id = CarrierStaging.objects.values_list('id', flat=True).get(carrier_code=carrier)
+        columns = get_copy_columns(model, reader.fieldnames)
+        lines = iter_copy_data(carrier, carrier_id, model, file, reader, columns)
+        table_name = get_staging_partition(model, carrier_id)
 
         try:
-            filtered_row['carrier'] = carrier_obj 
-            for k, v in row.items():
-                if k in allowed_fields:
-                    filtered_row[k] = None if v in {None, ''} else v
-            
-            if model in models_should_have_carrier_prefix:
-                filtered_row = add_carrier_prefix_to_fields(carrier, model, filtered_row)                   
-            
-            records.append(model(**filtered_row))
+            with transaction.atomic():
+                copied = copy_lines_to_db(table_name, columns, lines, buffer_size)
+
+                if model is ShapeSequenceStaging:
+                    create_shapes_from_sequences(carrier_id)
         except Exception as e:
-            logger.warning(f"Error in line: {e}")
+            logger.error(f'Error during COPY for {model._meta.label}: {e}')
+            logger.error(f'Table: {table_name}')
+            logger.error(f'Fields: {columns}')
             raise
-            
-    return records
 
+    logger.info(f'Successfully copied {copied} records to {table_name}')
+    return copied
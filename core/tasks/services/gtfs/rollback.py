@@ -0,0 +1,106 @@
+import logging
+
+from django.db import transaction
+
+from trips.models import *
+from common.services.redis import *
+from .models import *
+from .changes import revert_changes
+from .partitions import *
+from .throttle import wait_for_database_capacity
+
+
+logger = logging.getLogger(__name__)
+
+
+class GtfsRollbackError(ValueError):
+    """There is no retained version of the carrier's data to go back to"""
+
+
+def get_live_version(carrier: str) -> dict | None:
+    """Feed hash and file checksums of the carrier's live data, None if the carrier is not live yet"""
+    if not Carrier.objects.filter(carrier_code=carrier).exists():
+        return None
+
+    return {
+        'sha1': get_from_redis(f'{carrier}_sha1'),
+        'checksums': get_gtfs_checksums_from_redis(carrier),
+    }
+
+
+def retain_version(carrier: str, version: dict | None, diff: bool = False) -> None:
+    """
+    Remembers the version that a swap left in the staging partitions,
+    or whose changed rows a diff update left there.
+    """
+    if version is None:
+        return
+    set_retained_gtfs_version_in_redis(version | {'diff': diff}, carrier)
+
+
+def discard_retained_version(carrier: str) -> None:
+    """The staging partitions are about to be overwritten"""
+    remove_from_redis(f'{carrier}_RETAINED_GTFS_VERSION')
+
+
+def revert_carrier_changes(carrier: str) -> None:
+    """
+    A diff update changes the live data in place and keeps the changed rows of the previous version 
+    in the staging partitions, they are written back and the rows they replace are kept instead.
+    """
+    carrier_id = Carrier.objects.values_list('id', flat=True).get(carrier_code=carrier)
+    wait_for_database_capacity()
+
+    with transaction.atomic():
+        changed = revert_changes(carrier_id)
+
+        live_name = Carrier.objects.values_list('carrier_name', flat=True).get(id=carrier_id)
+        staging_name = CarrierStaging.objects.values_list('carrier_name', flat=True).get(id=carrier_id)
+        Carrier.objects.filter(id=carrier_id).update(carrier_name=staging_name)
+        CarrierStaging.objects.filter(id=carrier_id).update(carrier_name=live_name)
+
+    analyze_live_partitions(carrier_id, changed)
+
+
+def restore_version(carrier: str, version: dict) -> None:
+    """Without the checksums of the live data the next import carries nothing over"""
+    if version['sha1']:
+        set_hash_in_redis(version['sha1'], carrier)
+    else:
+        remove_from_redis(f'{carrier}_sha1')
+
+    if version['checksums']:
+        set_gtfs_checksums_in_redis(version['checksums'], carrier)
+    else:
+        remove_from_redis(f'{carrier}_GTFS_CHECKSUMS')
+
+
+def rollback_carrier(carrier: str) -> str | None:
+    """
+    Swaps the retained version of the carrier back in and restores its feed hash and checksums,
+    the rolled back version is retained in turn. The rolled back feed is not imported again.
+    Diff updates retain only the rows they change, which are reverted instead. Returns the hash of the restored feed.
+    """
+    retained = get_retained_gtfs_version_from_redis(carrier)
+
+    if not retained:
+        raise GtfsRollbackError(f'There is no retained GTFS version of {carrier} carrier to roll back to')
+
+    current = get_live_version(carrier)
+
+    if current is None:
+        raise GtfsRollbackError(f'{carrier} carrier is not live, there is nothing to roll back')
+
+    if retained.get('diff'):
+        revert_carrier_changes(carrier)
+    else:
+        swap_carrier_partitions(carrier)
+
+    restore_version(carrier, retained)
+
+    if current['sha1']:
+        set_hash_in_redis(current['sha1'], carrier, 'rejected_sha1')
+    retain_version(carrier, current, retained.get('diff', False))
+
+    logger.info(f'GTFS of {carrier} carrier rolled back from {current["sha1"]} to {retained["sha1"]}')
+    return retained['sha1']
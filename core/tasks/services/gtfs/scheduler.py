@@ -0,0 +1,178 @@
+import os
+import zipfile
+import logging
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterable
+
+from django.conf import settings
+from django.db import connection
+
+from .models import *
+from .download import open_gtfs_archive
+from .process import import_file, get_file_info
+from .metrics import run_measured, record_worker_stage
+from .checksums import carry_over_file
+from .trip_stops import refresh_trip_stops, carry_over_trip_stops
+from .service_days import refresh_service_days
+
+
+logger = logging.getLogger(__name__)
+
+# TripStops are built from the staging trips and stop times as soon as both are imported,
+# with unchanged stop times they are carried over as soon as the trips are
+TRIP_STOPS_NODE = 'trip_stops'
+TRIP_STOPS_DEPENDENCIES = {'trips', 'stop_times'}
+
+# Service days are materialized from the staging calendar dates, imported or carried over
+SERVICE_DAYS_NODE = 'service_days'
+SERVICE_DAYS_DEPENDENCIES = {'calendar_dates'}
+
+
+def get_model_filenames() -> dict[type[models.Model], str]:
+    """Maps every staging model filled during the import to the GTFS file it comes from"""
+    model_filenames = {model: filename for filename, model in REQUIRED_MODELS.items()}
+    model_filenames[ShapeStaging] = 'shapes'  # shapes are created from the shape points
+    return model_filenames
+
+
+def get_file_dependencies(filenames: Iterable[str]) -> dict[str, set[str]]:
+    """Builds the graph of GTFS files from the foreign keys of their staging models"""
+    filenames = set(filenames)
+    model_filenames = get_model_filenames()
+    dependencies = dict()
+
+    for filename in filenames:
+        model = REQUIRED_MODELS[filename]
+        related_models = {field.related_model for field in model._meta.fields if field.many_to_one}
+        related_files = {model_filenames[m] for m in related_models if m in model_filenames}
+        dependencies[filename] = (related_files & filenames) - {filename}
+
+    if TRIP_STOPS_DEPENDENCIES <= filenames:
+        dependencies[TRIP_STOPS_NODE] = set(TRIP_STOPS_DEPENDENCIES)
+
+    if SERVICE_DAYS_DEPENDENCIES <= filenames:
+        dependencies[SERVICE_DAYS_NODE] = set(SERVICE_DAYS_DEPENDENCIES)
+
+    return dependencies
+
+
+def import_file_from_archive(archive_path: str, carrier: str, filename: str, buffer_size: int) -> int:
+    """Worker side of the thread pool for archives on disk: opens its own archive handle and database connection"""
+    try:
+        with open_gtfs_archive(archive_path) as zip_file:
+            return import_file(zip_file, carrier, filename, buffer_size)
+    finally:
+        connection.close()
+
+
+def import_file_in_thread(zip_file: zipfile.ZipFile, carrier: str, filename: str, buffer_size: int) -> int:
+    """Worker side of the thread pool for archives that exist only in memory"""
+    try:
+        return import_file(zip_file, carrier, filename, buffer_size)
+    finally:
+        connection.close()
+
+
+def carry_over_file_in_worker(carrier: str, filename: str) -> int:
+    """Worker side of the thread pool for files that did not change since the last import"""
+    try:
+        return carry_over_file(carrier, filename)
+    finally:
+        connection.close()
+
+
+def refresh_trip_stops_in_worker(carrier: str, carry_over: bool) -> int:
+    """Worker side of the thread pool for the TripStops of the imported trips"""
+    try:
+        if carry_over:
+            carrier_id = CarrierStaging.objects.values_list('id', flat=True).get(carrier_code=carrier)
+            return carry_over_trip_stops(carrier_id)
+        return refresh_trip_stops(carrier)
+    finally:
+        connection.close()
+
+
+def refresh_service_days_in_worker(carrier: str) -> int:
+    """Worker side of the thread pool for the service days of the imported calendar dates"""
+    try:
+        carrier_id = CarrierStaging.objects.values_list('id', flat=True).get(carrier_code=carrier)
+        return refresh_service_days(carrier_id)
+    finally:
+        connection.close()
+
+
+def create_import_executor(workers: int) -> Executor:
+    """
+    Thread pool, every thread opens its own database connection.
+    Imports run in daemonic Celery worker processes, which can not start processes of their own.
+    """
+    return ThreadPoolExecutor(max_workers=workers)
+
+
+def get_archive_path(zip_file: zipfile.ZipFile) -> str | None:
+    filename = zip_file.filename
+    return filename if filename and os.path.isfile(filename) else None
+
+
+def run_import_schedule(zip_file: zipfile.ZipFile, carrier: str, filenames: Iterable[str],
+                        buffer_size: int = settings.GTFS_COPY_BUFFER_SIZE,
+                        workers: int = settings.GTFS_IMPORT_WORKERS,
+                        unchanged_files: Iterable[str] = ()) -> dict[str, int]:
+    """
+    Imports GTFS files in parallel, each on its own database connection.
+    A file starts as soon as all files its staging model refers to are imported.
+    Unchanged files are carried over from the live tables instead of being parsed,
+    unchanged stop times through the TripStops. TripStops are refreshed as soon as the trips and stop times are imported,
+    service days as soon as the calendar dates are.
+    """
+    archive_path = get_archive_path(zip_file)
+    unchanged_files = set(unchanged_files)
+    pending = get_file_dependencies(filenames)
+    imported = dict()
+    running: dict[Future, str] = dict()
+
+    def submit(executor: Executor, filename: str) -> Future:
+        logger.info(f'Start processing the file {filename}')
+
+        if filename == TRIP_STOPS_NODE:
+            return executor.submit(
+                run_measured, refresh_trip_stops_in_worker, carrier, 'stop_times' in unchanged_files)
+        if filename == SERVICE_DAYS_NODE:
+            return executor.submit(run_measured, refresh_service_days_in_worker, carrier)
+        if filename in unchanged_files:
+            return executor.submit(run_measured, carry_over_file_in_worker, carrier, filename)
+        if archive_path:
+            return executor.submit(
+                run_measured, import_file_from_archive, archive_path, carrier, filename, buffer_size)
+        return executor.submit(run_measured, import_file_in_thread, zip_file, carrier, filename, buffer_size)
+
+    def get_bytes_read(filename: str) -> int | None:
+        if filename in (TRIP_STOPS_NODE, SERVICE_DAYS_NODE) or filename in unchanged_files:
+            return None
+        return get_file_info(zip_file, filename).file_size
+
+    with create_import_executor(workers) as executor:
+        try:
+            while pending or running:
+                ready = [filename for filename, deps in pending.items() if deps <= imported.keys()]
+
+                for filename in ready:
+                    del pending[filename]
+                    running[submit(executor, filename)] = filename
+
+                if not running:
+                    raise ValueError(f'Unresolvable dependencies between GTFS files: {pending}')
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    filename = running.pop(future)
+                    result = future.result()
+                    imported[filename] = result.rows
+                    record_worker_stage(f'import:{filename}', result, get_bytes_read(filename))
+                    logger.info(f'Processing of {filename} completed: {imported[filename]} records')
+        except Exception:
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+
+    return imported
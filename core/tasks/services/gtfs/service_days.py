@@ -0,0 +1,39 @@
+import logging
+
+from django.db import connection
+
+from .models import *
+from .partitions import get_staging_partition
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_service_days_query(calendar_table: str) -> str:
+    """
+    Services running on every date of the feed. The feeds have no calendar.txt,
+    so a service runs on the dates it is added on and not removed from.
+    """
+    return f'''
+        SELECT date, service_id, carrier_id FROM "{calendar_table}"
+        WHERE carrier_id = %s
+        GROUP BY date, service_id, carrier_id
+        HAVING bool_and(exception_type = {CalendarDate.ExceptionChoice.ADDED})
+    '''
+
+
+def refresh_service_days(carrier_id: int) -> int:
+    """Materializes the staging service days from the staging calendar dates"""
+    service_days_table = get_staging_partition(ServiceDayStaging, carrier_id)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'TRUNCATE "{service_days_table}";')
+        cursor.execute(f'''
+            INSERT INTO "{service_days_table}" (date, service_id, carrier_id)
+            {get_service_days_query(get_staging_partition(CalendarDateStaging, carrier_id))};
+        ''', [carrier_id])
+        inserted = cursor.rowcount
+
+    logger.info(f'{inserted} service days of the carrier {carrier_id} materialized')
+    return inserted
+
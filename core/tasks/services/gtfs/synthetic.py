@@ -0,0 +1,144 @@
+import io
+import csv
+import random
+import zipfile
+import datetime
+from pathlib import Path
+from typing import Iterable
+
+
+# Approximate size of one week of the WTP feed, multiplied by the benchmark scale
+WTP_FEED_SIZE = {
+    'stops': 7_000,
+    'routes': 300,
+    'trips_per_route_day': 24,
+    'stops_per_trip': 20,
+}
+
+DAY_TYPES = ['PcS', 'PcS', 'PcS', 'PcS', 'PtS', 'SbS', 'NdS']
+
+
+def write_gtfs_file(zip_file: zipfile.ZipFile, filename: str, header: list[str], rows: Iterable[list]) -> int:
+    """Streams the rows into a member of the archive and returns their number"""
+    written = 0
+
+    with zip_file.open(f'{filename}.txt', 'w') as member:
+        with io.TextIOWrapper(member, encoding='utf-8', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+
+            for row in rows:
+                writer.writerow(row)
+                written += 1
+
+    return written
+
+
+def get_route_id(route: int) -> str:
+    # Route ids get the carrier prefix and have to fit into 8 characters together with it
+    return f'{route:x}'
+
+
+def get_stop_id(stop: int) -> str:
+    return f'{stop // 4:06d}0{stop % 4 + 1}'
+
+
+def get_route_pattern(route: int, stops: int, stops_per_trip: int, seed: int) -> list[int]:
+    return random.Random(seed * 1_000_003 + route).sample(range(stops), stops_per_trip)
+
+
+def get_departure(trip: int, trips_per_day: int) -> int:
+    """Departures of a route are spread between 4:30 and 23:30"""
+    return 4 * 3600 + 1800 + trip * (19 * 3600 // trips_per_day)
+
+
+def format_time(seconds: int) -> str:
+    return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+
+
+def generate_gtfs_feed(path: str | Path, scale: float = 1, days: int = 7, seed: int = 0,
+                       start: datetime.date | None = None) -> dict[str, int]:
+    """
+    Writes a synthetic feed shaped like the WTP one (trip ids, stop ids, calendar dates),
+    scale times its size. Rows are generated on the fly, so memory use does not depend on the scale.
+    Returns the number of rows per file.
+    """
+    start = start or datetime.date.today()
+    stops = max(int(WTP_FEED_SIZE['stops'] * scale), WTP_FEED_SIZE['stops_per_trip'])
+    routes = max(int(WTP_FEED_SIZE['routes'] * scale), 1)
+    trips_per_day = WTP_FEED_SIZE['trips_per_route_day']
+    stops_per_trip = WTP_FEED_SIZE['stops_per_trip']
+    rng = random.Random(seed)
+    coordinates = [(52.1 + rng.random() * 0.25, 20.85 + rng.random() * 0.4) for _ in range(stops)]
+    dates = [start + datetime.timedelta(days=day) for day in range(days)]
+    service_ids = [f'{date}:{DAY_TYPES[date.weekday()]}' for date in dates]
+
+    def iter_patterns():
+        for route in range(routes):
+            yield route, get_route_pattern(route, stops, stops_per_trip, seed)
+
+    def iter_trips():
+        for route, _ in iter_patterns():
+            for service_id in service_ids:
+                for trip in range(trips_per_day):
+                    departure = get_departure(trip, trips_per_day)
+                    trip_id = f'{service_id}:{get_route_id(route)}:{trip % 99}:{departure // 3600:02d}{departure % 3600 // 60:02d}'
+                    yield route, trip, trip_id, service_id, departure
+
+    def trips_rows():
+        for route, trip, trip_id, service_id, _ in iter_trips():
+            yield [get_route_id(route), service_id, trip_id, f'Terminal {route}',
+                   trip % 2, f'shape_{route}', 1, str(trip % 99), 'low']
+
+    def stop_times_rows():
+        patterns = dict(iter_patterns())
+
+        for route, _, trip_id, _, departure in iter_trips():
+            for sequence, stop in enumerate(patterns[route]):
+                time = format_time(departure + sequence * 90)
+                yield [trip_id, time, time, get_stop_id(stop), sequence, 0, 0]
+
+    def shapes_rows():
+        for route, pattern in iter_patterns():
+            for sequence, stop in enumerate(pattern, 1):
+                lat, lon = coordinates[stop]
+                yield [f'shape_{route}', f'{lat:.6f}', f'{lon:.6f}', sequence]
+
+    written = dict()
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        written['agency'] = write_gtfs_file(
+            zip_file, 'agency', ['agency_id', 'agency_name', 'agency_url', 'agency_timezone'],
+            [['1', f'Synthetic transport x{scale}', 'https://example.com', 'Europe/Warsaw']]
+        )
+        written['stops'] = write_gtfs_file(
+            zip_file, 'stops',
+            ['stop_id', 'stop_name', 'stop_code', 'stop_lat', 'stop_lon', 'location_type', 'wheelchair_boarding'],
+            ([get_stop_id(stop), f'Stop {stop // 4}', f'0{stop % 4 + 1}', f'{lat:.6f}', f'{lon:.6f}', 0, 1]
+             for stop, (lat, lon) in enumerate(coordinates))
+        )
+        written['routes'] = write_gtfs_file(
+            zip_file, 'routes',
+            ['route_id', 'agency_id', 'route_short_name', 'route_long_name', 'route_type', 'route_color', 'route_text_color'],
+            ([get_route_id(route), '1', get_route_id(route), f'Route {route}', 3, '880000', 'FFFFFF']
+             for route in range(routes))
+        )
+        written['calendar_dates'] = write_gtfs_file(
+            zip_file, 'calendar_dates', ['service_id', 'date', 'exception_type'],
+            ([service_id, date.strftime('%Y%m%d'), 1] for service_id, date in zip(service_ids, dates))
+        )
+        written['shapes'] = write_gtfs_file(
+            zip_file, 'shapes', ['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence'], shapes_rows()
+        )
+        written['trips'] = write_gtfs_file(
+            zip_file, 'trips',
+            ['route_id', 'service_id', 'trip_id', 'trip_headsign', 'direction_id', 'shape_id',
+             'wheelchair_accessible', 'brigade', 'fleet_type'],
+            trips_rows()
+        )
+        written['stop_times'] = write_gtfs_file(
+            zip_file, 'stop_times',
+            ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence', 'pickup_type', 'drop_off_type'],
+            stop_times_rows()
+        )
+
+    return written
@@ -1,18 +1,22 @@
-import requests
-import zipfile
 import logging
-import io
 import gc
 import os
+from pathlib import Path
 
 from django.conf import settings
 from django.core.management import CommandError
 from django_celery_beat.models import PeriodicTask, CrontabSchedule, IntervalSchedule
 
 from common.services.redis import *
-from common.models import Route
-from .download import get_from_feed
-from .db_operations import import_to_staging, refresh_trip_stops
+from common.models import Carrier, Route
+from .download import get_from_feed, download_gtfs, open_gtfs_archive
+from .db_operations import import_to_staging
+from .diff import apply_gtfs_diff
+from .validation import validate_feed
+from .rollback import discard_retained_version
+from .checksums import get_unchanged_files, save_member_checksums
+from .metrics import track_stage
+from .warmup import get_warmed_keys
 
 
 logger = logging.getLogger(__name__)
@@ -90,6 +94,7 @@ def clear_gtfs_cache(carrier:str):
 
         if carrier == 'WTP':
             keys_to_delete += list(get_redis_keys_by_regexp('WTP_ROUTE_SCHEDULE_*'))
+        keys_to_delete += get_warmed_keys(carrier)
             
         remove_from_redis(*keys_to_delete)
         logger.info(f"Cleared {len(keys_to_delete)} GTFS cache keys for {carrier}")
@@ -139,38 +144,50 @@ def validate_interval(options) -> IntervalSchedule | None:
         return None
 
 
-def update_sha_in_redis(feed, carrier:str):
+def update_sha_in_redis(feed, carrier:str, suffix:str = 'sha1'):
     feed_sha = get_from_feed(feed, 'sha1')
-    set_hash_in_redis(feed_sha, carrier)
+    set_hash_in_redis(feed_sha, carrier, suffix)
+
+
+def download_gtfs_archive(feed) -> Path:
+    with track_stage('download') as stage:
+        archive_path = download_gtfs(feed)
+        stage.bytes_read = archive_path.stat().st_size
+
+    return archive_path
 
 
 def download_and_process_gtfs(feed, carrier: str):
-    url = get_from_feed(feed, 'url')
-    
-    logger.info('Start downloading GTFS archive...')
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
-    
-    gtfs_buffer = io.BytesIO()
+    archive_path = download_gtfs_archive(feed)
     
-    total_size = 0
-    chunk_size = 128_000
-    
-    for chunk in response.iter_content(chunk_size=chunk_size):
-        if chunk:
-            gtfs_buffer.write(chunk)
-            total_size += len(chunk)
-    
-    logger.info(f'Download complete. Size: {total_size // (1024 * 1024)} MB')
-    
-    gtfs_buffer.seek(0)
-    
-    try:
-        with zipfile.ZipFile(gtfs_buffer) as zip_file:
-            import_to_staging(zip_file, carrier, batch_size=500_000)
-    finally:
-        gtfs_buffer.close()
-        del gtfs_buffer
-        gc.collect()
-
-    refresh_trip_stops()
+    with open_gtfs_archive(archive_path) as zip_file:
+        with track_stage('import_to_staging') as stage:
+            imported = import_to_staging(zip_file, carrier)
+            stage.rows = sum(imported.values())
+
+        save_member_checksums(zip_file, carrier)
+
+
+def is_diff_import_possible(carrier: str) -> bool:
+    """Changes can only be applied to a carrier that is already in the live tables"""
+    return settings.GTFS_DIFF_IMPORT and Carrier.objects.filter(carrier_code=carrier).exists()
+
+
+def download_and_apply_gtfs_diff(feed, carrier: str):
+    archive_path = download_gtfs_archive(feed)
+
+    with open_gtfs_archive(archive_path) as zip_file:
+        # A rejected feed leaves the retained version in place
+        validate_feed(zip_file)
+
+        # The changed rows of the live version replace the retained version in staging
+        discard_retained_version(carrier)
+
+        with track_stage('apply_gtfs_diff') as stage:
+            results = apply_gtfs_diff(zip_file, carrier, unchanged_files=get_unchanged_files(zip_file, carrier))
+            written = sum(sum(result) for result in results.values())
+            stage.rows = written
+
+        save_member_checksums(zip_file, carrier)
+
+    logger.info(f'GTFS changes for {carrier} applied: {written} rows written')
@@ -0,0 +1,155 @@
+import time
+import logging
+from datetime import datetime, time as dt_time, timedelta
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone as tz
+
+
+logger = logging.getLogger(__name__)
+
+DATABASE_PRESSURE_QUERY = '''
+    SELECT
+        (SELECT count(*) FROM pg_stat_activity
+         WHERE backend_type = 'client backend' AND state = 'active' AND pid <> pg_backend_pid()),
+        (SELECT count(*) FROM pg_stat_activity
+         WHERE wait_event_type = 'Lock' AND NOT %(worker_pid)s = ANY(pg_blocking_pids(pid))),
+        (SELECT coalesce(max(extract(epoch FROM replay_lag)), 0) FROM pg_stat_replication);
+'''
+
+
+class DatabasePressure(NamedTuple):
+    active_backends: int
+    lock_waits: int
+    replication_lag: float
+
+    def is_high(self) -> bool:
+        return (
+            self.active_backends > settings.GTFS_THROTTLE_MAX_ACTIVE_BACKENDS
+            or self.lock_waits > settings.GTFS_THROTTLE_MAX_LOCK_WAITS
+            or self.replication_lag > settings.GTFS_THROTTLE_MAX_REPLICATION_LAG
+        )
+
+
+class ImportThrottle:
+    """
+    Caps the rate at which one import worker writes, and pauses it while the API feels the database:
+    too many active queries, queries waiting for locks or replicas falling behind.
+    The pressure is read on a connection of its own, the worker's connection is busy with COPY.
+    Queries waiting for the locks of the worker itself do not count, the worker would wait for itself.
+    """
+    def __init__(self, bytes_per_second: float, check_interval: float = settings.GTFS_THROTTLE_CHECK_INTERVAL):
+        self.bytes_per_second = bytes_per_second
+        self.check_interval = check_interval
+        self.waited = 0.0
+        self._written = 0
+        self._started = time.monotonic()
+        self._checked = 0.0
+        self._monitor = None
+        connection.ensure_connection()
+        self._worker_pid = connection.connection.get_backend_pid()
+
+    def get_pressure(self) -> DatabasePressure:
+        if self._monitor is None:
+            self._monitor = connection.get_new_connection(connection.get_connection_params())
+            self._monitor.autocommit = True
+
+        with self._monitor.cursor() as cursor:
+            cursor.execute(DATABASE_PRESSURE_QUERY, {'worker_pid': self._worker_pid})
+            active_backends, lock_waits, replication_lag = cursor.fetchone()
+
+        return DatabasePressure(active_backends, lock_waits, float(replication_lag))
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+        self.waited += seconds
+
+    def wait_for_capacity(self) -> None:
+        """Blocks while the database is under pressure, backing off exponentially"""
+        self._checked = time.monotonic()
+        backoff = settings.GTFS_THROTTLE_BACKOFF
+
+        while (pressure := self.get_pressure()).is_high():
+            logger.info(f'Database is under pressure ({pressure}), pausing the import for {backoff:.1f}s')
+            self.sleep(backoff)
+            backoff = min(backoff * 2, settings.GTFS_THROTTLE_MAX_BACKOFF)
+
+        self._checked = time.monotonic()
+
+    def consume(self, size: int) -> None:
+        """Accounts for `size` written bytes, sleeping as long as the worker is ahead of its rate"""
+        self._written += size
+        ahead = self._written / self.bytes_per_second - (time.monotonic() - self._started)
+
+        if ahead > 0:
+            self.sleep(ahead)
+
+        if time.monotonic() - self._checked >= self.check_interval:
+            self.wait_for_capacity()
+
+    def close(self) -> None:
+        if self._monitor is not None:
+            self._monitor.close()
+            self._monitor = None
+
+    def __enter__(self) -> 'ImportThrottle':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def get_import_throttle() -> ImportThrottle | None:
+    """Throttle of one import worker with GTFS_THROTTLED_IMPORT, the write rate is shared by all workers"""
+    if not settings.GTFS_THROTTLED_IMPORT:
+        return None
+    return ImportThrottle(settings.GTFS_THROTTLE_BYTES_PER_SECOND / settings.GTFS_IMPORT_WORKERS)
+
+
+def get_copy_buffer_size(buffer_size: int) -> int:
+    """Smaller COPY chunks with GTFS_THROTTLED_IMPORT, so the rate cap is applied evenly"""
+    if not settings.GTFS_THROTTLED_IMPORT:
+        return buffer_size
+    return min(buffer_size, settings.GTFS_THROTTLE_BUFFER_SIZE)
+
+
+def wait_for_database_capacity() -> None:
+    """Lets the API through before a large statement that can not be throttled while it runs"""
+    if throttle := get_import_throttle():
+        with throttle:
+            throttle.wait_for_capacity()
+
+
+def parse_import_window(window: str) -> tuple[dt_time, dt_time] | None:
+    """'HH:MM-HH:MM' in local time, the window may pass midnight. None if imports are allowed any time"""
+    if not window:
+        return None
+
+    start, end = (dt_time.fromisoformat(value.strip()) for value in window.split('-'))
+    return start, end
+
+
+def is_in_import_window(now: datetime | None = None, window: str = settings.GTFS_IMPORT_WINDOW) -> bool:
+    if not (bounds := parse_import_window(window)):
+        return True
+
+    start, end = bounds
+    current = (now or tz.localtime()).time()
+
+    if start <= end:
+        return start <= current < end
+    return current >= start or current < end
+
+
+def get_next_import_window(now: datetime | None = None, window: str = settings.GTFS_IMPORT_WINDOW) -> datetime:
+    """Start of the next import window, `now` if imports are allowed right now"""
+    now = now or tz.localtime()
+
+    if is_in_import_window(now, window):
+        return now
+
+    start, _ = parse_import_window(window)
+    next_start = now.replace(hour=start.hour, minute=start.minute, second=0, microsecond=0)
+    return next_start if next_start > now else next_start + timedelta(days=1)
@@ -0,0 +1,111 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+from trips.models import *
+from .models import *
+from .partitions import get_partition_name, get_staging_partition
+from .throttle import wait_for_database_capacity
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_trip_id_ranges(carrier_id: int, chunk_size: int) -> list[tuple[str | None, str | None]]:
+    """Splits the carrier's staging trips into ranges of trip_id of about chunk_size trips each"""
+    trips_table = get_staging_partition(TripStaging, carrier_id)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT count(*) FROM "{trips_table}";')
+        chunks = -(-cursor.fetchone()[0] // chunk_size)
+
+        if chunks < 2:
+            return [(None, None)]
+
+        cursor.execute(f'''
+            SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY trip_id) FROM "{trips_table}";
+        ''', [[i / chunks for i in range(1, chunks)]])
+        bounds = sorted(set(cursor.fetchone()[0]))
+
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def insert_trip_stops(carrier_id: int, start: str | None, end: str | None) -> int:
+    """
+    Builds the staging TripStops of the trips in [start, end) and their patterns on its own connection.
+    Chunks sharing a pattern insert it once, the pattern_id is the hash of the pattern.
+    """
+    where_filters = {'t.carrier_id': carrier_id}
+    if start is not None:
+        where_filters['s.trip_id__gte'] = start
+    if end is not None:
+        where_filters['s.trip_id__lt'] = end
+
+    definition = TripStopsStaging._get_definition(
+        from_table=get_staging_partition(StopTimeStaging, carrier_id),
+        join_table=get_staging_partition(TripStaging, carrier_id),
+        **where_filters
+    )
+    statement, params = TripStopsStaging._get_insert(
+        definition,
+        trip_stops_table=get_staging_partition(TripStopsStaging, carrier_id),
+        patterns_table=get_staging_partition(TripPatternStaging, carrier_id),
+    )
+
+    try:
+        wait_for_database_capacity()
+
+        with connection.cursor() as cursor:
+            cursor.execute(statement, params)
+            return cursor.rowcount
+    finally:
+        connection.close()
+
+
+def carry_over_trip_stops(carrier_id: int) -> int:
+    """
+    Stop times did not change, so the staging trips keep the live patterns and starts,
+    trips removed from the feed are left out. The stop times are not loaded at all.
+    """
+    definition = TripStopsStaging._get_carried_over_definition(
+        from_table=get_partition_name(get_table_name(TripStops), carrier_id),
+        patterns_table=get_partition_name(get_table_name(TripPattern), carrier_id),
+        join_table=get_staging_partition(TripStaging, carrier_id),
+    )
+    statement, params = TripStopsStaging._get_insert(
+        definition,
+        trip_stops_table=get_staging_partition(TripStopsStaging, carrier_id),
+        patterns_table=get_staging_partition(TripPatternStaging, carrier_id),
+    )
+    wait_for_database_capacity()
+
+    with connection.cursor() as cursor:
+        cursor.execute(statement, params)
+        return cursor.rowcount
+
+
+def refresh_trip_stops(carrier: str, workers: int = settings.GTFS_IMPORT_WORKERS,
+                       chunk_size: int = settings.GTFS_TRIP_STOPS_CHUNK_SIZE) -> int:
+    """
+    Rebuilds the staging TripStops of one carrier. 
+    Large carriers are split by trip_id range into chunks built in parallel.
+    """
+    logger.info("Refreshing data in the TripStops unlogged table...")
+
+    carrier_id = CarrierStaging.objects.values_list('id', flat=True).get(carrier_code=carrier)
+    ranges = get_trip_id_ranges(carrier_id, chunk_size)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            TRUNCATE "{get_staging_partition(TripStopsStaging, carrier_id)}",
+                "{get_staging_partition(TripPatternStaging, carrier_id)}";
+        ''')
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(insert_trip_stops, carrier_id, start, end) for start, end in ranges]
+        inserted = sum(future.result() for future in futures)
+
+    logger.info(f"The data in the TripStops table successfully updated: {inserted} trips in {len(ranges)} chunks")
+    return inserted
@@ -0,0 +1,165 @@
+import csv
+import logging
+import zipfile
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .models import *
+from .process import get_file_info, open_gtfs_file, read_gtfs_batches
+from .scheduler import get_model_filenames
+from .metrics import track_stage
+
+
+logger = logging.getLogger(__name__)
+
+
+class GtfsValidationError(ValueError):
+    """The feed can not be imported, nothing was written to the database"""
+
+
+def get_required_columns(model: models.Model) -> list[str]:
+    """Columns that are NOT NULL in the database and have no default"""
+    return [
+        field.attname for field in model._meta.fields
+        if not field.null and not field.has_default() and not field.generated
+        and field.attname not in {'id', 'carrier_id'}
+    ]
+
+
+def get_unique_keys(model: models.Model) -> list[tuple[str, ...]]:
+    """Keys unique within one carrier: the primary key and `unique_together`, without the carrier"""
+    keys = list()
+    pk = model._meta.pk
+
+    if pk.attname != 'id':
+        keys.append((pk.attname,))
+
+    for fields in model._meta.unique_together:
+        keys.append(tuple(model._meta.get_field(name).attname for name in fields if name != 'carrier'))
+
+    return keys
+
+
+def get_references(filenames: set[str]) -> list[tuple[str, str, str, str]]:
+    """(file, column, referenced file, referenced column) of the foreign keys between the files"""
+    model_filenames = get_model_filenames()
+    references = list()
+
+    for filename in filenames:
+        for field in REQUIRED_MODELS[filename]._meta.fields:
+            related_filename = model_filenames.get(field.related_model) if field.many_to_one else None
+
+            # The carrier does not come from the file
+            if related_filename in {None, filename, 'agency'}:
+                continue
+            references.append((filename, field.attname, related_filename, field.target_field.attname))
+
+    return references
+
+
+def hash_values(values: pd.Series | pd.DataFrame) -> np.ndarray:
+    """64-bit hashes of the values or of the rows, a collision within one feed is practically impossible"""
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+
+def count_duplicates(hashes: list[np.ndarray]) -> int:
+    hashes = np.concatenate(hashes) if hashes else np.empty(0, dtype=np.uint64)
+    return len(hashes) - len(np.unique(hashes))
+
+
+def validate_gtfs_feed(zip_file: zipfile.ZipFile, batch_size: int = settings.GTFS_COLUMNAR_BATCH_SIZE) -> int:
+    """
+    Checks the feed before anything is written: required columns and values, unique keys and references
+    between the files. Every file is read once, only in the columns needed, keys are kept as hashes.
+    Raises GtfsValidationError with all problems found, returns the number of validated rows.
+    """
+    filenames = {filename for filename in REQUIRED_MODELS if get_file_info(zip_file, filename)}
+    filenames.discard('agency')
+    references = get_references(filenames)
+    referenced_columns = defaultdict(set)
+    errors = list()
+
+    for _, _, related_filename, related_column in references:
+        referenced_columns[related_filename].add(related_column)
+
+    fieldnames = dict()
+    for filename in filenames:
+        with open_gtfs_file(zip_file, filename) as file:
+            fieldnames[filename] = csv.DictReader(file).fieldnames or []
+
+        missing = set(get_required_columns(REQUIRED_MODELS[filename])) - set(fieldnames[filename])
+        if missing:
+            errors.append(f'{filename}: missing columns {sorted(missing)}')
+
+    # Without the columns the values can not be checked
+    if errors:
+        raise GtfsValidationError(f'Invalid GTFS feed: {"; ".join(errors)}')
+
+    key_hashes = defaultdict(list)
+    value_hashes = defaultdict(list)
+    rows = 0
+
+    for filename in sorted(filenames):
+        model = REQUIRED_MODELS[filename]
+        required_columns = get_required_columns(model)
+        unique_keys = get_unique_keys(model)
+        value_columns = referenced_columns[filename] | {
+            column for child, column, _, _ in references if child == filename
+        }
+        columns = sorted(set(required_columns) | value_columns.intersection(fieldnames[filename])
+                         | {column for key in unique_keys for column in key})
+        empty_values = pd.Series(0, index=required_columns)
+
+        with open_gtfs_file(zip_file, filename) as file:
+            next(csv.reader(file), None)  # header
+
+            for batch in read_gtfs_batches(file, fieldnames[filename], columns, batch_size):
+                rows += len(batch)
+                empty_values += (batch[required_columns] == '').sum()
+
+                for key in unique_keys:
+                    key_hashes[filename, key].append(hash_values(batch[list(key)]))
+
+                for column in value_columns.intersection(batch.columns):
+                    values = batch[column]
+                    value_hashes[filename, column].append(np.unique(hash_values(values[values != ''])))
+
+        for column, count in empty_values[empty_values > 0].items():
+            errors.append(f'{filename}: {count} rows without {column}')
+
+        for key in unique_keys:
+            duplicates = count_duplicates(key_hashes.pop((filename, key), []))
+            if duplicates:
+                errors.append(f'{filename}: {duplicates} duplicated values of {", ".join(key)}')
+
+    for filename, column, related_filename, related_column in references:
+        values = value_hashes.get((filename, column))
+        related_values = value_hashes.get((related_filename, related_column))
+
+        if not values:
+            continue
+
+        values = np.unique(np.concatenate(values))
+        related_values = np.concatenate(related_values) if related_values else np.empty(0, dtype=np.uint64)
+        missing = np.count_nonzero(~np.isin(values, related_values))
+
+        if missing:
+            errors.append(f'{filename}.{column}: {missing} values not found in {related_filename}.{related_column}')
+
+    if errors:
+        raise GtfsValidationError(f'Invalid GTFS feed: {"; ".join(errors)}')
+
+    logger.info(f'GTFS feed is valid: {rows} rows checked')
+    return rows
+
+
+def validate_feed(zip_file: zipfile.ZipFile) -> None:
+    """Validates the feed before an import if GTFS_VALIDATE_FEED is on"""
+    if not settings.GTFS_VALIDATE_FEED:
+        return
+
+    with track_stage('validate_gtfs_feed') as stage:
+        stage.rows = validate_gtfs_feed(zip_file)
@@ -0,0 +1,86 @@
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone as tz
+
+from common.models import Carrier, Route
+from common.services.redis import redis_client, get_redis_keys_by_regexp, remove_from_redis
+from .metrics import track_stage
+
+
+logger = logging.getLogger(__name__)
+
+# Keys filled by the warm-up besides STOP_LIST, stale ones are left by removed routes and past days
+WARMED_KEY_PATTERNS = ('{carrier}_ROUTE_DETAILS_*', '{carrier}_DEPARTURES_*')
+
+
+def get_warmed_keys(carrier: str) -> list[str]:
+    return [
+        key
+        for pattern in WARMED_KEY_PATTERNS
+        for key in get_redis_keys_by_regexp(pattern.format(carrier=carrier)) or []
+    ]
+
+
+def warm_up_in_thread(func: Callable, *args) -> bool:
+    """Worker side of the warm-up pool, a failed key stays cold and is filled by the first request"""
+    try:
+        func(*args)
+        return True
+    except Exception as e:
+        logger.warning(f'Unable to warm up {func.__name__}{args}: {e}')
+        return False
+    finally:
+        connection.close()
+
+
+def warm_up_gtfs_cache(carrier: str, workers: int = settings.GTFS_WARMUP_WORKERS) -> dict[str, tuple[int, int]]:
+    """
+    Fills the Redis cache right after an update, so the first users do not wait for cold tables:
+    the stop list, the details of every route of the carrier and today's departure boards of all its stops,
+    which are built together. Returns the number of warmed and of all jobs for each kind.
+    """
+    # The views import the GTFS services themselves
+    from routes.services.views import cache_route_details
+    from stops.services.views import cache_stop_list, cache_departure_boards
+
+    carrier_id = Carrier.objects.values_list('id', flat=True).get(carrier_code=carrier)
+    today = tz.localdate()
+
+    if stale_keys := get_warmed_keys(carrier):
+        remove_from_redis(*stale_keys)
+
+    jobs = {
+        'stop_list': [(cache_stop_list,)],
+        'route_details': [
+            (cache_route_details, route)
+            for route in Route.objects.filter(carrier_id=carrier_id).select_related('carrier')
+        ],
+        'departures': [(cache_departure_boards, carrier, today)],
+    }
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures: dict[str, list[Future]] = {
+            kind: [executor.submit(warm_up_in_thread, *job) for job in kind_jobs]
+            for kind, kind_jobs in jobs.items()
+        }
+
+    coverage = {kind: (sum(f.result() for f in kind_futures), len(kind_futures)) for kind, kind_futures in futures.items()}
+    logger.info(f'GTFS cache of {carrier} carrier warmed up: ' + ', '.join(
+        f'{kind} {warmed}/{total}' for kind, (warmed, total) in coverage.items()
+    ))
+    return coverage
+
+
+def warm_up_cache(carrier: str) -> None:
+    """Warm-up stage of the GTFS update, skipped when Redis is unavailable"""
+    if redis_client is None:
+        logger.warning('Redis is unavailable, GTFS cache is not warmed up')
+        return
+
+    with track_stage('warm_up_cache') as stage:
+        coverage = warm_up_gtfs_cache(carrier)
+        stage.rows = sum(warmed for warmed, _ in coverage.values())
@@ -4,6 +4,7 @@ import logging
 
 from django.conf import settings
 
+from .models import GtfsUpdateRun
 from .services import *
 from common.services.mongo import *
 from common.services.redis import *
@@ -28,14 +29,21 @@ def on_worker_ready(sender, **kwargs):
 @shared_task
 def check_gtfs_updates():
     was_any_updated = False
+    carriers = []
+
+    if not is_in_import_window():
+        logger.info(f'Outside of the GTFS import window, the next one starts at {get_next_import_window()}')
+        return
 
     for carrier in settings.ALLOWED_CARRIERS:
         if check_task_availability(carrier):
             logger.info(f'A separate task for updating GTFS for {carrier} carrier exists. Skipping...')
             continue
+        carriers.append(carrier)
 
-        feed = get_recent_feed(carrier)
+    feeds = get_recent_feeds(carriers)
 
+    for carrier, feed in feeds.items():
         if is_feed_new(feed, carrier):
             if not was_any_updated:
                 was_any_updated = True
@@ -52,28 +60,75 @@ def check_gtfs_updates():
 @shared_task(queue = 'gtfs_updates')
 def update_gtfs(feed, carrier: str):
     logger.info(f'Running GTFS update task for {carrier} carrier...')
+    diff_import = is_diff_import_possible(carrier)
+    mode = GtfsUpdateRun.ModeChoice.DIFF if diff_import else GtfsUpdateRun.ModeChoice.FULL
+    previous_version = get_live_version(carrier)
     
-    try:
-        logger.info("Updating GTFS feed hash...")
-        update_sha_in_redis(feed, carrier)
-
-        logger.info('Updated! Importing GTFS...')
-        download_and_process_gtfs(feed, carrier)
-
-        logger.info("Import complete! Table rearrangement...")
-        swap_tables()
-
-        logger.info('The rearrangement is successful! Backing up...')
-    except Exception as e:
-        logger.error(f'Error during import to test tables: {e}')
-        remove_from_redis(f'{carrier}_sha1')
+    with track_run(carrier, get_from_feed(feed, 'sha1'), mode) as run:
+        try:
+            if diff_import:
+                logger.info('Applying GTFS changes...')
+                download_and_apply_gtfs_diff(feed, carrier)
+                retain_version(carrier, previous_version, diff=True)
+                logger.info('The changes are applied!')
+            else:
+                logger.info('Importing GTFS...')
+                download_and_process_gtfs(feed, carrier)
+
+                logger.info("Import complete! Table rearrangement...")
+                with track_stage('swap_tables'):
+                    swap_tables(carrier)
+                retain_version(carrier, previous_version)
+
+                logger.info('The rearrangement is successful!')
+
+            # The hash names the live data, so it is written only once the feed is live
+            logger.info('Updating GTFS feed hash...')
+            update_sha_in_redis(feed, carrier)
+            bump_stops_version_in_redis()
+            prune_gtfs_cache()
+        except GtfsValidationError as e:
+            # Nothing was written, the same feed is not retried until a new one is published
+            logger.error(f'GTFS feed for {carrier} carrier rejected: {e}')
+            mark_run_failed(run, e)
+            update_sha_in_redis(feed, carrier, 'rejected_sha1')
+        except GtfsArchiveNotModifiedError as e:
+            # Nothing was downloaded, the next check asks the server again with a conditional request
+            logger.warning(f'GTFS feed for {carrier} carrier skipped: {e}')
+            mark_run_failed(run, e)
+        except Exception as e:
+            # The hash of the live feed is kept, the failed one is retried on the next check
+            logger.error(f'Error during import to test tables: {e}')
+            mark_run_failed(run, e)
+            remove_member_checksums(carrier)
+
+        logger.info('Updating carriers cache...')
+        with track_stage('cache_carriers_info'):
+            cache_carriers_info()
+
+        logger.info('Warming up GTFS cache...')
+        warm_up_cache(carrier)
 
-    backup_from_regular_tables()
-    logger.info('The backup was successful! Updating carriers cache...')
-    cache_carriers_info()
     logger.info('Updated! Updating GTFS was finished successfuly!')
     gc.collect()
         
+@shared_task(queue = 'gtfs_updates')
+def rollback_gtfs(carrier: str):
+    logger.info(f'Rolling back GTFS of {carrier} carrier...')
+
+    with track_run(carrier, None, GtfsUpdateRun.ModeChoice.ROLLBACK) as run:
+        with track_stage('swap_tables'):
+            run.feed_sha1 = rollback_carrier(carrier)
+        bump_stops_version_in_redis()
+
+        clear_gtfs_cache(carrier)
+        with track_stage('cache_carriers_info'):
+            cache_carriers_info()
+
+        warm_up_cache(carrier)
+
+    logger.info(f'GTFS of {carrier} carrier was rolled back to {run.feed_sha1}')
+
 @shared_task
 def update_gtfs_realtime(feed_name):
     logger.info(f'Searching recent feed for {feed_name}...')
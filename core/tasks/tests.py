@@ -0,0 +1,117 @@
+import tempfile
+import zipfile
+from pathlib import Path
+from unittest import mock
+
+import fakeredis
+from django.test import TransactionTestCase
+
+import common.services.redis as redis_service
+from common.models import Carrier
+from trips.models import TripStops
+from trips.services.models import get_stop_times
+from .models import GtfsUpdateRun
+from .services.gtfs import generate_gtfs_feed, remove_carrier, get_hash_from_redis, is_feed_new
+from .tasks import update_gtfs, rollback_gtfs
+
+
+def get_feed(sha1: str) -> dict:
+    return {'feeds': [{'feed_versions': [{'sha1': sha1, 'url': f'https://example.com/{sha1}.zip'}]}]}
+
+
+def get_feed_sha1(feed: dict) -> str:
+    return feed['feeds'][0]['feed_versions'][0]['sha1']
+
+
+def write_invalid_feed(source: Path, path: Path) -> None:
+    """A copy of the feed with its last trip duplicated"""
+    with zipfile.ZipFile(source) as source_zip, zipfile.ZipFile(path, 'w') as invalid_zip:
+        for name in source_zip.namelist():
+            content = source_zip.read(name)
+            if name == 'trips.txt':
+                content += content.rstrip(b'\r\n').rsplit(b'\n', 1)[-1] + b'\n'
+            invalid_zip.writestr(name, content)
+
+
+class DiffUpdateRollbackTest(TransactionTestCase):
+    """A diff update followed by a rollback brings back the data of the previous feed"""
+    carrier = 'BN'
+
+    def setUp(self):
+        self.feeds_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.feeds_dir.cleanup)
+
+        # Feeds of different seeds share ids and differ in their times, so the second one is a real diff
+        self.archives = dict()
+        for sha1, seed in (('A', 0), ('B', 1)):
+            self.archives[sha1] = Path(self.feeds_dir.name) / f'{sha1}.zip'
+            generate_gtfs_feed(self.archives[sha1], scale=0.02, days=2, seed=seed)
+        self.archives['C'] = Path(self.feeds_dir.name) / 'C.zip'
+        write_invalid_feed(self.archives['A'], self.archives['C'])
+
+        patches = [
+            mock.patch.object(redis_service, 'redis_client', fakeredis.FakeRedis(decode_responses=True)),
+            mock.patch('tasks.services.gtfs.tasks.download_gtfs', lambda feed: self.archives[get_feed_sha1(feed)]),
+            mock.patch('tasks.services.gtfs.tasks.settings.GTFS_DIFF_IMPORT', True),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        remove_carrier(self.carrier)
+
+    def get_last_run(self) -> GtfsUpdateRun:
+        return GtfsUpdateRun.objects.filter(carrier_code=self.carrier).latest('started_at')
+
+    def assertLastRun(self, mode: str):
+        run = self.get_last_run()
+        self.assertEqual((run.mode, run.status, run.error), (mode, GtfsUpdateRun.StatusChoice.SUCCESS, None))
+
+    def get_live_data(self) -> tuple[list, list]:
+        trip_stops = TripStops.objects.filter(carrier__carrier_code=self.carrier).order_by('trip_id')
+        stop_times = [
+            (stop_time.trip_id, stop_time.stop_sequence, stop_time.stop_id,
+             stop_time.arrival_time, stop_time.departure_time)
+            for stop_time in get_stop_times(trip_stops)
+        ]
+        trip_stops = trip_stops.values_list('trip_id', 'direction_id', 'route_id', 'stop_ids', 'pattern_id', 'start_seconds')
+        return stop_times, list(trip_stops)
+
+    def test_rollback_after_diff_update(self):
+        update_gtfs(get_feed('A'), self.carrier)
+        self.assertLastRun(GtfsUpdateRun.ModeChoice.FULL)
+        self.assertTrue(Carrier.objects.filter(carrier_code=self.carrier).exists())
+        data_a = self.get_live_data()
+        self.assertTrue(data_a[0])
+
+        # The carrier is live, so the second feed is applied as a diff
+        update_gtfs(get_feed('B'), self.carrier)
+        self.assertLastRun(GtfsUpdateRun.ModeChoice.DIFF)
+        self.assertEqual(get_hash_from_redis(self.carrier), 'B')
+        self.assertNotEqual(self.get_live_data(), data_a)
+
+        rollback_gtfs(self.carrier)
+        self.assertLastRun(GtfsUpdateRun.ModeChoice.ROLLBACK)
+        self.assertEqual(get_hash_from_redis(self.carrier), 'A')
+        self.assertEqual(self.get_live_data(), data_a)
+
+    def test_rollback_after_rejected_diff_update(self):
+        update_gtfs(get_feed('A'), self.carrier)
+        data_a = self.get_live_data()
+        update_gtfs(get_feed('B'), self.carrier)
+        data_b = self.get_live_data()
+
+        # The invalid feed is rejected before anything is written, the version of feed A is still retained
+        update_gtfs(get_feed('C'), self.carrier)
+        run = self.get_last_run()
+        self.assertEqual((run.mode, run.status), (GtfsUpdateRun.ModeChoice.DIFF, GtfsUpdateRun.StatusChoice.FAILED))
+        self.assertIn('duplicated values of trip_id', run.error)
+        self.assertEqual(self.get_live_data(), data_b)
+        self.assertEqual(get_hash_from_redis(self.carrier), 'B')
+        self.assertEqual(get_hash_from_redis(self.carrier, 'rejected_sha1'), 'C')
+        self.assertFalse(is_feed_new(get_feed('C'), self.carrier))
+
+        rollback_gtfs(self.carrier)
+        self.assertLastRun(GtfsUpdateRun.ModeChoice.ROLLBACK)
+        self.assertEqual(self.get_live_data(), data_a)
@@ -0,0 +1,8 @@
+from django.urls import path
+
+from .views import *
+
+
+urlpatterns = [
+    path('gtfs/', GtfsUpdateMetricsView.as_view()),
+]
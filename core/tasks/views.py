@@ -0,0 +1,29 @@
+from rest_framework.views import APIView
+from rest_framework.serializers import ValidationError
+from rest_framework import status
+from django.http import JsonResponse
+
+from .models import *
+from .serializers import *
+
+
+class GtfsUpdateMetricsView(APIView):
+    def get(self, request):
+        params = GtfsMetricsQueryParamsSerializer(data=request.query_params)
+
+        if not params.is_valid():
+            raise ValidationError(params.errors)
+
+        carrier = params['carrier'].value
+        limit = params['limit'].value
+
+        runs = GtfsUpdateRun.objects.prefetch_related('stages').order_by('-started_at')
+
+        if carrier:
+            runs = runs.filter(carrier_code=carrier)
+
+        response = {
+            'runs': GtfsUpdateRunSerializer(runs[:limit], many=True).data
+        }
+
+        return JsonResponse(response, status=status.HTTP_200_OK)
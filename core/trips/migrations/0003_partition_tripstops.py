@@ -0,0 +1,54 @@
+from django.db import migrations
+
+
+TRIPSTOPS_COLUMNS = """
+    trip_id VARCHAR(64) NOT NULL,
+    direction_id INTEGER NOT NULL,
+    route_id VARCHAR(8) NOT NULL,
+    stop_ids VARCHAR(16)[] NOT NULL,
+    carrier_id BIGINT NOT NULL,
+    PRIMARY KEY (trip_id, carrier_id)
+"""
+
+
+def partition_tripstops(apps, schema_editor):
+    """
+    Partitioned tables cannot be UNLOGGED, so only the per-carrier partitions are.
+    The staging table is a scratch area and is not carried over.
+    """
+    Carrier = apps.get_model('common', 'Carrier')
+    carrier_ids = list(Carrier.objects.values_list('id', flat=True))
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('CREATE TEMP TABLE tripstops_backup AS SELECT * FROM "trips_TripStops";')
+        cursor.execute('DROP TABLE "trips_TripStops", "trips_TripStops_Staging";')
+
+        for table in ('trips_TripStops', 'trips_TripStops_Staging'):
+            cursor.execute(f'CREATE TABLE "{table}" ({TRIPSTOPS_COLUMNS}) PARTITION BY LIST (carrier_id);')
+            cursor.execute(f'CREATE INDEX {table.lower()}_route_id_idx ON "{table}" (route_id);')
+            cursor.execute(f'CREATE INDEX {table.lower()}_carrier_id_idx ON "{table}" (carrier_id);')
+
+            for carrier_id in carrier_ids:
+                cursor.execute(f'''
+                    CREATE UNLOGGED TABLE "{table}_{carrier_id}" PARTITION OF "{table}"
+                    (CONSTRAINT "{table}_{carrier_id}_check" CHECK (carrier_id = {carrier_id}))
+                    FOR VALUES IN ({carrier_id});
+                ''')
+
+        cursor.execute('''
+            INSERT INTO "trips_TripStops" (trip_id, direction_id, route_id, stop_ids, carrier_id)
+            SELECT trip_id, direction_id, route_id, stop_ids, carrier_id FROM tripstops_backup;
+        ''')
+        cursor.execute('DROP TABLE tripstops_backup;')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0002_partition_gtfs_tables'),
+        ('trips', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_tripstops),
+    ]
@@ -0,0 +1,165 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:50
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+TRIPPATTERNS_COLUMNS = """
+    pattern_id VARCHAR(32) NOT NULL,
+    stop_ids VARCHAR(16)[] NOT NULL,
+    stop_sequences INTEGER[] NOT NULL,
+    arrival_offsets INTEGER[] NOT NULL,
+    departure_offsets INTEGER[] NOT NULL,
+    pickup_types INTEGER[] NOT NULL,
+    drop_off_types INTEGER[] NOT NULL,
+    carrier_id BIGINT NOT NULL,
+    PRIMARY KEY (pattern_id, carrier_id)
+"""
+
+# TripStops._get_insert as of this migration
+TRIPSTOPS_INSERT = """
+    WITH trips AS (
+        SELECT
+            trip_id, direction_id, route_id, stop_ids, carrier_id, pattern_id, start_seconds,
+            stop_sequences, arrival_offsets, departure_offsets, pickup_types, drop_off_types
+        FROM (
+            SELECT
+                *,
+                md5(ROW(
+                    stop_ids, stop_sequences, arrival_offsets, departure_offsets, pickup_types, drop_off_types
+                )::text) AS pattern_id
+            FROM (
+                SELECT
+                    *,
+                    ARRAY(SELECT a - start_seconds FROM unnest(arrivals) WITH ORDINALITY u(a, i) ORDER BY i)
+                        AS arrival_offsets,
+                    ARRAY(SELECT d - start_seconds FROM unnest(departures) WITH ORDINALITY u(d, i) ORDER BY i)
+                        AS departure_offsets
+                FROM (
+                    SELECT
+                        s.trip_id,
+                        t.direction_id,
+                        t.route_id,
+                        array_agg(s.stop_id ORDER BY s.stop_sequence) AS stop_ids,
+                        t.carrier_id,
+                        min(s.arrival_seconds) AS start_seconds,
+                        array_agg(s.stop_sequence ORDER BY s.stop_sequence) AS stop_sequences,
+                        array_agg(s.arrival_seconds ORDER BY s.stop_sequence) AS arrivals,
+                        array_agg(s.departure_seconds ORDER BY s.stop_sequence) AS departures,
+                        array_agg(s.pickup_type ORDER BY s.stop_sequence) AS pickup_types,
+                        array_agg(s.drop_off_type ORDER BY s.stop_sequence) AS drop_off_types
+                    FROM "{stop_times_table}" s
+                    JOIN "{trips_table}" t USING (trip_id)
+                    GROUP BY t.route_id, s.trip_id, t.direction_id, t.carrier_id
+                ) trips
+            ) trips
+        ) trips
+    ),
+    patterns AS (
+        INSERT INTO "{patterns_table}" (
+            pattern_id, stop_ids, stop_sequences, arrival_offsets, departure_offsets,
+            pickup_types, drop_off_types, carrier_id
+        )
+        SELECT DISTINCT ON (pattern_id)
+            pattern_id, stop_ids, stop_sequences, arrival_offsets, departure_offsets,
+            pickup_types, drop_off_types, carrier_id
+        FROM trips
+        ON CONFLICT DO NOTHING
+    )
+    INSERT INTO "{trip_stops_table}" (trip_id, direction_id, route_id, stop_ids, carrier_id, pattern_id, start_seconds)
+    SELECT trip_id, direction_id, route_id, stop_ids, carrier_id, pattern_id, start_seconds FROM trips
+"""
+
+
+def create_trip_patterns(apps, schema_editor):
+    """
+    Patterns are partitioned like the TripStops (see migration 0003), with a partition for every TripStops partition.
+    Both the live and the staging TripStops are rebuilt with their patterns, the staging ones are kept for a rollback.
+    """
+    tables = (
+        ('trips_TripStops', 'trips_TripPatterns', 'common_StopTimes', 'common_Trips'),
+        ('trips_TripStops_Staging', 'trips_TripPatterns_Staging', 'common_StopTimes_Staging', 'common_Trips_Staging'),
+    )
+
+    with schema_editor.connection.cursor() as cursor:
+        for trip_stops_table, table, stop_times_table, trips_table in tables:
+            cursor.execute(f'CREATE TABLE "{table}" ({TRIPPATTERNS_COLUMNS}) PARTITION BY LIST (carrier_id);')
+            cursor.execute(f'''
+                SELECT DISTINCT t.carrier_id FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                CROSS JOIN LATERAL (
+                    SELECT substring(pg_get_expr(c.relpartbound, c.oid) FROM '\\d+')::bigint AS carrier_id
+                ) t
+                WHERE i.inhparent = '"{trip_stops_table}"'::regclass;
+            ''')
+
+            for carrier_id, in cursor.fetchall():
+                cursor.execute(f'''
+                    CREATE UNLOGGED TABLE "{table}_{carrier_id}" PARTITION OF "{table}"
+                    (CONSTRAINT "{table}_{carrier_id}_check" CHECK (carrier_id = {carrier_id}))
+                    FOR VALUES IN ({carrier_id});
+                ''')
+
+            cursor.execute(f'''
+                ALTER TABLE "{trip_stops_table}"
+                    ADD COLUMN pattern_id VARCHAR(32),
+                    ADD COLUMN start_seconds INTEGER;
+            ''')
+            cursor.execute(f'TRUNCATE "{trip_stops_table}";')
+
+            cursor.execute(TRIPSTOPS_INSERT.format(
+                stop_times_table=stop_times_table,
+                trips_table=trips_table,
+                patterns_table=table,
+                trip_stops_table=trip_stops_table,
+            ))
+
+            cursor.execute(f'''
+                ALTER TABLE "{trip_stops_table}"
+                    ALTER COLUMN pattern_id SET NOT NULL,
+                    ALTER COLUMN start_seconds SET NOT NULL;
+            ''')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0006_service_days'),
+        ('trips', '0003_partition_tripstops'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripPattern',
+            fields=[
+                ('pattern_id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('stop_ids', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=16), size=None)),
+                ('stop_sequences', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('arrival_offsets', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('departure_offsets', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('pickup_types', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(null=True), size=None)),
+                ('drop_off_types', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(null=True), size=None)),
+            ],
+            options={
+                'db_table': 'trips_TripPatterns',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='TripPatternStaging',
+            fields=[
+                ('pattern_id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('stop_ids', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=16), size=None)),
+                ('stop_sequences', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('arrival_offsets', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('departure_offsets', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('pickup_types', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(null=True), size=None)),
+                ('drop_off_types', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(null=True), size=None)),
+            ],
+            options={
+                'db_table': 'trips_TripPatterns_Staging',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_trip_patterns),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+
+TABLES = ('trips_TripStops', 'trips_TripStops_Staging', 'trips_TripPatterns', 'trips_TripPatterns_Staging')
+
+
+def make_trip_patterns_logged(apps, schema_editor):
+    """
+    TripStops and patterns are the only stored form of the stop times now, 
+    so their partitions are no longer UNLOGGED, which a crash would empty.
+    Stops are looked up in the stop_ids of the TripStops.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            cursor.execute(f'''
+                SELECT c.relname FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = '"{table}"'::regclass;
+            ''')
+
+            for partition, in cursor.fetchall():
+                cursor.execute(f'ALTER TABLE "{partition}" SET LOGGED;')
+
+        for table in TABLES[:2]:
+            cursor.execute(f'CREATE INDEX {table.lower()}_stop_ids_idx ON "{table}" USING gin (stop_ids);')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0004_trip_patterns'),
+    ]
+
+    operations = [
+        migrations.RunPython(make_trip_patterns_logged),
+    ]
@@ -1,48 +1,142 @@
+from typing import NamedTuple
+
 from django.contrib.postgres.fields import ArrayField
 from django.db import models
 from common.models import Carrier, CarrierStaging
+from common.services.gtfs import format_gtfs_seconds
 
 class AbstractTripStops(models.Model):
     """
-    UNLOGGED Table.
-    Defined by `_definition` below and created manually via SQL migration.
+    Defined by `_get_definition` below and created manually via SQL migration.
+    With the patterns, the stored form of the stop times: the pattern of a trip and the time it starts at.
     """
     trip_id = models.CharField(max_length=64, primary_key=True)
     direction_id = models.IntegerField()
     route_id = models.CharField(max_length=8)
     stop_ids = ArrayField(models.CharField(max_length=16))
+    pattern_id = models.CharField(max_length=32)
+    start_seconds = models.IntegerField()
+
+    # Filters of `_get_definition` are `column` or `column__lookup`, e.g. `s.trip_id__gte`
+    LOOKUP_OPERATORS = {'': '= %s', 'gte': '>= %s', 'lt': '< %s', 'in': '= ANY(%s)'}
+
+    COLUMNS = ('trip_id', 'direction_id', 'route_id', 'stop_ids', 'carrier_id', 'pattern_id', 'start_seconds')
+    PATTERN_COLUMNS = (
+        'pattern_id', 'stop_ids', 'stop_sequences', 'arrival_offsets', 'departure_offsets',
+        'pickup_types', 'drop_off_types', 'carrier_id'
+    )
+
+    @classmethod
+    def _get_where_clause(cls, **where_filters) -> tuple[str, list]:
+        if not where_filters:
+            return '', []
+
+        conditions = []
+        params = []
+        for key, value in where_filters.items():
+            column, _, lookup = key.partition('__')
+            conditions.append(f'{column} {cls.LOOKUP_OPERATORS[lookup]}')
+            params.append(value)
+
+        return f"WHERE {' AND '.join(conditions)}", params
 
     @classmethod
     def _get_definition(cls, 
-                        from_table='common_StopTimes', 
+                        from_table='common_StopTimes_Staging', 
                         join_table='common_Trips', 
                         **where_filters) -> tuple[str, list]:
+        """Stop times are only loaded into their staging table to be turned into TripStops and patterns"""
         from_clause = f'FROM "{from_table}" s'
         join_clause = f'JOIN "{join_table}" t USING (trip_id)'
-        where_clause = ''
-        params = list()
-        
-        if where_filters:
-            conditions = []
-            for key, value in where_filters.items():
-                conditions.append(f'{key} = %s')
-                params.append(value)
-            where_clause = f"WHERE {' AND '.join(conditions)}"
+        where_clause, params = cls._get_where_clause(**where_filters)
         
+        # The pattern of a trip is its stop times relative to its start, identified by their hash
         query = f"""
             SELECT
-                s.trip_id,
-                t.direction_id,
-                t.route_id,
-                array_agg(s.stop_id ORDER BY s.stop_sequence) AS stop_ids,
-                t.carrier_id
-            {from_clause}
-            {join_clause}
+                {', '.join(dict.fromkeys(cls.COLUMNS + cls.PATTERN_COLUMNS))}
+            FROM (
+                SELECT
+                    *,
+                    md5(ROW(
+                        stop_ids, stop_sequences, arrival_offsets, departure_offsets, pickup_types, drop_off_types
+                    )::text) AS pattern_id
+                FROM (
+                    SELECT
+                        *,
+                        ARRAY(SELECT a - start_seconds FROM unnest(arrivals) WITH ORDINALITY u(a, i) ORDER BY i)
+                            AS arrival_offsets,
+                        ARRAY(SELECT d - start_seconds FROM unnest(departures) WITH ORDINALITY u(d, i) ORDER BY i)
+                            AS departure_offsets
+                    FROM (
+                        SELECT
+                            s.trip_id,
+                            t.direction_id,
+                            t.route_id,
+                            array_agg(s.stop_id ORDER BY s.stop_sequence) AS stop_ids,
+                            t.carrier_id,
+                            min(s.arrival_seconds) AS start_seconds,
+                            array_agg(s.stop_sequence ORDER BY s.stop_sequence) AS stop_sequences,
+                            array_agg(s.arrival_seconds ORDER BY s.stop_sequence) AS arrivals,
+                            array_agg(s.departure_seconds ORDER BY s.stop_sequence) AS departures,
+                            array_agg(s.pickup_type ORDER BY s.stop_sequence) AS pickup_types,
+                            array_agg(s.drop_off_type ORDER BY s.stop_sequence) AS drop_off_types
+                        {from_clause}
+                        {join_clause}
+                        {where_clause}
+                        GROUP BY t.route_id, s.trip_id, t.direction_id, t.carrier_id
+                    ) trips
+                ) trips
+            ) trips
+        """
+        return query, params
+
+    @classmethod
+    def _get_carried_over_definition(cls,
+                                     from_table='trips_TripStops',
+                                     patterns_table='trips_TripPatterns',
+                                     join_table='common_Trips',
+                                     **where_filters) -> tuple[str, list]:
+        """
+        The same rows as `_get_definition` for trips whose stop times did not change: 
+        their patterns are taken over, their direction and route come from `join_table`.
+        """
+        where_clause, params = cls._get_where_clause(**where_filters)
+        columns = ', '.join(
+            f'{"t" if column in ("direction_id", "route_id") else "s"}.{column}' for column in cls.COLUMNS
+        )
+        pattern_columns = ', '.join(f'p.{column}' for column in cls.PATTERN_COLUMNS if column not in cls.COLUMNS)
+
+        query = f"""
+            SELECT {columns}, {pattern_columns}
+            FROM "{from_table}" s
+            JOIN "{join_table}" t ON t.trip_id = s.trip_id AND t.carrier_id = s.carrier_id
+            JOIN "{patterns_table}" p ON p.pattern_id = s.pattern_id AND p.carrier_id = s.carrier_id
             {where_clause}
-            GROUP BY t.route_id, s.trip_id, t.direction_id, t.carrier_id
         """
         return query, params
 
+    @classmethod
+    def _get_insert(cls,
+                    definition: tuple[str, list],
+                    trip_stops_table='trips_TripStops',
+                    patterns_table='trips_TripPatterns') -> tuple[str, list]:
+        """Inserts the TripStops of the definition and their patterns that are not there yet in one statement"""
+        query, params = definition
+        columns = ', '.join(cls.COLUMNS)
+        pattern_columns = ', '.join(cls.PATTERN_COLUMNS)
+
+        statement = f"""
+            WITH trips AS ({query}),
+            patterns AS (
+                INSERT INTO "{patterns_table}" ({pattern_columns})
+                SELECT DISTINCT ON (pattern_id) {pattern_columns} FROM trips
+                ON CONFLICT DO NOTHING
+            )
+            INSERT INTO "{trip_stops_table}" ({columns})
+            SELECT {columns} FROM trips
+        """
+        return statement, params
+
     class Meta:
         abstract = True
 
@@ -60,14 +154,88 @@ class TripStopsStaging(AbstractTripStops):
     _base_model = TripStops
 
     @classmethod
-    def _get_definition(cls, **where_filters) -> tuple[str, list]:
+    def _get_definition(cls, 
+                        from_table='common_StopTimes_Staging', 
+                        join_table='common_Trips_Staging', 
+                        **where_filters) -> tuple[str, list]:
         query, params = super()._get_definition(
-            from_table='common_StopTimes_Staging',
-            join_table='common_Trips_Staging',
+            from_table=from_table,
+            join_table=join_table,
             **where_filters
         )
         return query, params
 
+    @classmethod
+    def _get_insert(cls,
+                    definition: tuple[str, list],
+                    trip_stops_table='trips_TripStops_Staging',
+                    patterns_table='trips_TripPatterns_Staging') -> tuple[str, list]:
+        return super()._get_insert(definition, trip_stops_table=trip_stops_table, patterns_table=patterns_table)
+
     class Meta:
         db_table = 'trips_TripStops_Staging'
-        managed = False
\ No newline at end of file
+        managed = False
+
+
+class PatternStopTime(NamedTuple):
+    """A stop time of a trip read from its pattern, with the attributes of a stop time the views use"""
+    trip_id: str
+    stop_id: str
+    stop_sequence: int
+    arrival_seconds: int
+    departure_seconds: int
+    pickup_type: int | None
+    drop_off_type: int | None
+
+    @property
+    def arrival_time(self) -> str:
+        return format_gtfs_seconds(self.arrival_seconds)
+
+    @property
+    def departure_time(self) -> str:
+        return format_gtfs_seconds(self.departure_seconds)
+
+
+class AbstractTripPattern(models.Model):
+    """
+    Filled together with TripStops by `_get_insert`.
+    Stop times shared by the trips that differ only by their start, as offsets from the start.
+    """
+    pattern_id = models.CharField(max_length=32, primary_key=True)
+    stop_ids = ArrayField(models.CharField(max_length=16))
+    stop_sequences = ArrayField(models.IntegerField())
+    arrival_offsets = ArrayField(models.IntegerField())
+    departure_offsets = ArrayField(models.IntegerField())
+    pickup_types = ArrayField(models.IntegerField(null=True))
+    drop_off_types = ArrayField(models.IntegerField(null=True))
+
+    def get_stop_times(self, trip_id: str, start_seconds: int) -> list[PatternStopTime]:
+        return [
+            PatternStopTime(trip_id, stop_id, stop_sequence, start_seconds + arrival, start_seconds + departure,
+                            pickup_type, drop_off_type)
+            for stop_id, stop_sequence, arrival, departure, pickup_type, drop_off_type in zip(
+                self.stop_ids, self.stop_sequences, self.arrival_offsets, self.departure_offsets,
+                self.pickup_types, self.drop_off_types
+            )
+        ]
+
+    class Meta:
+        abstract = True
+
+
+class TripPattern(AbstractTripPattern):
+    carrier = models.ForeignKey(Carrier, on_delete=models.CASCADE)
+
+    class Meta:
+        db_table = 'trips_TripPatterns'
+        managed = False
+
+
+class TripPatternStaging(AbstractTripPattern):
+    carrier = models.ForeignKey(CarrierStaging, on_delete=models.CASCADE)
+    _base_model = TripPattern
+
+    class Meta:
+        db_table = 'trips_TripPatterns_Staging'
+        managed = False
+
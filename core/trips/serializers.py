@@ -168,8 +168,16 @@ class TripDetailsSerializer(BaseTripSerializer, serializers.ModelSerializer):
     stops = serializers.SerializerMethodField()
 
     def get_stops(self, obj:Trip):
-        stop_time_objs = StopTime.objects.filter(trip_id=obj.trip_id)
-        stops = StopTimeSerializer(stop_time_objs, many=True).data
+        trip_stops = TripStops.objects.filter(trip_id=obj.trip_id, carrier_id=obj.carrier_id).first()
+
+        if trip_stops is None:
+            return []
+
+        stop_times = get_trip_stop_times(trip_stops)
+        stop_objs = Stop.objects \
+            .filter(stop_id__in=trip_stops.stop_ids, carrier_id=obj.carrier_id) \
+            .in_bulk(field_name='stop_id')
+        stops = StopTimeSerializer(stop_times, many=True, context={'stops': stop_objs}).data
         return stops
     
     class Meta(BaseTripSerializer.Meta):
@@ -1,3 +1,5 @@
+from typing import Collection, Iterable, Iterator
+
 from django.db.models import QuerySet
 
 from common.models import *
@@ -10,3 +12,42 @@ def get_stops_for_trip_stops(obj:TripStops) -> QuerySet[Stop]:
     stops_dict = {stop.stop_id: stop for stop in stops}
     ordered_stops = [stops_dict[sid] for sid in stop_ids if sid in stops_dict]
     return ordered_stops
+
+
+def get_trip_stop_times(trip_stops: TripStops) -> list[PatternStopTime]:
+    """Stop times of the trip in the order of the stop sequence, rebuilt from its pattern"""
+    pattern = TripPattern.objects.get(pattern_id=trip_stops.pattern_id, carrier_id=trip_stops.carrier_id)
+    return pattern.get_stop_times(trip_stops.trip_id, trip_stops.start_seconds)
+
+
+def get_trip_patterns(trip_stops: Iterable[TripStops]) -> dict[str, TripPattern]:
+    """
+    Patterns of the trips in one query. The pattern_id is the hash of the pattern,
+    so a pattern shared by carriers is the same pattern.
+    """
+    pattern_ids = {obj.pattern_id for obj in trip_stops}
+    carrier_ids = {obj.carrier_id for obj in trip_stops}
+    patterns = TripPattern.objects.filter(pattern_id__in=pattern_ids, carrier_id__in=carrier_ids)
+    return {pattern.pattern_id: pattern for pattern in patterns}
+
+
+def get_stop_times(trip_stops: Iterable[TripStops], stop_ids: Collection[str] | None = None) -> Iterator[PatternStopTime]:
+    """Stop times of the trips rebuilt from their patterns, only the ones at `stop_ids` if given"""
+    trip_stops = list(trip_stops)
+    patterns = get_trip_patterns(trip_stops)
+
+    for obj in trip_stops:
+        for stop_time in patterns[obj.pattern_id].get_stop_times(obj.trip_id, obj.start_seconds):
+            if stop_ids is None or stop_time.stop_id in stop_ids:
+                yield stop_time
+
+
+def get_trip_times(trip_stops: Iterable[TripStops]) -> dict[str, tuple[int, int]]:
+    """The first arrival and the last departure of every trip, in seconds of its service day"""
+    trip_stops = list(trip_stops)
+    patterns = get_trip_patterns(trip_stops)
+
+    return {
+        obj.trip_id: (obj.start_seconds, obj.start_seconds + max(patterns[obj.pattern_id].departure_offsets))
+        for obj in trip_stops
+    }
@@ -1,13 +1,16 @@
 from datetime import datetime
 from typing import NamedTuple
 
-from django.db.models import QuerySet
+import numpy as np
+
 from django.utils import timezone as tz
 
 from common.collections import NestedDict
 from common.models import *
 from common.services.gtfs import *
-from trips.models import TripStops
+from common.services.distance import *
+from trips.models import TripStops, PatternStopTime
+from .models import get_trip_stop_times
 from tasks.services.gtfs.models import add_carrier_prefix
 from routes.services.views import LocationPoint, calculate_simple_distance
 
@@ -66,12 +69,13 @@ def transform_rt_vehicle_data(carrier:str, data: dict) -> dict:
 
         def get_data_for_trip(
             trip_id: str
-        ) -> tuple[Trip, QuerySet[StopTime], list[StopNT], list[ShapeSequenceNT]]:
+        ) -> tuple[Trip, list[PatternStopTime], list[StopNT], list[ShapeSequenceNT]]:
             
             trip = Trip.objects.get(trip_id=trip_id)
-            stop_times = StopTime.objects.filter(trip_id=trip_id)
+            trip_stops = TripStops.objects.get(trip_id=trip_id)
+            stop_times = get_trip_stop_times(trip_stops)
 
-            stop_ids = TripStops.objects.get(trip_id=trip_id).stop_ids
+            stop_ids = trip_stops.stop_ids
             stops_locs = list(Stop.objects
                 .filter(stop_id__in=stop_ids)
                 .values_list('stop_id', 'stop_lat', 'stop_lon', named=True))
@@ -85,23 +89,22 @@ def transform_rt_vehicle_data(carrier:str, data: dict) -> dict:
         
         def get_nearest_shape_p_nr(self_loc: LocationPoint, shape_seq: list[ShapeSequenceNT]) -> int:            
             shape_seq_locs = [(sh.shape_pt_lat, sh.shape_pt_lon) for sh in shape_seq]
-            distances = [calculate_simple_distance([self_loc, loc], unit='m') for loc in shape_seq_locs]            
-            nearest_idx = min(range(len(distances)), key=lambda x: distances[x])
+            distances = get_distances(self_loc, shape_seq_locs)
+            nearest_idx = int(np.argmin(distances))
             
             return nearest_idx
         
         def find_next_stop_and_its_nearest_point(shape_seq: list[ShapeSequenceNT], stops_locs: list[StopNT]):            
-            for i, sh in enumerate(shape_seq):
-                sh_loc = (sh.shape_pt_lat, sh.shape_pt_lon)
-                
-                for s in stops_locs:
-                    stop_loc = (s.stop_lat, s.stop_lon)
-                    distance = calculate_simple_distance([sh_loc, stop_loc], unit='m')
-                    
-                    if distance <= 25:
-                        return s, i
-            
-            raise ValueError("No next stop found in 25m of shape sequence")
+            shape_seq_locs = [(sh.shape_pt_lat, sh.shape_pt_lon) for sh in shape_seq]
+            stop_locs = [(s.stop_lat, s.stop_lon) for s in stops_locs]
+            # Rows are shape points, columns are stops
+            is_near = get_distance_matrix(shape_seq_locs, stop_locs) <= 25
+
+            if not is_near.any():
+                raise ValueError("No next stop found in 25m of shape sequence")
+
+            i = int(is_near.any(axis=1).argmax())
+            return stops_locs[int(is_near[i].argmax())], i
         
         if not ensure_vehicle_has_started(trip_id):
             return None
@@ -111,8 +114,8 @@ def transform_rt_vehicle_data(carrier:str, data: dict) -> dict:
         shape_sequence = shape_sequence[nearest_shape_point:]
         
         next_stop, its_nearest_point = find_next_stop_and_its_nearest_point(shape_sequence, stops_location)
-        next_stop_sequence_nr = stop_times.get(stop_id=next_stop.stop_id).stop_sequence
-        stop_times = stop_times.filter(stop_sequence__gte=next_stop_sequence_nr)
+        next_stop_idx = next(i for i, st in enumerate(stop_times) if st.stop_id == next_stop.stop_id)
+        stop_times = stop_times[next_stop_idx:]
         shape_sequence = shape_sequence[its_nearest_point:]
         
         next_stop_loc = (next_stop.stop_lat, next_stop.stop_lon)
@@ -123,11 +126,11 @@ def transform_rt_vehicle_data(carrier:str, data: dict) -> dict:
         delta = tz.timedelta(minutes=minutes_to_next_stop)
         
         stop_time_updates = list()
-        for stop_time in stop_times.iterator():
-            arrival_time = parse_gtfs_time(stop_time.arrival_time) + delta
+        for stop_time in stop_times:
+            arrival_time = tz.timedelta(seconds=stop_time.arrival_seconds) + delta
             new_time = timedelta_to_str(arrival_time)
             stop_time_updates.append({
-                "stop_id": stop_time.stop.stop_id,
+                "stop_id": stop_time.stop_id,
                 "new_time": new_time
             })            
         return stop_time_updates